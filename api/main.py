@@ -1,30 +1,54 @@
+from contextlib import asynccontextmanager
 from datetime import datetime
 from logging import Logger
 import os
+import random
 import socket
-from typing import Annotated, Dict, List, Any
+from typing import Annotated, AsyncIterator, Dict, List, Any, Literal
 import uvicorn
-from fastapi import FastAPI, HTTPException, Query, status, Response, Request
+from fastapi import Depends, FastAPI, HTTPException, Query, status, Response, Request
+from fastapi.responses import PlainTextResponse
+from starlette.concurrency import run_in_threadpool
 from services.color_matcher_with_publisher import ColorMatcherWithPublisher
-from services.color_matcher import ColorMatcher, ColorMatcherProtocol
+from services.color_matcher import ColorMatcher, ColorMatcherABC, ColorMatcherProtocol
+from services.color_matcher_in_thread_pool import ColorMatcherInThreadPool
 from services.color_matcher_with_delay import ColorMatcherWithDelay
+from services.color_matcher_with_cache import ColorMatcherWithCache
+from services.palette_registry import Palette, PaletteRegistry, UnknownPaletteError
+from services.response_encoder import ResponseEncoder
 from services.api_schemas import (
-    MatchColorRequest, ColorMatched, ColorListResponse, ColorNamesResponse
+    MatchColorRequest, RandomColorRequest, ColorMatched, ColorListResponse, ColorNamesResponse,
+    BatchMatchRequest, BatchMatchResponse, SuggestColorRequest,
+    ColorSuggestResponse, PaletteInfo, PaletteListResponse
 )
 from logger_factory import get_logger, min_log_level, log_config
+from metrics import REGISTRY, PROMETHEUS_CONTENT_TYPE, RequestMetricsMiddleware
+from profiler import Profiler, ProfilerBusyError
 
 
 _boot_time = datetime.now()
 _host_name = socket.gethostname()  # pylint: disable=R0801
 
 
+@asynccontextmanager
+async def lifespan(_: FastAPI) -> AsyncIterator[None]:
+    ColorMatcher.load()  # map the palette snapshots before the first request, not during it
+    PaletteRegistry.start()
+    ColorMatcherWithPublisher.startup()
+    yield
+    await PaletteRegistry.stop()
+    await ColorMatcherWithPublisher.cleanup()  # runs once uvicorn starts shutting down
+
+
 app = FastAPI(
     title="Color API App",
     description=(
         "API app that takes http requests and publishes to a Redis list."
     ),
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
+app.add_middleware(RequestMetricsMiddleware, prefix="color_api")
 
 def log() -> Logger:
     if not hasattr(app, "logger"):
@@ -40,37 +64,184 @@ async def health_check() -> Dict[str, Any]:
         "name": "color api 🎨",
         "host": _host_name,
         "boot": _boot_time,
-        "alive": str(current_time - _boot_time)
+        "alive": str(current_time - _boot_time),
+        "cache": ColorMatcherWithCache.stats(),
+        "publisher": ColorMatcherWithPublisher.stats(),
+        "queue": ColorMatcherWithPublisher.queue_stats()
     }
     log().debug("Health check: OK for %s", _host_name)
     return resp
 
 
-def _resolve_color_matcher(req: Request) -> ColorMatcherProtocol:
+@app.get("/color/metrics", response_class=PlainTextResponse)
+async def metrics() -> PlainTextResponse:
+    return PlainTextResponse(REGISTRY.render(), media_type=PROMETHEUS_CONTENT_TYPE)
+
+
+async def _admit() -> None:
+    # turns publishing requests away while the worker queue is above the reject watermark
+    admission = ColorMatcherWithPublisher.admission()
+    if not admission.admit():
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Color match queue is full, please retry later.",
+            headers={"Retry-After": str(admission.retry_after_s)})
+
+
+def _palette(palette: str | None) -> Palette:
+    try:
+        return PaletteRegistry.get(palette)
+    except UnknownPaletteError as e:
+        raise HTTPException(status_code=404, detail=f"Unknown palette: {palette}") from e
+
+
+def _color_matcher(palette: str | None) -> ColorMatcher:
+    try:
+        return ColorMatcher(palette)
+    except UnknownPaletteError as e:
+        raise HTTPException(status_code=404, detail=f"Unknown palette: {palette}") from e
+
+
+def _resolve_color_matcher(req: Request, palette: str | None = None) -> ColorMatcherProtocol:
+    matcher = _color_matcher(palette)
+    # a large palette is searched on the thread pool, only cache misses pay for the hop
+    core: ColorMatcherABC = ColorMatcherInThreadPool(matcher.sync) if matcher.blocking else matcher
     return ColorMatcherWithDelay(
-        ColorMatcherWithPublisher(ColorMatcher(), req)
-    )  # decorator pattern
+        ColorMatcherWithPublisher(ColorMatcherWithCache(core, matcher.palette.key), req)
+    )  # decorator pattern, publishing sits outside the cache so hits are still published
 
 
-@app.get("/color/match", response_model=ColorListResponse)
+@app.get("/color/match", response_model=ColorListResponse, dependencies=[Depends(_admit)])
 async def match_color(
-    query: Annotated[MatchColorRequest, Query()], request: Request, response: Response
-) -> ColorListResponse:
+    query: Annotated[MatchColorRequest, Query()], request: Request
+) -> Response:
     if not query.name.strip():
         raise HTTPException(status_code=400, detail="The 'name' field cannot be empty.")
 
-    matcher: ColorMatcherProtocol = _resolve_color_matcher(request)
-    results: List[ColorMatched] = matcher.match(query.name)
-    if results is None or len(results) == 0:
-        response.status_code = status.HTTP_404_NOT_FOUND
-    return ColorListResponse(inquery=query, count=len(results), matches=results)
+    palette = _palette(query.palette)
+    matcher: ColorMatcherProtocol = _resolve_color_matcher(request, palette.name)
+    results: List[ColorMatched] = await matcher.match(query.name, query.k)
+    # the matcher still runs (& publishes) on a revalidation, a 304 only saves the body
+    return ResponseEncoder.respond(
+        request, ResponseEncoder.color_list(palette.color_json, query, results), "no-cache",
+        status_code=status.HTTP_200_OK if len(results) > 0 else status.HTTP_404_NOT_FOUND)
+
+
+@app.post(
+    "/color/match/batch", response_model=BatchMatchResponse, dependencies=[Depends(_admit)])
+async def match_color_batch(body: BatchMatchRequest, request: Request) -> Response:
+    if any(not name.strip() for name in body.names):
+        raise HTTPException(status_code=400, detail="The 'names' items cannot be empty.")
+
+    palette = _palette(body.palette)
+    matcher: ColorMatcherProtocol = _resolve_color_matcher(request, palette.name)
+    batch: List[List[ColorMatched]] = await matcher.match_batch(body.names, body.k)
+    return ResponseEncoder.respond(
+        request, ResponseEncoder.batch(palette.color_json, body.names, batch), "no-cache")
+
+
+@app.get("/color/nearest", response_model=ColorListResponse, dependencies=[Depends(_admit)])
+async def nearest_color(
+    query: Annotated[RandomColorRequest, Query()], request: Request
+) -> Response:
+    # omitted channels are randomized, an empty query returns the neighbours of a random color
+    is_random = query.r is None or query.g is None or query.b is None
+    query = RandomColorRequest(
+        r=random.randint(0, 255) if query.r is None else query.r,
+        g=random.randint(0, 255) if query.g is None else query.g,
+        b=random.randint(0, 255) if query.b is None else query.b,
+        k=query.k,
+        palette=query.palette)
+    palette = _palette(query.palette)
+    matcher: ColorMatcherProtocol = _resolve_color_matcher(request, palette.name)
+    results: List[ColorMatched] = await matcher.nearest(
+        (query.r, query.g, query.b), query.k)  # type: ignore
+    return ResponseEncoder.respond(
+        request, ResponseEncoder.color_list(palette.color_json, query, results),
+        "no-store" if is_random else "no-cache")
 
 
 @app.get("/color/names", response_model=ColorNamesResponse)
-async def list_names(request: Request) -> ColorNamesResponse:
-    matcher: ColorMatcherProtocol = _resolve_color_matcher(request)
-    names = matcher.names()
-    return ColorNamesResponse(count=len(names), names=names)
+async def list_names(
+    request: Request, palette: Annotated[str | None, Query(max_length=64)] = None
+) -> Response:
+    # the body is encoded once per palette version, so is its ETag
+    selected = _palette(palette)
+    cache_control = f"public, max-age={ResponseEncoder.names_max_age_s}"
+    if ResponseEncoder.not_modified(request, selected.names_etag):
+        return Response(
+            status_code=status.HTTP_304_NOT_MODIFIED,
+            headers={"ETag": selected.names_etag, "Cache-Control": cache_control})
+    await _resolve_color_matcher(request, selected.name).names()  # the artificial delay
+    return ResponseEncoder.respond(
+        request, selected.names_json, cache_control, selected.names_etag)
+
+
+@app.get("/color/suggest", response_model=ColorSuggestResponse)
+async def suggest_color(query: Annotated[SuggestColorRequest, Query()]) -> ColorSuggestResponse:
+    # ranked "did you mean" names, not a match: nothing is published, no artificial delay
+    matcher = _color_matcher(query.palette)
+    if matcher.blocking:
+        suggestions = await run_in_threadpool(matcher.suggest, query.name, query.limit)
+    else:
+        suggestions = matcher.suggest(query.name, query.limit)
+    return ColorSuggestResponse(inquery=query, count=len(suggestions), suggestions=suggestions)
+
+
+def _palette_list(reloaded: List[str]) -> PaletteListResponse:
+    palettes = [PaletteInfo(**p) for p in PaletteRegistry.describe()]
+    return PaletteListResponse(
+        default=PaletteRegistry.default_name, count=len(palettes), palettes=palettes,
+        reloaded=reloaded)
+
+
+@app.get("/color/palettes", response_model=PaletteListResponse)
+async def list_palettes() -> PaletteListResponse:
+    return _palette_list([])
+
+
+@app.post("/color/palettes/reload", response_model=PaletteListResponse)
+async def reload_palettes() -> PaletteListResponse:
+    # rebuilds new & changed palette files on the thread pool, requests keep being served with
+    # the previous versions until each new one is swapped in. Only reloads this process
+    reloaded = await run_in_threadpool(PaletteRegistry.refresh)
+    return _palette_list(reloaded)
+
+
+def _profiling() -> None:
+    # the debug endpoints only answer with DEBUG_PROFILER set, they cost nothing otherwise
+    if not Profiler.enabled:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not Found")
+
+
+ProfileSecondsQuery = Annotated[
+    float, Query(gt=0, le=Profiler.max_seconds, description="Window, in seconds")]
+ProfileIntervalQuery = Annotated[
+    float, Query(ge=1, le=1_000, description="Time between samples, in ms")]
+
+
+@app.get(
+    "/color/debug/profile", response_class=PlainTextResponse, include_in_schema=False,
+    dependencies=[Depends(_profiling)])
+async def debug_profile(
+    seconds: ProfileSecondsQuery = 10, interval_ms: ProfileIntervalQuery = 10,
+    mode: Literal["loop", "threads", "tasks"] = "loop"
+) -> PlainTextResponse:
+    # collapsed stacks of this process only, for flamegraph.pl or speedscope. loop: what the
+    # event loop runs, threads: every thread, tasks: where each asyncio task is suspended
+    try:
+        stacks = await Profiler.profile(seconds, interval_ms, mode)
+    except ProfilerBusyError as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e)) from e
+    return PlainTextResponse(stacks)
+
+
+@app.get("/color/debug/loop-lag", include_in_schema=False, dependencies=[Depends(_profiling)])
+async def debug_loop_lag(
+    seconds: ProfileSecondsQuery = 5, interval_ms: ProfileIntervalQuery = 10
+) -> Dict[str, Any]:
+    # how late timers fire on the event loop, i.e. how long callbacks hold it
+    return await Profiler.loop_lag(seconds, interval_ms)
 
 
 def main() -> None:
@@ -80,14 +251,18 @@ def main() -> None:
         kargs = {
             "host": host,
             "port": int(port),
-            "log_level": min_log_level()
+            "log_level": min_log_level(),
+            "log_config": log_config(),
         }
-        fmt = log_config()
-        if fmt is not None:
-            kargs["log_config"] = fmt
+        # compile the palette snapshots once, every worker process then maps the same files
+        ColorMatcher.load()
+        workers = int(os.getenv("API_WORKERS", "1")) or 1
 
         # this is a blocking call and will only continue if the server is shutdown
-        uvicorn.run(app, **kargs)  # type: ignore
+        if workers > 1:  # uvicorn spawns the workers, they import the app by name
+            uvicorn.run("main:app", workers=workers, **kargs)  # type: ignore
+        else:
+            uvicorn.run(app, **kargs)  # type: ignore
     except Exception as e:  # pylint: disable=broad-except
         log().error("API server failed to start: %s", e)
         raise e
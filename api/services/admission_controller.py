@@ -0,0 +1,112 @@
+import asyncio
+import os
+import random
+import time
+from typing import Any, Dict
+from redis.asyncio import StrictRedis as Redis
+from logger_factory import get_logger
+from metrics import REGISTRY
+from shared_schemas import COLOR_STREAM_GROUP
+
+
+class AdmissionController:  # pylint: disable=too-many-instance-attributes
+    # samples the worker queue depth in the background, requests only read the last sample
+    logger = get_logger(__name__)
+    sample_interval_s: float = float(os.getenv("API_QUEUE_SAMPLE_INTERVAL_S", "1"))
+    sample_watermark: int = int(os.getenv("API_QUEUE_SAMPLE_WATERMARK", "0"))  # 0 disables
+    reject_watermark: int = int(os.getenv("API_QUEUE_REJECT_WATERMARK", "0"))  # 0 disables
+    sample_rate: float = float(os.getenv("API_QUEUE_SAMPLE_RATE", "0.1"))
+    retry_after_s: int = int(os.getenv("API_QUEUE_RETRY_AFTER_S", "5"))
+    FULL = "full"
+    SAMPLED = "sampled"
+    REJECT = "reject"
+
+    def __init__(self, redis: Redis, queue_name: str, transport: str):
+        self._redis = redis
+        self.queue_name = queue_name
+        self.transport = transport
+        self.mode = self.FULL
+        self.depth = -1  # unknown until the first sample
+        self._sampled_at = 0.0
+        self._task: asyncio.Task | None = None
+        self._shed = 0
+        self._rejected = 0
+        self.can_control = self.sample_watermark > 0 or self.reject_watermark > 0
+        REGISTRY.gauge(
+            "color_api_queue_depth", "Last sampled worker queue depth, -1 when not sampled"
+        ).set_function(lambda: self.depth)
+        REGISTRY.gauge(
+            "color_api_admission_mode", "Admission mode: 0 full, 1 sampled, 2 reject"
+        ).set_function(lambda: (self.FULL, self.SAMPLED, self.REJECT).index(self.mode))
+
+    def start(self) -> None:
+        if self._task is None and self.can_control:
+            self._task = asyncio.create_task(self._sample_loop())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _depth(self) -> int:
+        if self.transport == "stream":
+            # backlog of the worker group: not yet delivered + delivered but not acked
+            try:
+                for group in await self._redis.xinfo_groups(self.queue_name):
+                    name = group.get("name")
+                    if (name.decode() if isinstance(name, bytes) else name) == COLOR_STREAM_GROUP:
+                        return int(group.get("lag") or 0) + int(group.get("pending") or 0)
+            except Exception:  # pylint: disable=broad-except
+                pass  # stream or group not created yet
+            return int(await self._redis.xlen(self.queue_name))
+        return int(await self._redis.llen(self.queue_name))  # type: ignore[misc]
+
+    def _mode_for(self, depth: int) -> str:
+        if 0 < self.reject_watermark <= depth:
+            return self.REJECT
+        if 0 < self.sample_watermark <= depth:
+            return self.SAMPLED
+        return self.FULL
+
+    async def _sample_loop(self) -> None:
+        while True:
+            try:
+                self.depth = await self._depth()
+                self._sampled_at = time.time()
+                mode = self._mode_for(self.depth)
+                if mode != self.mode:
+                    self.logger.warning(
+                        "Queue depth %d, admission mode %s -> %s", self.depth, self.mode, mode)
+                    self.mode = mode
+            except Exception as e:  # pylint: disable=broad-except
+                self.logger.error("Failed to sample queue depth: %s", e)
+            await asyncio.sleep(self.sample_interval_s)
+
+    def admit(self) -> bool:
+        # False means the request should be turned away with a 429
+        if self._task is None:
+            self.start()  # lazy start, e.g. when the app runs without lifespan events
+        if self.mode == self.REJECT:
+            self._rejected += 1
+            return False
+        return True
+
+    def should_publish(self) -> bool:
+        if self.mode == self.FULL:
+            return True
+        if self.mode == self.SAMPLED and random.random() < self.sample_rate:
+            return True
+        self._shed += 1
+        return False
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "mode": self.mode,
+            "depth": self.depth,
+            "sampled_at": self._sampled_at,
+            "sample_watermark": self.sample_watermark,
+            "reject_watermark": self.reject_watermark,
+            "sample_rate": self.sample_rate,
+            "shed": self._shed,
+            "rejected": self._rejected,
+        }
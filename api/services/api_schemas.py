@@ -1,15 +1,33 @@
-from typing import List, Optional
+import os
+from typing import Annotated, List, Optional
 from pydantic import BaseModel, Field
 from shared_schemas import ColorMatched
 
+MAX_NEAREST_COLORS: int = 32
+MAX_BATCH_SIZE: int = int(os.getenv("API_BATCH_MAX_SIZE", "256"))
+MAX_SUGGESTIONS: int = 20
+
+
 class MatchColorRequest(BaseModel):
     name: str = Field(
-        ..., min_length=3, max_length=32, description="Provide a color name or hex code")
+        ..., min_length=3, max_length=32, description="Provide a color name, hex code or r,g,b")
+    k: int = Field(
+        1, ge=1, le=MAX_NEAREST_COLORS,
+        description="Nearest palette colors to return for a hex or r,g,b value not in the palette")
+    palette: Optional[str] = Field(
+        None, max_length=64, description="Palette name, the default one if omitted")
 
 class RandomColorRequest(BaseModel):
-    r: Optional[int] = Field(..., ge=0, le=255, description="Optional Red value")
-    g: Optional[int] = Field(..., ge=0, le=255, description="Optional Green value")
-    b: Optional[int] = Field(..., ge=0, le=255, description="Optional Blue value")
+    r: Optional[int] = Field(
+        None, ge=0, le=255, description="Optional Red value, random if omitted")
+    g: Optional[int] = Field(
+        None, ge=0, le=255, description="Optional Green value, random if omitted")
+    b: Optional[int] = Field(
+        None, ge=0, le=255, description="Optional Blue value, random if omitted")
+    k: int = Field(
+        1, ge=1, le=MAX_NEAREST_COLORS, description="Number of nearest palette colors to return")
+    palette: Optional[str] = Field(
+        None, max_length=64, description="Palette name, the default one if omitted")
 
 class ColorListResponse(BaseModel):
     inquery: MatchColorRequest | RandomColorRequest
@@ -19,3 +37,56 @@ class ColorListResponse(BaseModel):
 class ColorNamesResponse(BaseModel):
     count: int = 0
     names: List[str]
+
+class BatchMatchRequest(BaseModel):
+    names: List[Annotated[str, Field(min_length=3, max_length=32)]] = Field(
+        ..., min_length=1, max_length=MAX_BATCH_SIZE,
+        description="Color names, hex codes or r,g,b values to match")
+    k: int = Field(
+        1, ge=1, le=MAX_NEAREST_COLORS,
+        description="Nearest palette colors to return for a hex or r,g,b value not in the palette")
+    palette: Optional[str] = Field(
+        None, max_length=64, description="Palette name, the default one if omitted")
+
+class BatchMatchResult(BaseModel):
+    input: str
+    status: int = Field(..., description="HTTP status of this item: 200 or 404")
+    count: int = 0
+    matches: List[ColorMatched]
+
+class BatchMatchResponse(BaseModel):
+    count: int = 0
+    found: int = 0
+    results: List[BatchMatchResult]
+
+class SuggestColorRequest(BaseModel):
+    name: str = Field(
+        ..., min_length=3, max_length=32, description="Provide a (misspelled) color name")
+    limit: int = Field(
+        5, ge=1, le=MAX_SUGGESTIONS, description="Maximum number of suggestions to return")
+    palette: Optional[str] = Field(
+        None, max_length=64, description="Palette name, the default one if omitted")
+
+class ColorSuggestion(BaseModel):
+    name: str
+    distance: int = Field(..., description="Edit distance between the input and this name")
+    score: float = Field(..., description="Similarity from 0 to 1, 1 is an exact match")
+
+class ColorSuggestResponse(BaseModel):
+    inquery: SuggestColorRequest
+    count: int = 0
+    suggestions: List[ColorSuggestion]
+
+class PaletteInfo(BaseModel):
+    name: str
+    version: str = Field(..., description="Short sha256 of the palette file")
+    families: int
+    colors: int
+    loaded_at: float = Field(..., description="Unix time the palette was (re)loaded")
+
+class PaletteListResponse(BaseModel):
+    default: str
+    count: int = 0
+    palettes: List[PaletteInfo]
+    reloaded: List[str] = Field(
+        default_factory=list, description="Palettes (re)built by this call")
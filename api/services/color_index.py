@@ -0,0 +1,279 @@
+from array import array
+import hashlib
+import json
+import mmap
+import os
+import re
+import struct
+import sys
+from typing import Any, Callable, Dict, List, Sequence, Tuple
+import zlib
+import numpy as np
+from services.color_space import rgb_to_lab
+from logger_factory import get_logger
+
+
+# snapshot layout: header, a table of section offsets, then the sections, each 8 byte aligned.
+# Everything is little endian & read in place, nothing is parsed or copied at load time.
+# magic, version, section count, rows, families, sha256 of the source JSON
+_HEADER = struct.Struct("<4sHHII32s")
+_SECTIONS: Tuple[Tuple[str, str], ...] = (
+    ("rgb", "<f8"),            # (rows, 3) palette colors, nearest search in rgb space
+    ("lab", "<f8"),            # (rows, 3) same colors in CIELAB
+    ("row_keys", "<u4"),       # (rows,) 0xRRGGBB
+    ("row_name_off", "<u4"),   # (rows + 1,) offsets into row_names
+    ("row_names", "u1"),       # utf-8 blob, "blue5"
+    ("hex_table", "<u4"),      # open addressing hash table of row + 1, 0 is an empty slot
+    ("fam_name_off", "<u4"),   # (families + 1,) offsets into fam_names
+    ("fam_names", "u1"),       # utf-8 blob, "blue", in source order
+    ("fam_table", "<u4"),      # open addressing hash table of family + 1
+    ("fam_start", "<u4"),      # (families,) first fam_hex entry
+    ("fam_len", "<u4"),        # (families,) number of fam_hex entries
+    ("fam_list", "u1"),        # (families,) 1 when the source value is a list of shades
+    ("fam_hex", "S7"),         # "#rrggbb" of every shade, family after family
+)
+_re_hex = re.compile(r"^#[0-9a-f]{6}$")
+
+
+def _hex_slot(key: int, mask: int) -> int:
+    return ((key * 2654435761) >> 16) & mask  # Knuth multiplicative hash, middle bits
+
+
+def _name_slot(key: bytes, mask: int) -> int:
+    return zlib.crc32(key) & mask  # stable across processes, unlike hash()
+
+
+def _strings(values: Sequence[str]) -> Tuple[np.ndarray, np.ndarray]:
+    encoded = [v.encode("utf-8") for v in values]
+    offsets = np.zeros(len(encoded) + 1, dtype="<u4")
+    offsets[1:] = np.cumsum([len(e) for e in encoded], dtype=np.uint64)
+    return offsets, np.frombuffer(b"".join(encoded), dtype="u1")
+
+
+def _hash_table(keys: Sequence[Any], slot: Callable[[Any, int], int]) -> np.ndarray:
+    # load factor <= 0.5 with linear probing, lookups are 1 or 2 probes
+    size = 8
+    while size < 2 * len(keys):
+        size *= 2
+    table = np.zeros(size, dtype="<u4")
+    for i, key in enumerate(keys):
+        s = slot(key, size - 1)
+        while table[s]:
+            s = (s + 1) & (size - 1)
+        table[s] = i + 1
+    return table
+
+
+class ColorIndex:  # pylint: disable=too-many-instance-attributes
+    # immutable, memory-mapped palette snapshot compiled from a palette JSON file. Forked or
+    # spawned API processes that map the same file share its pages through the OS page cache
+    magic = b"CIDX"
+    version = 1
+    logger = get_logger(__name__)
+
+    def __init__(self, buf: Any):
+        self._buf = buf  # keeps the mapping alive as long as the views are in use
+        magic, version, sections, rows, families, source_hash = _HEADER.unpack_from(buf, 0)
+        if magic != self.magic or version != self.version or sections != len(_SECTIONS):
+            raise ValueError(f"Not a v{self.version} color index snapshot")
+        self.rows = rows
+        self.families = families
+        self.source_hash: bytes = source_hash
+        views = self._sections(buf)
+        # lookups run per request: plain memoryviews index ~10x faster than numpy scalars
+        self.rgb = np.frombuffer(views["rgb"], dtype="<f8").reshape(-1, 3)
+        self.lab = np.frombuffer(views["lab"], dtype="<f8").reshape(-1, 3)
+        self._row_keys = self._u4(views["row_keys"])
+        self._row_name_off = self._u4(views["row_name_off"])
+        self._row_names = views["row_names"]
+        self._hex_table = self._u4(views["hex_table"])
+        self._fam_name_off = self._u4(views["fam_name_off"])
+        self._fam_names = views["fam_names"]
+        self._fam_table = self._u4(views["fam_table"])
+        self._fam_start = self._u4(views["fam_start"])
+        self._fam_len = self._u4(views["fam_len"])
+        self._fam_list = views["fam_list"]
+        self._fam_hex = views["fam_hex"]
+
+    @staticmethod
+    def _sections(buf: Any) -> Dict[str, memoryview]:
+        view = memoryview(buf)
+        offsets = struct.unpack_from(f"<{len(_SECTIONS) + 1}Q", buf, _HEADER.size)
+        return {name: view[offsets[i]:offsets[i + 1]] for i, (name, _) in enumerate(_SECTIONS)}
+
+    @staticmethod
+    def _u4(view: memoryview) -> Sequence[int]:
+        if sys.byteorder == "little":
+            return view.cast("I")  # zero copy, amd64 & arm64
+        values = array("I", view.tobytes())
+        values.byteswap()
+        return values
+
+    def row_name(self, row: int) -> str:
+        off = self._row_name_off
+        return str(self._row_names[off[row]:off[row + 1]], "utf-8")
+
+    def row_hex(self, row: int) -> str:
+        return f"#{self._row_keys[row]:06x}"
+
+    def row_rgb(self, row: int) -> Tuple[int, int, int]:
+        key = self._row_keys[row]
+        return (key >> 16) & 0xFF, (key >> 8) & 0xFF, key & 0xFF
+
+    def hex_row(self, hex_key: str) -> int:
+        # hex_key is "rrggbb", returns -1 when it is not a palette color
+        key = int(hex_key, 16)
+        table = self._hex_table
+        mask = len(table) - 1
+        slot = _hex_slot(key, mask)
+        while table[slot]:
+            row = table[slot] - 1
+            if self._row_keys[row] == key:
+                return row
+            slot = (slot + 1) & mask
+        return -1
+
+    def family(self, name: str) -> int:
+        # returns the family id of a palette JSON key, -1 when there is none
+        key = name.encode("utf-8")
+        table, names, off = self._fam_table, self._fam_names, self._fam_name_off
+        mask = len(table) - 1
+        slot = _name_slot(key, mask)
+        while table[slot]:
+            fam = table[slot] - 1
+            if names[off[fam]:off[fam + 1]] == key:
+                return fam
+            slot = (slot + 1) & mask
+        return -1
+
+    def family_names(self) -> List[str]:
+        off = self._fam_name_off
+        return [str(self._fam_names[off[i]:off[i + 1]], "utf-8") for i in range(self.families)]
+
+    def is_shades(self, fam: int) -> bool:
+        # True when the palette JSON value is a list of shades, not a single color
+        return bool(self._fam_list[fam])
+
+    def shade_count(self, fam: int) -> int:
+        return self._fam_len[fam]
+
+    def shade(self, fam: int, i: int) -> str:
+        at = (self._fam_start[fam] + i) * 7
+        return str(self._fam_hex[at:at + 7], "ascii")
+
+    @classmethod
+    def compile(cls, source: bytes) -> bytes:  # pylint: disable=too-many-locals
+        palette: Dict[str, Any] = json.loads(source)
+        hexmap: Dict[str, str] = {}  # hex -> name, a later duplicate renames the row
+        fam_names: List[str] = []
+        fam_start: List[int] = []
+        fam_len: List[int] = []
+        fam_list: List[int] = []
+        fam_hex: List[str] = []
+        for color_name, value in palette.items():
+            shades = [value] if isinstance(value, str) else list(value)
+            for hex_value in shades:
+                if not isinstance(hex_value, str) or not _re_hex.match(hex_value.lower()):
+                    raise ValueError(f"Invalid hex value for {color_name}: {hex_value}")
+            fam_names.append(color_name)
+            fam_start.append(len(fam_hex))
+            fam_len.append(len(shades))
+            fam_list.append(0 if isinstance(value, str) else 1)
+            fam_hex.extend(shades)
+            if isinstance(value, str):
+                hexmap[value[1:].lower()] = color_name
+            else:
+                for index, hex_value in enumerate(shades):
+                    hexmap[hex_value[1:].lower()] = f"{color_name}{index}"
+
+        keys = np.array([int(h, 16) for h in hexmap], dtype="<u4")
+        rgb = np.stack([(keys >> 16) & 0xFF, (keys >> 8) & 0xFF, keys & 0xFF], axis=1)
+        row_name_off, row_names = _strings(list(hexmap.values()))
+        fam_name_off, fam_names_blob = _strings(fam_names)
+        sections: Dict[str, np.ndarray] = {
+            "rgb": rgb.astype("<f8"),
+            "lab": rgb_to_lab(rgb).astype("<f8"),
+            "row_keys": keys,
+            "row_name_off": row_name_off,
+            "row_names": row_names,
+            "hex_table": _hash_table(keys.tolist(), _hex_slot),
+            "fam_name_off": fam_name_off,
+            "fam_names": fam_names_blob,
+            "fam_table": _hash_table([n.encode("utf-8") for n in fam_names], _name_slot),
+            "fam_start": np.array(fam_start, dtype="<u4"),
+            "fam_len": np.array(fam_len, dtype="<u4"),
+            "fam_list": np.array(fam_list, dtype="u1"),
+            "fam_hex": np.array(fam_hex, dtype="S7"),
+        }
+
+        offsets: List[int] = []
+        body = bytearray()
+        pos = _HEADER.size + 8 * (len(_SECTIONS) + 1)
+        for name, dtype in _SECTIONS:
+            pad = -pos % 8
+            body += b"\0" * pad
+            pos += pad
+            offsets.append(pos)
+            data = np.ascontiguousarray(sections[name], dtype=dtype).tobytes()
+            body += data
+            pos += len(data)
+        offsets.append(pos)
+        header = _HEADER.pack(
+            cls.magic, cls.version, len(_SECTIONS), len(hexmap), len(fam_names),
+            hashlib.sha256(source).digest())
+        return header + np.array(offsets, dtype="<u8").tobytes() + bytes(body)
+
+    @classmethod
+    def build(cls, source_path: str, snapshot_path: str) -> bytes:
+        with open(source_path, "rb") as f:
+            source = f.read()
+        snapshot = cls.compile(source)
+        tmp_path = f"{snapshot_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(snapshot)
+        os.replace(tmp_path, snapshot_path)  # readers never see a partially written file
+        cls.logger.info(
+            "Compiled %s into %s (%d bytes)", source_path, snapshot_path, len(snapshot))
+        return snapshot
+
+    @classmethod
+    def _open(cls, snapshot_path: str, source_hash: bytes) -> "ColorIndex | None":
+        try:
+            with open(snapshot_path, "rb") as f:
+                buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            index = cls(buf)
+        except (OSError, ValueError) as e:
+            cls.logger.info("No usable color index snapshot at %s: %s", snapshot_path, e)
+            return None
+        if index.source_hash != source_hash:
+            cls.logger.info("Color index snapshot %s is stale", snapshot_path)
+            return None
+        return index
+
+    @classmethod
+    def load(cls, source_path: str, snapshot_path: str) -> "ColorIndex":
+        # maps the snapshot when it matches the source, else (re)builds it first. When the
+        # snapshot cannot be written (read-only file system) the index lives in process memory
+        with open(source_path, "rb") as f:
+            source_hash = hashlib.sha256(f.read()).digest()
+        index = cls._open(snapshot_path, source_hash)
+        if index is not None:
+            return index
+        try:
+            cls.build(source_path, snapshot_path)
+        except OSError as e:
+            cls.logger.warning("Cannot write color index snapshot %s: %s", snapshot_path, e)
+            with open(source_path, "rb") as f:
+                return cls(cls.compile(f.read()))
+        index = cls._open(snapshot_path, source_hash)
+        if index is None:
+            raise ValueError(f"Color index snapshot {snapshot_path} is unreadable")
+        return index
+
+
+if __name__ == "__main__":  # build step: python -m services.color_index [source.json] [snapshot]
+    _dir = os.path.dirname(__file__)
+    _source = sys.argv[1] if len(sys.argv) > 1 else os.path.join(
+        _dir, "palettes", "open_colors.json")
+    _snapshot = sys.argv[2] if len(sys.argv) > 2 else os.path.splitext(_source)[0] + ".cidx"
+    ColorIndex.build(_source, _snapshot)
@@ -1,69 +1,111 @@
 from abc import ABC, abstractmethod
-import json
 import os
 import re
-from typing import Any, Dict, List, Protocol, Tuple
-from services.api_schemas import ColorMatched
+import time
+from typing import List, Protocol, Tuple
+from services.api_schemas import ColorMatched, ColorSuggestion
+from services.palette_registry import PaletteRegistry
 from logger_factory import get_logger
+from metrics import REGISTRY
 
 
-class ColorMatcherProtocol(Protocol):
+RGB = Tuple[int, int, int]
+
+
+class SyncColorMatcherProtocol(Protocol):
     def names(self) -> List[str]:
         ...
 
-    def match(self, name: str) -> List[ColorMatched]:
+    def match(self, name: str, k: int = 1) -> List[ColorMatched]:
+        ...
+
+    def match_batch(self, names: List[str], k: int = 1) -> List[List[ColorMatched]]:
+        ...
+
+    def nearest(self, rgb: RGB, k: int = 1) -> List[ColorMatched]:
+        ...
+
+
+class ColorMatcherProtocol(Protocol):
+    async def names(self) -> List[str]:
+        ...
+
+    async def match(self, name: str, k: int = 1) -> List[ColorMatched]:
+        ...
+
+    async def match_batch(self, names: List[str], k: int = 1) -> List[List[ColorMatched]]:
+        ...
+
+    async def nearest(self, rgb: RGB, k: int = 1) -> List[ColorMatched]:
         ...
 
 
 class ColorMatcherABC(ABC, ColorMatcherProtocol):
     @abstractmethod
-    def names(self) -> List[str]:
+    async def names(self) -> List[str]:
+        pass
+
+    @abstractmethod
+    async def match(self, name: str, k: int = 1) -> List[ColorMatched]:
         pass
 
     @abstractmethod
-    def match(self, name: str) -> List[ColorMatched]:
+    async def match_batch(self, names: List[str], k: int = 1) -> List[List[ColorMatched]]:
         pass
 
+    @abstractmethod
+    async def nearest(self, rgb: RGB, k: int = 1) -> List[ColorMatched]:
+        pass
+
+
+class ColorMatcherDecorator(ColorMatcherABC):
+    # forwards everything to the wrapped matcher, decorators override only what they change
+    def __init__(self, matcher: ColorMatcherABC):
+        self._matcher = matcher
+
+    async def names(self) -> List[str]:
+        return await self._matcher.names()
+
+    async def match(self, name: str, k: int = 1) -> List[ColorMatched]:
+        return await self._matcher.match(name, k)
+
+    async def match_batch(self, names: List[str], k: int = 1) -> List[List[ColorMatched]]:
+        return await self._matcher.match_batch(names, k)
+
+    async def nearest(self, rgb: RGB, k: int = 1) -> List[ColorMatched]:
+        return await self._matcher.nearest(rgb, k)
+
 
 class ColorMatcher(ColorMatcherABC):
-    colors: Dict[str, Any] = {}
-    hexmap: Dict[str, str] = {}
     re_color_num = re.compile(r"^\s*([a-z]{3,})\s*([0-9])\s*$", flags=re.IGNORECASE)
     re_color_mod = re.compile(
         r"^\s*(light|mild|medium|standard|regular|dark)\s+([a-z]{3,})\s*$", flags=re.IGNORECASE)
     re_hex_name = re.compile(r"^\s*[#]?([a-f0-9]{6})\s*$", flags=re.IGNORECASE)
     re_short_hex_name = re.compile(r"^\s*[#]?([a-f0-9]{3})\s*$", flags=re.IGNORECASE)
+    re_rgb_name = re.compile(r"^\s*([0-9]{1,3})\s*,\s*([0-9]{1,3})\s*,\s*([0-9]{1,3})\s*$")
     logger = get_logger(__name__)
+    layer_seconds = REGISTRY.histogram(
+        "color_api_layer_seconds", "Time spent in each matcher layer", layer="match")
+    fuzzy_matches = REGISTRY.counter(
+        "color_api_fuzzy_matches", "Names only matched after correcting a typo")
+    # the nearest color scan & the typo scoring grow with the palette. From this many colors
+    # they run on the thread pool, SEE: ./color_matcher_in_thread_pool.py. 0: never
+    thread_min_colors: int = int(os.getenv("API_MATCH_THREAD_MIN_COLORS", "5000"))
 
     @classmethod
-    def _load_colors(cls):
-        if len(cls.colors) > 0:
-            return
-
-        # SEE: https://yeun.github.io/open-color/
-        # get current script path:
-        script_dir = os.path.dirname(__file__)
-        file_path = os.path.join(script_dir, "open_colors.json")
-        with open(file_path, encoding="utf-8") as f:
-            colors = json.load(f)
-            cls.colors = colors
-
-        for color_name, value in colors.items():
-            if isinstance(value, str):
-                # skip first character of value
-                hex_key = value[1:].lower()
-                cls.hexmap[hex_key] = color_name
-            elif isinstance(value, list):
-                index = 0
-                for hex_value in value:
-                    hex_value = hex_value[1:].lower()
-                    cls.hexmap[hex_value] = f"{color_name}{index}"
-                    index += 1
-
-        cls.logger.debug("Loaded %d colors OK", len(cls.colors))
-
-    def __init__(self):
-        self._load_colors()
+    def load(cls) -> None:
+        # called once at startup, so no request pays for it. SEE: ./palette_registry.py
+        PaletteRegistry.load()
+
+    def __init__(self, palette: str | None = None):
+        # resolved once, a palette reloaded mid request does not change under this matcher
+        self.palette = PaletteRegistry.get(palette)
+        self.sync = SyncColorMatcher(self)
+
+    @property
+    def blocking(self) -> bool:
+        # too large to search on the event loop, the caller should use the thread pool
+        return 0 < self.thread_min_colors <= self.palette.index.rows
 
     @staticmethod
     def _hex_to_rgb(hex_color: str) -> Tuple[int, int, int]:
@@ -74,81 +116,175 @@ class ColorMatcher(ColorMatcherABC):
     def _rgb_to_hex(rgb: Tuple[int, int, int]) -> str:
         return "#%02x%02x%02x" % rgb  # pylint: disable=consider-using-f-string
 
-    def names(self) -> List[str]:
-        return list(self.colors.keys())
+    @staticmethod
+    def _modifier_hint(modifier: str) -> int:
+        case = modifier.lower()
+        if case == "light":
+            return 0
+        if case == "mild":
+            return 2
+        if case == "strong":
+            return 7
+        if case == "dark":
+            return 9
+        return 5
+
+    async def names(self) -> List[str]:
+        return self.sync.names()
+
+    async def match(self, name: str, k: int = 1) -> List[ColorMatched]:
+        # pure in-memory lookups, cheap enough to run directly on the event loop for a palette
+        # that is not blocking
+        return self.sync.match(name, k)
+
+    async def match_batch(self, names: List[str], k: int = 1) -> List[List[ColorMatched]]:
+        return self.sync.match_batch(names, k)
+
+    async def nearest(self, rgb: RGB, k: int = 1) -> List[ColorMatched]:
+        return self.sync.nearest(rgb, k)
+
+    def fuzzy(self, name: str, limit: int = 5) -> List[Tuple[str, str, str, int, int, float]]:
+        # closest palette names for a misspelled one, best first, as (suggestion, name to match
+        # with, family, shade hint, edit distance, score). A shade number or modifier is kept,
+        # only the color part is corrected: "gren5" -> "green5", "dark purpel" -> "dark purple"
+        name = name.strip().lower()
+        base, prefix, suffix, hint = name, "", "", -1
+        exp = self.re_color_num.findall(name)
+        if exp is not None and len(exp) >= 1 and len(exp[0]) == 2:
+            base, suffix, hint = exp[0][0], exp[0][1], int(exp[0][1])
+        else:
+            exp = self.re_color_mod.findall(name)
+            if exp is not None and len(exp) >= 1 and len(exp[0]) == 2:
+                base, prefix, hint = exp[0][1], f"{exp[0][0]} ", self._modifier_hint(exp[0][0])
+        return [
+            (f"{prefix}{family}{suffix}", f"{prefix}{family}", family, hint, distance, score)
+            for family, distance, score in self.palette.fuzzy_index.search(base, limit)
+        ]
+
+    def suggest(self, name: str, limit: int = 5) -> List[ColorSuggestion]:
+        return [
+            ColorSuggestion(name=suggestion, distance=distance, score=score)
+            for suggestion, _, _, _, distance, score in self.fuzzy(name, limit)
+        ]
 
-    def match(self, name: str) -> List[ColorMatched]:  # pylint: disable=R0912,R0915
+    def find_nearest(self, rgb: RGB, k: int = 1) -> List[ColorMatched]:
+        colors = self.palette.index
+        results: List[ColorMatched] = []
+        for i in self.palette.nearest_index.query(rgb, k):
+            m_rgb = colors.row_rgb(i)
+            results.append(ColorMatched(
+                name=colors.row_name(i), hex=colors.row_hex(i),
+                r=m_rgb[0], g=m_rgb[1], b=m_rgb[2]))
+        return results
+
+    def find(self, name: str, k: int = 1) -> List[ColorMatched]:  # pylint: disable=R0912,R0914,R0915
         name = name.lower()
         results: List[ColorMatched] = []
-        direct = self.colors.get(name)
+        colors = self.palette.index
+        direct = colors.family(name)  # family id, -1 when there is none
         index_hint: int = -1
 
-        if direct is None:  # no direct match, check short hex
+        if direct < 0:  # no direct match, check r,g,b triplet
+            exp = self.re_rgb_name.findall(name)
+            if exp is not None and len(exp) >= 1 and len(exp[0]) == 3:
+                rgb_in = tuple(int(v) for v in exp[0])
+                if max(rgb_in) <= 255:
+                    name = self._rgb_to_hex(rgb_in)  # type: ignore
+
+        if direct < 0:  # no direct match, check short hex
             exp = self.re_short_hex_name.findall(name)
             if exp is not None and len(exp) >= 1 and isinstance(exp[0], str):
                 hex_key = exp[0].lower()
                 # expand short hex_key to long hex format
                 name = f"#{hex_key[0] * 2}{hex_key[1] * 2}{hex_key[2] * 2}"
 
-        if direct is None:  # no direct match, check hexmap
+        if direct < 0:  # no direct match, check hexmap
             exp = self.re_hex_name.findall(name)
             if exp is not None and len(exp) >= 1 and isinstance(exp[0], str):
                 hex_key = exp[0].lower()
-                color_name = self.hexmap.get(hex_key)
-                if color_name is not None:
+                row = colors.hex_row(hex_key)
+                if row >= 0:
                     rgb = self._hex_to_rgb(hex_key)
                     m = ColorMatched(
-                        name=color_name, hex=f"#{hex_key}", r=rgb[0], g=rgb[1], b=rgb[2])
+                        name=colors.row_name(row), hex=f"#{hex_key}", r=rgb[0], g=rgb[1], b=rgb[2])
                     results.append(m)
                     self.logger.debug("Matched %s to %d colors", name, len(results))
                     return results  # return early because we're constructing the result directly
 
-        if direct is None:  # no direct match, attempt to match with number
+                # not a palette color, return the closest palette colors instead
+                results = self.find_nearest(self._hex_to_rgb(hex_key), k)
+                self.logger.debug("Matched %s to %d nearest colors", name, len(results))
+                return results
+
+        if direct < 0:  # no direct match, attempt to match with number
             exp = self.re_color_num.findall(name)
             if exp is not None and len(exp) >= 1 and len(exp[0]) == 2:
-                base_name = exp[0][0]
-                if base_name in self.colors:
-                    direct = self.colors.get(base_name)
+                direct = colors.family(exp[0][0])
+                if direct >= 0:
                     index_hint = int(exp[0][1])
 
-        if direct is None:  # no direct match, attempt to match with modifier
+        if direct < 0:  # no direct match, attempt to match with modifier
             exp = self.re_color_mod.findall(name)
             if exp is not None and len(exp) >= 1 and len(exp[0]) == 2:
-                base_name = exp[0][1]
-                if base_name in self.colors:
-                    direct = self.colors.get(base_name)
-                    case = exp[0][0].lower()
-                    if case == "light":
-                        index_hint = 0
-                    elif case == "mild":
-                        index_hint = 2
-                    elif case == "strong":
-                        index_hint = 7
-                    elif case == "dark":
-                        index_hint = 9
-                    else:
-                        index_hint = 5
-
-        # check if direct is a string or an array
-        if isinstance(direct, str):
-            rgb = self._hex_to_rgb(direct)
-            m = ColorMatched(name=name, hex=direct, r=rgb[0], g=rgb[1], b=rgb[2])
+                direct = colors.family(exp[0][1])
+                if direct >= 0:
+                    index_hint = self._modifier_hint(exp[0][0])
+
+        if direct < 0:  # still no match, attempt to correct a typo in the color name
+            fuzzy = self.fuzzy(name, 1)
+            if len(fuzzy) > 0:
+                _, name, family, index_hint, _, _ = fuzzy[0]
+                direct = colors.family(family)
+                self.fuzzy_matches.inc()
+
+        # check if direct is a single color or a list of shades
+        if direct >= 0 and not colors.is_shades(direct):
+            hex_value = colors.shade(direct, 0)
+            rgb = self._hex_to_rgb(hex_value)
+            m = ColorMatched(name=name, hex=hex_value, r=rgb[0], g=rgb[1], b=rgb[2])
             results.append(m)
-        elif isinstance(direct, list):
-            if index_hint >= 0 and index_hint < len(direct):  # pylint: disable=R1716
-                hex_value = direct[index_hint]
+        elif direct >= 0:
+            shades = colors.shade_count(direct)
+            if index_hint >= 0 and index_hint < shades:  # pylint: disable=R1716
+                hex_value = colors.shade(direct, index_hint)
                 rgb = self._hex_to_rgb(hex_value)
                 m = ColorMatched(
                     name=f"{name}{index_hint}", hex=hex_value, r=rgb[0], g=rgb[1], b=rgb[2])
                 results.append(m)
             else:  # add everything
-                index = 0
-                for hex_value in direct:
-                    index += 1
+                for index in range(shades):
+                    hex_value = colors.shade(direct, index)
                     rgb = self._hex_to_rgb(hex_value)
                     m = ColorMatched(
-                        name=f"{name}{index}", hex=hex_value, r=rgb[0], g=rgb[1], b=rgb[2])
+                        name=f"{name}{index + 1}", hex=hex_value, r=rgb[0], g=rgb[1], b=rgb[2])
                     results.append(m)
 
         self.logger.debug("Matched %s to %d colors", name, len(results))
         return results
+
+
+class SyncColorMatcher(SyncColorMatcherProtocol):
+    # the blocking face of a ColorMatcher, for ColorMatcherInThreadPool
+    def __init__(self, matcher: ColorMatcher):
+        self._matcher = matcher
+
+    def names(self) -> List[str]:
+        return self._matcher.palette.names
+
+    def match(self, name: str, k: int = 1) -> List[ColorMatched]:
+        start = time.perf_counter()
+        res = self._matcher.find(name, k)
+        self._matcher.layer_seconds.observe_since(start)
+        return res
+
+    def match_batch(self, names: List[str], k: int = 1) -> List[List[ColorMatched]]:
+        start = time.perf_counter()
+        res = [self._matcher.find(name, k) for name in names]
+        self._matcher.layer_seconds.observe_since(start)
+        return res
+
+    def nearest(self, rgb: RGB, k: int = 1) -> List[ColorMatched]:
+        start = time.perf_counter()
+        res = self._matcher.find_nearest(rgb, k)
+        self._matcher.layer_seconds.observe_since(start)
+        return res
@@ -0,0 +1,22 @@
+from typing import List
+from starlette.concurrency import run_in_threadpool
+from services.color_matcher import ColorMatcherABC, SyncColorMatcherProtocol, RGB
+from services.api_schemas import ColorMatched
+
+
+class ColorMatcherInThreadPool(ColorMatcherABC):
+    # adapts a blocking (sync) matcher to the async protocol by running it on the thread pool
+    def __init__(self, matcher: SyncColorMatcherProtocol):
+        self.__matcher = matcher
+
+    async def names(self) -> List[str]:
+        return await run_in_threadpool(self.__matcher.names)
+
+    async def match(self, name: str, k: int = 1) -> List[ColorMatched]:
+        return await run_in_threadpool(self.__matcher.match, name, k)
+
+    async def match_batch(self, names: List[str], k: int = 1) -> List[List[ColorMatched]]:
+        return await run_in_threadpool(self.__matcher.match_batch, names, k)
+
+    async def nearest(self, rgb: RGB, k: int = 1) -> List[ColorMatched]:
+        return await run_in_threadpool(self.__matcher.nearest, rgb, k)
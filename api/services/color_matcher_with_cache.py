@@ -0,0 +1,118 @@
+from collections import OrderedDict
+import os
+import time
+from typing import Any, Dict, List, Tuple
+from services.color_matcher import ColorMatcherABC, ColorMatcherDecorator
+from services.api_schemas import ColorMatched
+from logger_factory import get_logger
+from metrics import REGISTRY
+
+
+CacheKey = Tuple[str, str, int]
+
+
+class ColorMatcherWithCache(ColorMatcherDecorator):
+    # entries are shared by every request, the decorator itself is created per request
+    # (scope, name, k), the scope is the palette key: a reloaded palette never serves old results
+    _entries: OrderedDict[CacheKey, Tuple[float, List[ColorMatched]]] = OrderedDict()
+    _hits: int = 0
+    _misses: int = 0
+    _evictions: int = 0
+    logger = get_logger(__name__)
+    max_size: int = int(os.getenv("API_CACHE_SIZE", "1024"))
+    ttl_s: float = float(os.getenv("API_CACHE_TTL_S", "0"))  # 0 means entries never expire
+    can_cache: bool = max_size > 0
+    layer_seconds = REGISTRY.histogram(
+        "color_api_layer_seconds", "Time spent in each matcher layer", layer="cache")
+
+    def __init__(self, matcher: ColorMatcherABC, scope: str = ""):
+        super().__init__(matcher)
+        self.scope = scope
+
+    @staticmethod
+    def _normalize(name: str) -> str:
+        return " ".join(name.lower().split())
+
+    @classmethod
+    def _get(cls, key: CacheKey) -> List[ColorMatched] | None:
+        entry = cls._entries.get(key)
+        if entry is None:
+            cls._misses += 1
+            return None
+        expires, res = entry
+        if expires > 0 and expires < time.monotonic():  # pylint: disable=R1716
+            del cls._entries[key]
+            cls._misses += 1
+            return None
+        cls._entries.move_to_end(key)
+        cls._hits += 1
+        return res
+
+    @classmethod
+    def _put(cls, key: CacheKey, res: List[ColorMatched]) -> None:
+        expires = time.monotonic() + cls.ttl_s if cls.ttl_s > 0 else 0
+        cls._entries[key] = (expires, res)
+        cls._entries.move_to_end(key)
+        while len(cls._entries) > cls.max_size:
+            cls._entries.popitem(last=False)  # least recently used is at the front
+            cls._evictions += 1
+
+    @classmethod
+    def stats(cls) -> Dict[str, Any]:
+        return {
+            "size": len(cls._entries),
+            "max_size": cls.max_size,
+            "ttl_s": cls.ttl_s,
+            "hits": cls._hits,
+            "misses": cls._misses,
+            "evictions": cls._evictions,
+        }
+
+    async def match(self, name: str, k: int = 1) -> List[ColorMatched]:
+        if not self.can_cache:
+            return await self._matcher.match(name, k)
+
+        start = time.perf_counter()
+        key = (self.scope, self._normalize(name), k)
+        res = self._get(key)
+        if res is None:
+            inner = time.perf_counter()
+            res = await self._matcher.match(key[1], k)
+            start += time.perf_counter() - inner  # only this layer's own time is observed
+            self._put(key, res)
+        res = list(res)  # callers get their own list, cached models are shared
+        self.layer_seconds.observe_since(start)
+        return res
+
+    async def match_batch(self, names: List[str], k: int = 1) -> List[List[ColorMatched]]:
+        if not self.can_cache:
+            return await self._matcher.match_batch(names, k)
+
+        start = time.perf_counter()
+        keys = [(self.scope, self._normalize(name), k) for name in names]
+        found: Dict[CacheKey, List[ColorMatched]] = {}
+        for key in keys:
+            if key not in found:
+                res = self._get(key)
+                if res is not None:
+                    found[key] = res
+        misses = list(dict.fromkeys(key for key in keys if key not in found))
+        if len(misses) > 0:  # every miss in the batch goes down the chain in a single call
+            inner = time.perf_counter()
+            batch = await self._matcher.match_batch([key[1] for key in misses], k)
+            start += time.perf_counter() - inner
+            for key, res in zip(misses, batch):
+                self._put(key, res)
+                found[key] = res
+        results = [list(found[key]) for key in keys]
+        self.layer_seconds.observe_since(start)
+        return results
+
+
+def _cache_gauge(stat: str) -> None:
+    REGISTRY.gauge(f"color_api_cache_{stat}", f"Match result cache {stat}").set_function(
+        lambda: ColorMatcherWithCache.stats()[stat])
+
+
+for _stat in ("hits", "misses", "evictions", "size"):
+    _cache_gauge(_stat)
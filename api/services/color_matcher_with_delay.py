@@ -1,41 +1,55 @@
-import time
-from datetime import datetime
+import asyncio
 import random
+import time
 from typing import List
 import os
-from services.color_matcher import ColorMatcherABC
+from services.color_matcher import ColorMatcherDecorator, RGB
 from services.api_schemas import ColorMatched
 from logger_factory import get_logger
+from metrics import REGISTRY
 
 
-class ColorMatcherWithDelay(ColorMatcherABC):
+class ColorMatcherWithDelay(ColorMatcherDecorator):
     logger = get_logger(__name__)
     min_delay_ms: float = float(os.getenv("API_DELAY_MIN", "0"))
     max_delay_ms: float = float(os.getenv("API_DELAY_MAX", "0"))
     can_delay: bool = min_delay_ms >= 0 and max_delay_ms >= min_delay_ms and max_delay_ms > 0  # noqa pylint: disable=R1716
     is_random: bool = min_delay_ms < max_delay_ms
-
-    def __init__(self, matcher: ColorMatcherABC):
-        self.__matcher = matcher
+    layer_seconds = REGISTRY.histogram(
+        "color_api_layer_seconds", "Time spent in each matcher layer", layer="delay")
 
     @classmethod
-    def _delay(cls, start: datetime) -> None:
+    async def _delay(cls, start: float) -> None:
         if cls.can_delay:
-            took_ms: float = (datetime.now() - start).microseconds / 1_000
+            took_ms: float = (time.perf_counter() - start) * 1_000
             nap_ms: float = round(
                 random.uniform(cls.min_delay_ms, cls.max_delay_ms) if cls.is_random
                 else cls.max_delay_ms, 2)
             cls.logger.debug("Execution took %sms Delaying for %fms", took_ms, nap_ms)
-            time.sleep(nap_ms / 1_000)
+            nap_start = time.perf_counter()
+            await asyncio.sleep(nap_ms / 1_000)  # yields the event loop to other requests
+            cls.layer_seconds.observe_since(nap_start)
+
+    async def names(self) -> List[str]:
+        start = time.perf_counter()
+        res = await self._matcher.names()
+        await self._delay(start)
+        return res
+
+    async def match(self, name: str, k: int = 1) -> List[ColorMatched]:
+        start = time.perf_counter()
+        res = await self._matcher.match(name, k)
+        await self._delay(start)
+        return res
 
-    def names(self) -> List[str]:
-        start = datetime.now()
-        res = self.__matcher.names()
-        self._delay(start)
+    async def match_batch(self, names: List[str], k: int = 1) -> List[List[ColorMatched]]:
+        start = time.perf_counter()
+        res = await self._matcher.match_batch(names, k)
+        await self._delay(start)  # one simulated delay for the whole batch
         return res
 
-    def match(self, name: str) -> List[ColorMatched]:
-        start = datetime.now()
-        res = self.__matcher.match(name)
-        self._delay(start)
+    async def nearest(self, rgb: RGB, k: int = 1) -> List[ColorMatched]:
+        start = time.perf_counter()
+        res = await self._matcher.nearest(rgb, k)
+        await self._delay(start)
         return res
@@ -1,22 +1,31 @@
-from typing import Any, List
+from typing import Any, Dict, List
 import os
-import base64
 import binascii
-import pickle
+import time
 from datetime import datetime
 from fastapi import Request
-from redis import StrictRedis as Redis
+from redis.asyncio import ConnectionPool, StrictRedis as Redis
 from logger_factory import get_logger
-from shared_schemas import ColorMatched, COLOR_LIST_NAME
-from services.color_matcher import ColorMatcherABC
+from metrics import REGISTRY
+from shared_schemas import (
+    ColorMatched, EventCodec, COLOR_LIST_NAME, COLOR_STREAM_NAME, EVENT_TRANSPORT
+)
+from services.color_matcher import ColorMatcherABC, ColorMatcherDecorator, RGB
+from services.event_publisher import EventPublisher
+from services.admission_controller import AdmissionController
 
 
-class ColorMatcherWithPublisher(ColorMatcherABC):
+class ColorMatcherWithPublisher(ColorMatcherDecorator):
     _redis: Redis | None = None
+    _publisher: EventPublisher | None = None
+    _admission: AdmissionController | None = None
     logger = get_logger(__name__)
+    queue_name: str = COLOR_STREAM_NAME if EVENT_TRANSPORT == "stream" else COLOR_LIST_NAME
+    layer_seconds = REGISTRY.histogram(
+        "color_api_layer_seconds", "Time spent in each matcher layer", layer="publish")
 
     def __init__(self, matcher: ColorMatcherABC, request: Request):
-        self.__matcher = matcher
+        super().__init__(matcher)
         self.request = request
         self._init_redis()
 
@@ -25,43 +34,100 @@ class ColorMatcherWithPublisher(ColorMatcherABC):
         if cls._redis is None:
             host = os.getenv("REDIS_HOST", "localhost")
             port = int(os.getenv("REDIS_PORT", "6379"))
-            cls.logger.debug(f"Connecting to Redis at {host}:{port}")
-            cls._redis = Redis(host, port, decode_responses=True)
+            pool_size = int(os.getenv("REDIS_POOL_SIZE", "10"))
+            cls.logger.debug("Connecting to Redis at %s:%d", host, port)
+            pool = ConnectionPool(
+                host=host, port=port, max_connections=pool_size)
+            cls._redis = Redis.from_pool(pool)  # the client owns & closes the pool
+        if cls._publisher is None:
+            cls._publisher = EventPublisher(cls._redis)
+        if cls._admission is None:
+            cls._admission = AdmissionController(cls._redis, cls.queue_name, EVENT_TRANSPORT)
 
-    def names(self) -> List[str]:
-        return self.__matcher.names()
+    @classmethod
+    def startup(cls) -> None:
+        cls._init_redis()
+        if cls._publisher is not None:
+            cls._publisher.start()
+        if cls._admission is not None:
+            cls._admission.start()
 
-    def _publish(self, key_name: str, data: Any):
-        if self._redis is None:
-            self.logger.error("Redis connection is not initialized")
-            return
+    @classmethod
+    def admission(cls) -> AdmissionController:
+        cls._init_redis()
+        return cls._admission  # type: ignore[return-value]
+
+    @classmethod
+    def stats(cls) -> Dict[str, Any]:
+        return cls._publisher.stats() if cls._publisher is not None else {}
+
+    @classmethod
+    def queue_stats(cls) -> Dict[str, Any]:
+        return cls._admission.stats() if cls._admission is not None else {}
 
-        buf = pickle.dumps(data)
-        # s = buf.decode('utf-8')
-        s = base64.b64encode(buf)
-        self._redis.lpush(key_name, s)
+    @classmethod
+    async def cleanup(cls) -> None:
+        if cls._admission is not None:
+            await cls._admission.stop()
+            cls._admission = None
+        if cls._publisher is not None:
+            await cls._publisher.stop()  # flush pending events before the connection goes away
+            cls._publisher = None
+        if cls._redis is not None:
+            try:
+                await cls._redis.aclose()
+                cls._redis = None
+                cls.logger.debug("Closed Redis connection")
+            except Exception as e:  # pylint: disable=broad-except
+                cls.logger.warning("Failed to close Redis connection: %s", e)
 
-    def _publish_colors(self, colors: List[ColorMatched]):
-        if self._redis is None:
-            self.logger.error("Redis connection is not initialized")
+    async def _publish(self, key_name: str, *data: Any):
+        if self._publisher is None:
+            self.logger.error("Redis publisher is not initialized")
             return
+        if self._admission is not None and self._admission.mode != AdmissionController.FULL:
+            data = tuple(d for d in data if self._admission.should_publish())  # load shedding
+        if len(data) == 0:
+            return
+
+        start = time.perf_counter()
+        payloads = [EventCodec.encode(d) for d in data]
+        await self._publisher.publish(key_name, *payloads)  # buffered, flushed in the background
+        self.layer_seconds.observe_since(start)
 
+    def _event(self, name: str, colors: List[ColorMatched]) -> Dict[str, Any]:
         now_crc = binascii.crc32(datetime.now().strftime("%Y-%m-%d %H:%M:%S").encode('utf-8'))
         epoch = int(datetime.now().timestamp())
-        evt = {
+        event_id, published_at = EventCodec.stamp()  # the worker measures its lag from here
+        return {
+            "event_id": event_id,
+            "published_at": published_at,
             "user": self.request.headers.get("X-User") or self.request.query_params.get("user") or f"_{now_crc % 100}",  # noqa pylint: disable=line-too-long
             "run": self.request.headers.get("X-Run") or self.request.query_params.get("run") or f"_{epoch % 60}",  # noqa  pylint: disable=line-too-long
-            "input": self.request.query_params.get("name") or "",
+            "input": name,
             "request": {
                 "url": self.request.url.path,
                 "query": dict(self.request.query_params),
-                "headers": dict(self.request.headers)
+                "headers": self.request.headers  # trimmed to EVENT_HEADER_ALLOWLIST on encode
             },
             "colors": colors
         }
-        self._publish(COLOR_LIST_NAME, evt)
 
-    def match(self, name) -> List[ColorMatched]:
-        res = self.__matcher.match(name)
-        self._publish_colors(res)
+    async def _publish_colors(self, name: str, colors: List[ColorMatched]):
+        await self._publish(self.queue_name, self._event(name, colors))
+
+    async def match(self, name: str, k: int = 1) -> List[ColorMatched]:
+        res = await self._matcher.match(name, k)
+        await self._publish_colors(name, res)
+        return res
+
+    async def match_batch(self, names: List[str], k: int = 1) -> List[List[ColorMatched]]:
+        res = await self._matcher.match_batch(names, k)
+        await self._publish(
+            self.queue_name, *[self._event(name, colors) for name, colors in zip(names, res)])
+        return res
+
+    async def nearest(self, rgb: RGB, k: int = 1) -> List[ColorMatched]:
+        res = await self._matcher.nearest(rgb, k)
+        await self._publish_colors(f"#{rgb[0]:02x}{rgb[1]:02x}{rgb[2]:02x}", res)
         return res
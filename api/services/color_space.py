@@ -0,0 +1,67 @@
+from typing import List, Sequence, Tuple
+import numpy as np
+
+
+# sRGB (D65) -> XYZ matrix, SEE: http://www.brucelindbloom.com/index.html?Eqn_RGB_XYZ_Matrix.html
+_RGB_TO_XYZ = np.array([
+    [0.4124564, 0.3575761, 0.1804375],
+    [0.2126729, 0.7151522, 0.0721750],
+    [0.0193339, 0.1191920, 0.9503041],
+])
+_D65_WHITE = np.array([0.95047, 1.0, 1.08883])
+_LAB_EPSILON = 216 / 24389
+_LAB_KAPPA = 24389 / 27
+
+
+def rgb_to_lab(rgb: np.ndarray) -> np.ndarray:
+    # rgb is an (N, 3) array of 0-255 values, returns an (N, 3) array of CIELAB values
+    c = np.asarray(rgb, dtype=np.float64) / 255.0
+    c = np.where(c > 0.04045, ((c + 0.055) / 1.055) ** 2.4, c / 12.92)  # linearize sRGB
+    xyz = (c @ _RGB_TO_XYZ.T) / _D65_WHITE
+    f = np.where(xyz > _LAB_EPSILON, np.cbrt(xyz), (_LAB_KAPPA * xyz + 16) / 116)
+    return np.stack([
+        116 * f[:, 1] - 16,
+        500 * (f[:, 0] - f[:, 1]),
+        200 * (f[:, 1] - f[:, 2]),
+    ], axis=1)
+
+
+class NearestColorIndex:
+    # palette is held as contiguous arrays so every query is a single vectorized distance pass
+    spaces = ("lab", "rgb")
+
+    def __init__(self, rgb: Sequence[Tuple[int, int, int]], space: str = "lab"):
+        if space not in self.spaces:
+            raise ValueError(f"Unknown color space: {space}")
+        self.space = space
+        self.rgb = np.asarray(rgb, dtype=np.float64).reshape(-1, 3)
+        self.points = rgb_to_lab(self.rgb) if space == "lab" else self.rgb
+
+    @classmethod
+    def from_points(
+        cls, rgb: np.ndarray, points: np.ndarray, space: str = "lab"
+    ) -> "NearestColorIndex":
+        # uses precomputed (possibly memory-mapped, read-only) arrays as they are, no copy
+        if space not in cls.spaces:
+            raise ValueError(f"Unknown color space: {space}")
+        index = cls.__new__(cls)
+        index.space = space
+        index.rgb = rgb
+        index.points = points
+        return index
+
+    def __len__(self) -> int:
+        return len(self.points)
+
+    def query(self, rgb: Tuple[int, int, int], k: int = 1) -> List[int]:
+        # returns palette indexes ordered from the closest to the furthest
+        size = len(self.points)
+        k = min(max(k, 1), size)
+        if k <= 0:
+            return []
+        q = np.asarray([rgb], dtype=np.float64)
+        if self.space == "lab":
+            q = rgb_to_lab(q)
+        dist = np.einsum("ij,ij->i", self.points - q, self.points - q)  # squared euclidean
+        idx = np.argpartition(dist, k - 1)[:k] if k < size else np.arange(size)
+        return idx[np.argsort(dist[idx], kind="stable")].tolist()
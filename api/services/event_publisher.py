@@ -0,0 +1,202 @@
+import asyncio
+from collections import deque
+import os
+import time
+from typing import Any, Deque, Dict, List, Tuple
+from redis.asyncio import StrictRedis as Redis
+from logger_factory import get_logger
+from metrics import REGISTRY, SIZE_BUCKETS
+from shared_schemas import EVENT_TRANSPORT, COLOR_STREAM_FIELD
+
+
+class EventPublisher:  # pylint: disable=too-many-instance-attributes
+    # requests enqueue encoded events & return, a single background task pushes them to Redis
+    logger = get_logger(__name__)
+    batch_size: int = int(os.getenv("API_PUBLISH_BATCH_SIZE", "100"))
+    flush_interval_ms: float = float(os.getenv("API_PUBLISH_FLUSH_MS", "50"))
+    buffer_size: int = int(os.getenv("API_PUBLISH_BUFFER_SIZE", "10000"))
+    overflow_policy: str = os.getenv("API_PUBLISH_OVERFLOW", "drop_oldest").lower()
+    overflow_policies = ("drop_oldest", "drop_newest", "block")
+    transport: str = EVENT_TRANSPORT
+    stream_max_len: int = int(os.getenv("API_STREAM_MAX_LEN", "0"))  # 0 keeps every entry
+    flush_seconds = REGISTRY.histogram(
+        "color_api_redis_publish_seconds", "Latency of one pipelined Redis publish flush")
+    flush_events = REGISTRY.histogram(
+        "color_api_redis_publish_events", "Events sent per Redis publish flush", SIZE_BUCKETS)
+    dropped_events = {
+        reason: REGISTRY.counter(
+            "color_api_publish_dropped", "Events the publisher dropped", reason=reason)
+        for reason in ("overflow", "shutdown")}
+
+    def __init__(self, redis: Redis):
+        if self.overflow_policy not in self.overflow_policies:
+            raise ValueError(f"Unknown API_PUBLISH_OVERFLOW policy: {self.overflow_policy}")
+        if self.transport not in ("list", "stream"):
+            raise ValueError(f"Unknown EVENT_TRANSPORT: {self.transport}")
+        self._redis = redis
+        self._buffer: Deque[Tuple[str, Any]] = deque()
+        self._ready = asyncio.Event()  # set when a full batch is waiting
+        # notified when a flush made room, used by the block policy. The batch in flight still
+        # counts against the buffer: a failed flush puts it back & must find its room free
+        self._space = asyncio.Condition()
+        self._in_flight = 0
+        self._task: asyncio.Task | None = None
+        self._closing = False
+        self._enqueued = 0
+        self._published = 0
+        self._dropped = 0
+        self._flushes = 0
+        self._failed_flushes = 0
+        self._max_depth = 0
+        self._last_flush_ms = 0.0
+        self._max_flush_ms = 0.0
+        self._total_flush_ms = 0.0
+        REGISTRY.gauge(
+            "color_api_publish_buffer_depth", "Events buffered in the API waiting for Redis"
+        ).set_function(lambda: len(self._buffer))
+
+    def start(self) -> None:
+        if self._task is None:
+            self._closing = False
+            self._task = asyncio.create_task(self._flush_loop())
+            self.logger.debug(
+                "Publisher started. batch: %d, interval: %sms, buffer: %d, overflow: %s",
+                self.batch_size, self.flush_interval_ms, self.buffer_size, self.overflow_policy)
+
+    async def stop(self) -> None:
+        # stop the flusher & push out everything still buffered
+        self._closing = True
+        if self._task is not None:
+            self._ready.set()
+            try:
+                await self._task
+            except Exception as e:  # pylint: disable=broad-except
+                self.logger.warning("Publisher flush loop ended with error: %s", e)
+            self._task = None
+        while len(self._buffer) > 0:
+            if not await self._flush():
+                self.logger.error("Dropping %d unpublished events on shutdown", len(self._buffer))
+                self._drop(len(self._buffer), "shutdown")
+                self._buffer.clear()
+        await self._notify_space()  # blocked publishers give up, nothing flushes after this
+
+    async def publish(self, key_name: str, *payloads: Any) -> None:
+        if self._closing:
+            # stopped or stopping: nothing would flush these once the final drain is done
+            self._drop(len(payloads), "shutdown")
+            return
+        if self._task is None:
+            self.start()  # lazy start, e.g. when the app runs without lifespan events
+        block = self.overflow_policy == "block"
+        for i, payload in enumerate(payloads):
+            # block counts the batch in flight too, so a failed flush always finds its room
+            if len(self._buffer) + (self._in_flight if block else 0) >= self.buffer_size:
+                if self.overflow_policy == "drop_newest":
+                    self._drop(1, "overflow")
+                    continue
+                if self.overflow_policy == "drop_oldest":
+                    self._buffer.popleft()
+                    self._drop(1, "overflow")
+                else:
+                    async with self._space:
+                        await self._space.wait_for(
+                            lambda: self._closing
+                            or len(self._buffer) + self._in_flight < self.buffer_size)
+                    if self._closing:  # woken by stop(), the final drain is over
+                        self._drop(len(payloads) - i, "shutdown")
+                        return
+            self._buffer.append((key_name, payload))
+            self._enqueued += 1
+        depth = len(self._buffer)
+        self._max_depth = max(depth, self._max_depth)
+        if depth >= self.batch_size:
+            self._ready.set()
+
+    async def _flush_loop(self) -> None:
+        interval_s = self.flush_interval_ms / 1_000
+        while not self._closing:
+            try:
+                await asyncio.wait_for(self._ready.wait(), timeout=interval_s)
+            except asyncio.TimeoutError:
+                pass  # time threshold reached, flush whatever is buffered
+            self._ready.clear()
+            while len(self._buffer) > 0 and not self._closing:
+                if not await self._flush():
+                    await asyncio.sleep(interval_s)  # back off, events stay buffered
+                    break
+                if len(self._buffer) < self.batch_size:
+                    break
+
+    async def _flush(self) -> bool:
+        count = min(len(self._buffer), self.batch_size)
+        if count == 0:
+            return True
+        batch = [self._buffer.popleft() for _ in range(count)]
+        self._in_flight = count
+
+        grouped: Dict[str, List[Any]] = {}
+        for key_name, payload in batch:
+            grouped.setdefault(key_name, []).append(payload)
+
+        start = time.perf_counter()
+        try:
+            async with self._redis.pipeline(transaction=False) as pipe:
+                for key_name, values in grouped.items():
+                    if self.transport == "stream":
+                        for value in values:
+                            pipe.xadd(
+                                key_name, {COLOR_STREAM_FIELD: value},
+                                maxlen=self.stream_max_len or None, approximate=True)
+                    else:
+                        pipe.lpush(key_name, *values)
+                await pipe.execute()
+        except Exception as e:  # pylint: disable=broad-except
+            self._in_flight = 0
+            self._failed_flushes += 1
+            self.logger.error("Failed to publish %d events: %s", count, e)
+            self._buffer.extendleft(reversed(batch))  # keep the original order for the retry
+            while len(self._buffer) > self.buffer_size and self.overflow_policy != "block":
+                if self.overflow_policy == "drop_newest":
+                    self._buffer.pop()
+                else:
+                    self._buffer.popleft()
+                self._drop(1, "overflow")
+            return False
+
+        self._in_flight = 0
+        took_s = time.perf_counter() - start
+        self.flush_seconds.observe(took_s)
+        self.flush_events.observe(count)
+        took_ms = took_s * 1_000
+        self._flushes += 1
+        self._published += count
+        self._last_flush_ms = took_ms
+        self._max_flush_ms = max(took_ms, self._max_flush_ms)
+        self._total_flush_ms += took_ms
+        await self._notify_space()  # only now: a failed batch takes its room back
+        return True
+
+    def _drop(self, count: int, reason: str) -> None:
+        self._dropped += count
+        self.dropped_events[reason].inc(count)
+
+    async def _notify_space(self) -> None:
+        async with self._space:
+            self._space.notify_all()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "depth": len(self._buffer),
+            "max_depth": self._max_depth,
+            "buffer_size": self.buffer_size,
+            "overflow_policy": self.overflow_policy,
+            "transport": self.transport,
+            "enqueued": self._enqueued,
+            "published": self._published,
+            "dropped": self._dropped,
+            "flushes": self._flushes,
+            "failed_flushes": self._failed_flushes,
+            "last_flush_ms": round(self._last_flush_ms, 3),
+            "max_flush_ms": round(self._max_flush_ms, 3),
+            "avg_flush_ms": round(self._total_flush_ms / self._flushes, 3) if self._flushes else 0,
+        }
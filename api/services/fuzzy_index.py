@@ -0,0 +1,103 @@
+from collections import Counter
+from itertools import chain
+from typing import Dict, List, Sequence, Tuple
+
+
+Suggestion = Tuple[str, int, float]  # name, edit distance, score in [0, 1]
+
+
+def _grams(word: str) -> List[str]:
+    # padded trigrams, "blue" -> "  b", " bl", "blu", "lue", "ue ". The padding weights the start
+    # of a word, typos tend to be at the end
+    padded = f"  {word} "
+    return [padded[i:i + 3] for i in range(len(padded) - 2)]
+
+
+def _pattern(word: str) -> Dict[str, int]:
+    # bit i of pattern[c] is set when word[i] == c
+    pattern: Dict[str, int] = {}
+    for i, c in enumerate(word):
+        pattern[c] = pattern.get(c, 0) | (1 << i)
+    return pattern
+
+
+def edit_distance(  # pylint: disable=too-many-locals
+    word: str, other: str, pattern: Dict[str, int] | None = None
+) -> int:
+    # edit distance where swapping 2 adjacent letters is 1 typo (optimal string alignment).
+    # Bit-parallel, a whole column of the DP matrix per letter of other (Hyyro 2003)
+    m = len(word)
+    if m == 0:
+        return len(other)
+    if pattern is None:
+        pattern = _pattern(word)
+    mask = (1 << m) - 1
+    last = 1 << (m - 1)
+    vp, vn, d0, prev_x, distance = mask, 0, 0, 0, m
+    for c in other:
+        x = pattern.get(c, 0)
+        swap = (((~d0) & x) << 1) & prev_x
+        d0 = ((((x & vp) + vp) ^ vp) | x | vn | swap) & mask
+        hp = vn | (~(d0 | vp) & mask)
+        hn = d0 & vp
+        if hp & last:
+            distance += 1
+        elif hn & last:
+            distance -= 1
+        hp = ((hp << 1) | 1) & mask
+        hn = (hn << 1) & mask
+        vp = hn | (~(d0 | hp) & mask)
+        vn = hp & d0
+        prev_x = x
+    return distance
+
+
+class FuzzyNameIndex:
+    # trigram inverted index over the palette names, split by name length. Only names of a
+    # length within the edit bound that share enough trigrams with the input are checked with
+    # the edit distance. A lookup stays well under a millisecond for 10k+ names
+    def __init__(self, names: Sequence[str], max_distance: int = 2, max_candidates: int = 32):
+        self.names = list(names)
+        self.max_distance = max_distance
+        self.max_candidates = max_candidates
+        self._postings: Dict[Tuple[str, int], List[int]] = {}
+        for i, name in enumerate(self.names):
+            for gram in set(_grams(name)):
+                self._postings.setdefault((gram, len(name)), []).append(i)
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def bound(self, word: str) -> int:
+        # 1 typo in short words, "red" must not turn into any 3 letter color
+        return min(self.max_distance, max(1, len(word) // 3))
+
+    def search(self, word: str, limit: int = 5) -> List[Suggestion]:
+        # ranked by distance, then by shared trigrams, then palette order
+        word = word.strip().lower()
+        if len(word) < 3 or self.max_distance <= 0:  # too short to guess what was meant
+            return []
+        bound = self.bound(word)
+        grams = sorted(set(_grams(word)))  # fixed order, ties rank the same in every process
+        postings = self._postings
+        lengths = sorted(range(max(1, len(word) - bound), len(word) + bound + 1),
+                         key=lambda n: abs(n - len(word)))  # closest first, they win ties
+        shared: Counter[int] = Counter(chain.from_iterable(
+            postings[key] for key in ((g, n) for n in lengths for g in grams) if key in postings))
+        # an edit changes at most 3 trigrams (4 for a swap), names sharing fewer are too far
+        threshold = max(1, len(grams) - 4 * bound)
+        pattern = _pattern(word)
+
+        found: List[Tuple[int, int, int]] = []
+        top = self.max_candidates if len(shared) > self.max_candidates else None  # None: sort
+        for i, count in shared.most_common(top):
+            if count < threshold:
+                break
+            distance = edit_distance(word, self.names[i], pattern)
+            if distance <= bound:
+                found.append((distance, -count, i))
+        found.sort()
+        return [
+            (self.names[i], d, round(1 - d / max(len(word), len(self.names[i])), 3))
+            for d, _, i in found[:limit]
+        ]
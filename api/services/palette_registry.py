@@ -0,0 +1,175 @@
+import asyncio
+import os
+import re
+import sys
+import threading
+import time
+from typing import Any, Dict, List
+from services.color_index import ColorIndex
+from services.color_space import NearestColorIndex
+from services.fuzzy_index import FuzzyNameIndex
+from services.response_encoder import ResponseEncoder, color_fragments
+from logger_factory import get_logger
+from metrics import REGISTRY
+
+
+class UnknownPaletteError(LookupError):
+    pass
+
+
+class Palette:  # pylint: disable=too-many-instance-attributes
+    # everything the matcher needs for one palette, built once & never mutated. A reload builds
+    # a new Palette and swaps the reference, requests holding the old one finish with it
+    def __init__(
+        self, name: str, source_path: str, snapshot_path: str, nearest_space: str,
+        fuzzy_max_distance: int
+    ):
+        self.name = name
+        self.source_path = source_path
+        self.mtime = os.stat(source_path).st_mtime
+        self.index = ColorIndex.load(source_path, snapshot_path)
+        self.nearest_index = NearestColorIndex.from_points(
+            self.index.rgb, self.index.lab if nearest_space == "lab" else self.index.rgb,
+            nearest_space)
+        self.names: List[str] = self.index.family_names()  # materialized once, read only
+        self.fuzzy_index = FuzzyNameIndex(self.names, fuzzy_max_distance)
+        self.version = self.index.source_hash.hex()[:12]
+        self.key = f"{name}@{self.version}"  # changes with the content, scopes cached results
+        # response bytes that only change with the palette, SEE: response_encoder.py
+        self.color_json = color_fragments(self.index)
+        self.names_json = ResponseEncoder.names(self.names)
+        self.names_etag = f'"{name}-{self.version}"'
+        self.loaded_at = time.time()
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "version": self.version,
+            "families": self.index.families,
+            "colors": self.index.rows,
+            "loaded_at": self.loaded_at,
+        }
+
+
+class PaletteRegistry:
+    # every *.json file in the palette directory is a palette named after the file. Readers only
+    # ever load the dict reference, a (re)load builds a new dict & swaps it in one assignment
+    palette_dir: str = os.getenv(
+        "API_PALETTE_DIR", os.path.join(os.path.dirname(__file__), "palettes"))
+    snapshot_dir: str = os.getenv("API_COLOR_INDEX_DIR", "")  # "" is next to each JSON palette
+    default_name: str = os.getenv("API_DEFAULT_PALETTE", "open_colors")
+    reload_s: float = float(os.getenv("API_PALETTE_RELOAD_S", "0"))  # 0 turns polling off
+    nearest_space: str = os.getenv("API_NEAREST_SPACE", "lab").lower()
+    fuzzy_max_distance: int = int(os.getenv("API_FUZZY_MAX_DISTANCE", "2"))  # 0 turns it off
+    re_name = re.compile(r"^[a-z0-9_-]{1,64}$")
+    _palettes: Dict[str, Palette] = {}
+    _failed: Dict[str, float] = {}  # mtime of files that failed, retried once they change
+    _lock = threading.Lock()  # serializes (re)loads, never taken by readers
+    _task: asyncio.Task | None = None
+    logger = get_logger(__name__)
+    reloads = REGISTRY.counter("color_api_palette_reloads", "Palettes (re)loaded", result="ok")
+    failed_reloads = REGISTRY.counter(
+        "color_api_palette_reloads", "Palettes (re)loaded", result="failed")
+
+    @classmethod
+    def _sources(cls) -> Dict[str, str]:
+        sources: Dict[str, str] = {}
+        for file_name in sorted(os.listdir(cls.palette_dir)):
+            name, ext = os.path.splitext(file_name)
+            if ext == ".json" and cls.re_name.match(name):
+                sources[name] = os.path.join(cls.palette_dir, file_name)
+        return sources
+
+    @classmethod
+    def _build(cls, name: str, source_path: str) -> Palette:
+        snapshot_dir = cls.snapshot_dir or os.path.dirname(source_path)
+        return Palette(
+            name, source_path, os.path.join(snapshot_dir, f"{name}.cidx"), cls.nearest_space,
+            cls.fuzzy_max_distance)
+
+    @classmethod
+    def load(cls) -> None:
+        # blocking, once at startup. A palette that fails to load is skipped, the default one
+        # has to load
+        if len(cls._palettes) > 0:
+            return
+        cls.refresh()
+        if cls.default_name not in cls._palettes:
+            raise UnknownPaletteError(
+                f"Default palette {cls.default_name} not found in {cls.palette_dir}")
+
+    @classmethod
+    def refresh(cls) -> List[str]:
+        # blocking, run it off the event loop. Picks up new, changed & deleted palette files and
+        # returns the names of the palettes that were (re)built
+        with cls._lock:
+            sources = cls._sources()
+            palettes = {
+                name: p for name, p in cls._palettes.items()
+                if name in sources or name == cls.default_name}  # the default is never dropped
+            changed: List[str] = []
+            for name, path in sources.items():
+                current = palettes.get(name)
+                mtime = -1.0
+                try:
+                    mtime = os.stat(path).st_mtime
+                    if (current is not None and current.mtime == mtime) \
+                            or cls._failed.get(name) == mtime:
+                        continue
+                    palettes[name] = cls._build(name, path)
+                    cls._failed.pop(name, None)
+                    changed.append(name)
+                    cls.reloads.inc()
+                except (OSError, ValueError) as e:  # keeps serving the previous version
+                    cls._failed[name] = mtime
+                    cls.failed_reloads.inc()
+                    cls.logger.error("Failed to load palette %s from %s: %s", name, path, e)
+            cls._palettes = palettes
+        if len(changed) > 0:
+            cls.logger.info("Loaded palettes: %s", ", ".join(changed))
+        return changed
+
+    @classmethod
+    def get(cls, name: str | None = None) -> Palette:
+        palettes = cls._palettes
+        if len(palettes) == 0:
+            cls.load()
+            palettes = cls._palettes
+        palette = palettes.get(name or cls.default_name)
+        if palette is None:
+            raise UnknownPaletteError(f"Unknown palette: {name}")
+        return palette
+
+    @classmethod
+    def describe(cls) -> List[Dict[str, Any]]:
+        return [p.describe() for p in cls._palettes.values()]
+
+    @classmethod
+    def start(cls) -> None:
+        if cls._task is None and cls.reload_s > 0:
+            cls._task = asyncio.create_task(cls._watch_loop())
+
+    @classmethod
+    async def stop(cls) -> None:
+        if cls._task is not None:
+            cls._task.cancel()
+            cls._task = None
+
+    @classmethod
+    async def _watch_loop(cls) -> None:
+        # polls the palette files, building a large palette takes a while so it runs on a thread
+        while True:
+            await asyncio.sleep(cls.reload_s)
+            try:
+                await asyncio.to_thread(cls.refresh)
+            except Exception as e:  # pylint: disable=broad-except
+                cls.logger.error("Palette reload failed: %s", e)
+
+
+if __name__ == "__main__":  # build step: python -m services.palette_registry [palette_dir]
+    if len(sys.argv) > 1:
+        PaletteRegistry.palette_dir = sys.argv[1]
+    for _name, _path in PaletteRegistry._sources().items():  # pylint: disable=protected-access
+        ColorIndex.build(
+            _path, os.path.join(
+                PaletteRegistry.snapshot_dir or os.path.dirname(_path), f"{_name}.cidx"))
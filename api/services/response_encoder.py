@@ -0,0 +1,112 @@
+import hashlib
+import os
+from typing import Dict, List, Sequence
+from fastapi import Request, Response, status
+from pydantic import BaseModel
+import orjson
+from services.color_index import ColorIndex
+from shared_schemas import ColorMatched
+
+
+_dumps = orjson.dumps  # pylint: disable=no-member  # C extension, not visible to pylint
+
+
+def _color_tail(hex_value: str) -> bytes:
+    # a ColorMatched JSON object without its leading {"name":..., name depends on the input
+    key = int(hex_value[1:], 16)
+    return (
+        f',"r":{(key >> 16) & 0xFF},"g":{(key >> 8) & 0xFF},"b":{key & 0xFF},'
+        f'"hex":{_dumps(hex_value).decode()}}}').encode()
+
+
+def color_fragments(index: ColorIndex) -> Dict[str, bytes]:
+    # every hex a match can carry: the rows ("#rrggbb") & the shades as written in the palette
+    fragments: Dict[str, bytes] = {}
+    for row in range(index.rows):
+        hex_value = index.row_hex(row)
+        fragments[hex_value] = _color_tail(hex_value)
+    for fam in range(index.families):
+        for i in range(index.shade_count(fam)):
+            hex_value = index.shade(fam, i)
+            if hex_value not in fragments:
+                fragments[hex_value] = _color_tail(hex_value)
+    return fragments
+
+
+class ResponseEncoder:
+    # JSON bodies assembled from bytes pre-encoded when the palette was loaded, with the same
+    # shape & field order as the response models. Endpoints return them as a Response, FastAPI
+    # then skips the response_model validation & serialization (the OpenAPI schema keeps them)
+    names_max_age_s: int = int(os.getenv("API_NAMES_MAX_AGE_S", "60"))
+    media_type = "application/json"
+
+    @staticmethod
+    def matches(fragments: Dict[str, bytes], colors: Sequence[ColorMatched]) -> bytes:
+        parts: List[bytes] = []
+        for color in colors:
+            tail = fragments.get(color.hex)
+            if tail is None:  # not a palette color, encoded in full
+                parts.append(_dumps(color.model_dump()))
+            else:
+                parts.append(b'{"name":' + _dumps(color.name) + tail)
+        return b"[" + b",".join(parts) + b"]"
+
+    @classmethod
+    def color_list(
+        cls, fragments: Dict[str, bytes], inquery: BaseModel, colors: Sequence[ColorMatched]
+    ) -> bytes:
+        # ColorListResponse
+        return (
+            b'{"inquery":' + _dumps(inquery.model_dump()) + b',"count":'
+            + str(len(colors)).encode() + b',"matches":' + cls.matches(fragments, colors) + b"}")
+
+    @classmethod
+    def batch(
+        cls, fragments: Dict[str, bytes], names: Sequence[str],
+        batch: Sequence[Sequence[ColorMatched]]
+    ) -> bytes:
+        # BatchMatchResponse, an item status is 200 or 404 like a single match
+        results: List[bytes] = []
+        found = 0
+        for name, colors in zip(names, batch):
+            found += 1 if len(colors) > 0 else 0
+            results.append(
+                b'{"input":' + _dumps(name) + b',"status":'
+                + (b"200" if len(colors) > 0 else b"404") + b',"count":'
+                + str(len(colors)).encode() + b',"matches":' + cls.matches(fragments, colors)
+                + b"}")
+        return (
+            f'{{"count":{len(results)},"found":{found},"results":['.encode()
+            + b",".join(results) + b"]}")
+
+    @staticmethod
+    def names(names: Sequence[str]) -> bytes:
+        # ColorNamesResponse
+        return _dumps({"count": len(names), "names": list(names)})
+
+    @staticmethod
+    def etag(body: bytes) -> str:
+        return f'"{hashlib.blake2b(body, digest_size=12).hexdigest()}"'
+
+    @staticmethod
+    def not_modified(request: Request, etag: str) -> bool:
+        # If-None-Match uses the weak comparison, W/"x" matches "x"
+        header = request.headers.get("if-none-match")
+        if header is None:
+            return False
+        if header.strip() == "*":
+            return True
+        return any(t.strip().removeprefix("W/") == etag for t in header.split(","))
+
+    @classmethod
+    def respond(
+        cls, request: Request, body: bytes, cache_control: str, etag: str | None = None,
+        status_code: int = status.HTTP_200_OK
+    ) -> Response:
+        # only a 200 gets an ETag, a 304 when the client already holds the same body
+        headers = {"Cache-Control": cache_control}
+        if status_code == status.HTTP_200_OK:
+            headers["ETag"] = etag or cls.etag(body)
+            if cls.not_modified(request, headers["ETag"]):
+                return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+        return Response(body, status_code=status_code, media_type=cls.media_type, headers=headers)
@@ -0,0 +1,22 @@
+import asyncio
+from services.color_matcher import ColorMatcher
+from services.color_matcher_in_thread_pool import ColorMatcherInThreadPool
+
+
+def test_large_palettes_are_matched_on_the_thread_pool() -> None:
+    ColorMatcher.load()
+    matcher = ColorMatcher()
+    assert not matcher.blocking  # the bundled palettes are small
+    ColorMatcher.thread_min_colors = 1
+    try:
+        assert matcher.blocking
+    finally:
+        ColorMatcher.thread_min_colors = 5000
+
+    async def scenario() -> None:
+        pooled = ColorMatcherInThreadPool(matcher.sync)
+        assert await pooled.match("gren5") == await matcher.match("gren5")
+        assert await pooled.nearest((10, 20, 30), 3) == await matcher.nearest((10, 20, 30), 3)
+        assert await pooled.names() == await matcher.names()
+
+    asyncio.run(scenario())
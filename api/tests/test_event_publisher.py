@@ -0,0 +1,118 @@
+import asyncio
+from typing import Any, List
+from redis.exceptions import ConnectionError as RedisConnectionError
+from services.event_publisher import EventPublisher
+
+
+class FlakyRedis:
+    # pipelines fail while down is set, pushed values are kept otherwise
+    def __init__(self) -> None:
+        self.down = True
+        self.delay_s = 0.0  # how long a pipeline takes to fail or succeed
+        self.pushed: List[Any] = []
+
+    def pipeline(self, **_: Any) -> "FlakyPipeline":
+        return FlakyPipeline(self)
+
+
+class FlakyPipeline:
+    def __init__(self, redis: FlakyRedis):
+        self._redis = redis
+        self._values: List[Any] = []
+
+    async def __aenter__(self) -> "FlakyPipeline":
+        return self
+
+    async def __aexit__(self, *exc: Any) -> None:
+        return None
+
+    def lpush(self, _: str, *values: Any) -> "FlakyPipeline":
+        self._values.extend(values)
+        return self
+
+    async def execute(self) -> List[Any]:
+        await asyncio.sleep(self._redis.delay_s)
+        if self._redis.down:
+            raise RedisConnectionError("redis is down")
+        self._redis.pushed.extend(self._values)
+        return []
+
+
+class BlockingPublisher(EventPublisher):
+    batch_size = 2
+    flush_interval_ms = 5
+    buffer_size = 4
+    overflow_policy = "block"
+    transport = "list"
+
+
+def test_block_policy_waits_without_spinning_while_redis_fails() -> None:
+    async def scenario() -> None:
+        redis = FlakyRedis()
+        publisher = BlockingPublisher(redis)  # type: ignore[arg-type]
+        await publisher.publish("q", *[f"e{i}".encode() for i in range(4)])
+        blocked = asyncio.create_task(publisher.publish("q", b"e4"))
+        await asyncio.sleep(0)  # the flusher has a batch in flight, later publishers wait too
+        late = asyncio.create_task(publisher.publish("q", b"e5"))
+
+        # the failing flusher re-queues its batch: the publisher stays blocked, the loop runs
+        ticks = 0
+        for _ in range(20):
+            await asyncio.sleep(0.005)
+            ticks += 1
+        assert ticks == 20
+        assert not blocked.done() and not late.done()
+        assert publisher.stats()["dropped"] == 0
+        assert publisher.stats()["failed_flushes"] > 0
+
+        redis.down = False
+        await asyncio.wait_for(asyncio.gather(blocked, late), timeout=1)
+        await publisher.stop()
+        assert sorted(redis.pushed) == [f"e{i}".encode() for i in range(6)]
+        assert publisher.stats()["dropped"] == 0
+
+    asyncio.run(asyncio.wait_for(scenario(), timeout=5))
+
+
+def test_block_policy_keeps_room_for_a_failing_batch_in_flight() -> None:
+    async def scenario() -> None:
+        redis = FlakyRedis()
+        redis.delay_s = 0.02
+        publisher = BlockingPublisher(redis)  # type: ignore[arg-type]
+        await publisher.publish("q", b"e0", b"e1")  # a full batch, the flusher takes it
+        await asyncio.sleep(0.005)
+        assert publisher.stats()["depth"] == 0
+
+        # 2 events fit next to the batch in flight, the other 2 wait for the failing flush
+        later = [f"e{i}".encode() for i in range(2, 6)]
+        waiting = asyncio.create_task(publisher.publish("q", *later))
+        await asyncio.sleep(0.1)
+        assert not waiting.done()
+        assert publisher.stats()["failed_flushes"] > 0
+        assert publisher.stats()["depth"] <= publisher.buffer_size
+        assert publisher.stats()["dropped"] == 0
+
+        redis.down = False
+        await asyncio.wait_for(waiting, timeout=1)
+        await publisher.stop()
+        assert redis.pushed == [f"e{i}".encode() for i in range(6)]
+        assert publisher.stats()["dropped"] == 0
+
+    asyncio.run(asyncio.wait_for(scenario(), timeout=5))
+
+
+def test_events_published_after_stop_are_counted_as_dropped() -> None:
+    async def scenario() -> None:
+        redis = FlakyRedis()
+        redis.down = False
+        publisher = BlockingPublisher(redis)  # type: ignore[arg-type]
+        await publisher.publish("q", b"e0")
+        await publisher.stop()
+        dropped = EventPublisher.dropped_events["shutdown"].value
+        await publisher.publish("q", b"e1", b"e2")
+        assert redis.pushed == [b"e0"]
+        assert publisher.stats()["enqueued"] == 1
+        assert publisher.stats()["dropped"] == 2
+        assert EventPublisher.dropped_events["shutdown"].value == dropped + 2
+
+    asyncio.run(asyncio.wait_for(scenario(), timeout=5))
@@ -0,0 +1,125 @@
+import asyncio
+import json
+import os
+import time
+from typing import Any, Dict, List, MutableMapping, Tuple
+from common import Result, parse_args, percentile, use_app, write_results
+from stand_ins import MemoryRedis
+
+os.environ.setdefault("EVENT_TRANSPORT", "list")  # the Redis stand-in only speaks lists
+os.environ.setdefault("API_DELAY_MIN", "0")
+os.environ.setdefault("API_DELAY_MAX", "0")
+use_app("api")
+from main import app  # noqa: E402 pylint: disable=C0413
+from services.color_matcher_with_publisher import (  # noqa: E402 pylint: disable=C0413
+    ColorMatcherWithPublisher
+)
+
+
+# name, method, path, query string, body, expected status
+Scenario = Tuple[str, str, str, bytes, bytes, int]
+SCENARIOS: List[Scenario] = [
+    ("match", "GET", "/color/match", b"name=light+blue", b"", 200),
+    ("match_hex_nearest", "GET", "/color/match", b"name=123456&k=3", b"", 200),
+    ("match_miss", "GET", "/color/match", b"name=nope", b"", 404),
+    ("nearest", "GET", "/color/nearest", b"r=10&g=120&b=200&k=3", b"", 200),
+    ("batch_32", "POST", "/color/match/batch", b"", json.dumps({
+        "names": [f"blue {i % 10}" for i in range(30)] + ["fff", "nope"], "k": 1}).encode(), 200),
+    ("names", "GET", "/color/names", b"", b"", 200),
+]
+
+
+async def _request(method: str, path: str, query: bytes, body: bytes) -> int:
+    # calls the ASGI app directly, no sockets & no HTTP client in the measurement
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": method,
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": query,
+        "root_path": "",
+        "headers": [
+            (b"host", b"bench"), (b"user-agent", b"bench/1.0"),
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode())],
+        "client": ("127.0.0.1", 50000),
+        "server": ("bench", 80),
+    }
+    status = [0]
+    sent = [False]
+
+    async def receive() -> Dict[str, Any]:
+        if not sent[0]:
+            sent[0] = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        await asyncio.Event().wait()  # the client never disconnects
+        return {"type": "http.disconnect"}
+
+    async def send(message: MutableMapping[str, Any]) -> None:
+        if message["type"] == "http.response.start":
+            status[0] = message["status"]
+
+    await app(scope, receive, send)
+    return status[0]
+
+
+async def _load(scenario: Scenario, requests: int, concurrency: int) -> Result:
+    _, method, path, query, body, expected = scenario
+    latencies: List[float] = []
+    errors = [0]
+    remaining = [requests]
+
+    async def client() -> None:
+        while remaining[0] > 0:
+            remaining[0] -= 1
+            start = time.perf_counter()
+            code = await _request(method, path, query, body)
+            latencies.append((time.perf_counter() - start) * 1_000)
+            if code != expected:
+                errors[0] += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    return {
+        "value": round(requests / elapsed, 1),
+        "unit": "req/s",
+        "higher_is_better": True,
+        "p50_ms": round(percentile(latencies, 50), 3),
+        "p95_ms": round(percentile(latencies, 95), 3),
+        "p99_ms": round(percentile(latencies, 99), 3),
+        "errors": errors[0],
+    }
+
+
+async def run(
+    requests: int, concurrency: int, warmup: int, redis_latency_ms: float
+) -> Dict[str, Result]:
+    redis = MemoryRedis(redis_latency_ms)
+    # pylint: disable-next=protected-access
+    ColorMatcherWithPublisher._redis = redis  # type: ignore[assignment]
+    results: Dict[str, Result] = {}
+    async with app.router.lifespan_context(app):
+        for scenario in SCENARIOS:
+            await _load(scenario, warmup, concurrency)
+            res = await _load(scenario, requests, concurrency)
+            results[f"api.{scenario[0]}"] = res
+            results[f"api.{scenario[0]}.p99"] = {
+                "value": res["p99_ms"], "unit": "ms", "higher_is_better": False}
+            if res["errors"] > 0:
+                print(f"{scenario[0]}: {res['errors']} unexpected status codes")
+    print(f"redis round-trips: {redis.round_trips}")
+    return results
+
+
+def main() -> None:
+    args = parse_args("api", requests=5_000, concurrency=32, warmup=200, redis_latency_ms=0.2)
+    results = asyncio.run(run(args.requests, args.concurrency, args.warmup, args.redis_latency_ms))
+    write_results("api", args.out, results, vars(args))
+
+
+if __name__ == "__main__":
+    main()
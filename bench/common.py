@@ -0,0 +1,98 @@
+import argparse
+from datetime import datetime, timezone
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from typing import Any, Callable, Dict, List
+
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(REPO_ROOT, "bench", "results")
+
+Result = Dict[str, Any]  # {"value": float, "unit": str, "higher_is_better": bool, ...extras}
+
+
+def use_app(app_dir: str) -> None:
+    # api & worker both ship a `main` module & a `services` package, one app per benchmark process
+    for path in (os.path.join(REPO_ROOT, app_dir), os.path.join(REPO_ROOT, "shared_lib")):
+        if path not in sys.path:
+            sys.path.insert(0, path)
+
+
+def _int_list(value: str) -> List[int]:
+    return [int(v) for v in value.split(",") if v.strip()]
+
+
+def parse_args(suite: str, **defaults: Any) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=f"{suite} benchmark")
+    parser.add_argument("--out", default=os.path.join(RESULTS_DIR, f"{suite}.json"),
+                        help="where to write the JSON results")
+    for name, value in defaults.items():
+        kind = _int_list if isinstance(value, list) else type(value)
+        parser.add_argument(f"--{name.replace('_', '-')}", type=kind, default=value)
+    return parser.parse_args()
+
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    idx = min(int(round(pct / 100 * (len(ordered) - 1))), len(ordered) - 1)
+    return ordered[idx]
+
+
+def measure(run_round: Callable[[], Any], number: int, rounds: int, warmup: int = 2) -> Result:
+    # run_round performs `number` operations. Reported numbers are per operation, the median of
+    # `rounds` rounds is the headline value as it is the least sensitive to a noisy neighbour
+    for _ in range(warmup):
+        run_round()
+    per_op: List[float] = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        run_round()
+        per_op.append((time.perf_counter() - start) / number * 1_000_000)
+    return {
+        "value": round(percentile(per_op, 50), 4),
+        "unit": "us/op",
+        "higher_is_better": False,
+        "min": round(min(per_op), 4),
+        "p95": round(percentile(per_op, 95), 4),
+        "rounds": rounds,
+        "number": number,
+    }
+
+
+def _commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT, capture_output=True,
+            text=True, check=True, timeout=5).stdout.strip()
+    except Exception:  # pylint: disable=broad-except
+        return ""
+
+
+def write_results(suite: str, out: str, results: Dict[str, Result], params: Dict[str, Any]) -> None:
+    doc = {
+        "suite": suite,
+        "created": datetime.now(timezone.utc).isoformat(),
+        "env": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "machine": platform.machine(),
+            "cpus": os.cpu_count(),
+            "commit": _commit(),
+        },
+        "params": params,
+        "results": results,
+    }
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump(doc, f, indent=2)
+        f.write("\n")
+    width = max((len(k) for k in results), default=0)
+    for key, res in results.items():
+        print(f"{suite:8} {key:{width}}  {res['value']:>12.3f} {res['unit']}")
+    print(f"results written to {out}")
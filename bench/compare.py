@@ -0,0 +1,64 @@
+import argparse
+import json
+import os
+import sys
+from typing import Any, Dict, List, Tuple
+
+
+def _load(path: str) -> Dict[str, Any]:
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _pairs(base: str, new: str) -> List[Tuple[str, str]]:
+    # either 2 result files or 2 result directories, matched by file name
+    if os.path.isdir(base) and os.path.isdir(new):
+        return [(os.path.join(base, name), os.path.join(new, name))
+                for name in sorted(os.listdir(new))
+                if name.endswith(".json") and os.path.isfile(os.path.join(base, name))]
+    return [(base, new)]
+
+
+def compare(base: Dict[str, Any], new: Dict[str, Any], threshold: float) -> int:
+    regressions = 0
+    base_res = base.get("results", {})
+    print(f"{new.get('suite', '')}: {base.get('env', {}).get('commit') or '?'} -> "
+          f"{new.get('env', {}).get('commit') or '?'}")
+    for key, res in new.get("results", {}).items():
+        old = base_res.get(key)
+        if old is None or not old.get("value"):
+            print(f"  {key:32} {'':>12} {res['value']:>12.3f} {res['unit']:8} new")
+            continue
+        change = (res["value"] - old["value"]) / old["value"]
+        worse = -change if res.get("higher_is_better") else change  # > 0 means slower / bigger
+        flag = ""
+        if worse > threshold:
+            flag = "REGRESSION"
+            regressions += 1
+        elif worse < -threshold:
+            flag = "improved"
+        print(f"  {key:32} {old['value']:>12.3f} {res['value']:>12.3f} {res['unit']:8} "
+              f"{change:+8.1%} {flag}")
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Compare benchmark results, exits with 1 when anything regressed")
+    parser.add_argument("base", help="baseline result file or directory")
+    parser.add_argument("new", help="new result file or directory")
+    parser.add_argument("--threshold", type=float, default=0.1,
+                        help="relative change that counts as a regression (default: 0.1 = 10%%)")
+    args = parser.parse_args()
+
+    regressions = 0
+    for base, new in _pairs(args.base, args.new):
+        regressions += compare(_load(base), _load(new), args.threshold)
+    if regressions > 0:
+        print(f"{regressions} regression(s) above {args.threshold:.0%}")
+        sys.exit(1)
+    print("no regressions")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+import asyncio
+import base64
+import pickle
+from typing import Any, Callable, Dict
+from common import Result, measure, parse_args, use_app, write_results
+
+use_app("api")
+from services.color_matcher import ColorMatcher  # noqa: E402 pylint: disable=C0413
+from shared_schemas import ColorMatched, EventCodec  # noqa: E402 pylint: disable=C0413
+
+
+# one input per branch of ColorMatcher.find
+MATCH_INPUTS: Dict[str, str] = {
+    "exact": "blue",
+    "numbered": "blue 5",
+    "modifier": "light blue",
+    "short_hex": "fff",
+    "hex": "#339af0",
+    "hex_nearest": "123456",
+    "rgb": "10,120,200",
+    "fuzzy": "gren5",
+    "miss": "nope",
+}
+
+EVENT: Dict[str, Any] = {
+    "user": "bench",
+    "run": "run-1",
+    "input": "blue",
+    "request": {
+        "url": "http://localhost:8000/color/match?name=blue",
+        "query": {"name": "blue"},
+        "headers": {"host": "localhost:8000", "user-agent": "bench/1.0", "accept": "*/*"},
+    },
+    "colors": [
+        ColorMatched(name=f"blue{i}", hex="#339af0", r=51, g=154, b=240) for i in range(3)],
+}
+
+
+def _match_round(
+    loop: asyncio.AbstractEventLoop, matcher: ColorMatcher, name: str, number: int
+) -> Callable[[], None]:
+    async def _match() -> None:
+        for _ in range(number):
+            await matcher.match(name)
+
+    return lambda: loop.run_until_complete(_match())
+
+
+def main() -> None:
+    args = parse_args("micro", number=2_000, rounds=15)
+    loop = asyncio.new_event_loop()
+    matcher = ColorMatcher()
+    results: Dict[str, Result] = {}
+
+    for case, name in MATCH_INPUTS.items():
+        results[f"match.{case}"] = measure(
+            _match_round(loop, matcher, name, args.number), args.number, args.rounds)
+
+    encoded = EventCodec.encode(EVENT)
+    legacy = base64.b64encode(pickle.dumps(dict(EVENT)))
+
+    def _encode() -> None:
+        for _ in range(args.number):
+            EventCodec.encode(EVENT)
+
+    def _decode() -> None:
+        for _ in range(args.number):
+            EventCodec.decode(encoded)
+
+    def _decode_legacy() -> None:
+        for _ in range(args.number):
+            EventCodec.decode(legacy)
+
+    results["codec.encode"] = measure(_encode, args.number, args.rounds)
+    results["codec.decode"] = measure(_decode, args.number, args.rounds)
+    results["codec.decode_legacy"] = measure(_decode_legacy, args.number, args.rounds)
+    results["codec.event_bytes"] = {
+        "value": len(encoded), "unit": "bytes", "higher_is_better": False}
+    loop.close()
+    write_results("micro", args.out, results, vars(args))
+
+
+if __name__ == "__main__":
+    main()
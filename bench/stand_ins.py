@@ -0,0 +1,129 @@
+import asyncio
+from collections import deque
+from typing import Any, Deque, Dict, List, Sequence, Tuple
+
+
+class MemoryRedis:
+    # just enough of redis.asyncio for the list transport: LPUSH, LLEN, BLMPOP & pipelines.
+    # Keeps the benchmark about our code, not about the network or the Redis server
+    def __init__(self, latency_ms: float = 0):
+        self.lists: Dict[str, Deque[bytes]] = {}
+        self.latency_s = latency_ms / 1_000  # added to every round-trip
+        self.round_trips = 0
+
+    async def _round_trip(self) -> None:
+        self.round_trips += 1
+        await asyncio.sleep(self.latency_s)  # also yields, like a socket read would
+
+    def _lpush(self, name: str, *values: Any) -> int:
+        items = self.lists.setdefault(name, deque())
+        for value in values:
+            items.appendleft(value if isinstance(value, bytes) else str(value).encode())
+        return len(items)
+
+    async def lpush(self, name: str, *values: Any) -> int:
+        await self._round_trip()
+        return self._lpush(name, *values)
+
+    async def llen(self, name: str) -> int:
+        await self._round_trip()
+        return len(self.lists.get(name) or ())
+
+    async def blmpop(
+        self, timeout: float, numkeys: int, *keys: str, direction: str = "RIGHT", count: int = 1
+    ) -> List[Any] | None:
+        del numkeys
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while True:
+            await self._round_trip()
+            for key in keys:
+                items = self.lists.get(key)
+                if items:
+                    pop = items.pop if direction == "RIGHT" else items.popleft
+                    return [key.encode(), [pop() for _ in range(min(count, len(items)))]]
+            if loop.time() >= deadline:
+                return None
+            await asyncio.sleep(0.001)  # a real BLMPOP would be woken up by the next push
+
+    def pipeline(self, transaction: bool = True) -> "MemoryPipeline":
+        del transaction
+        return MemoryPipeline(self)
+
+    async def aclose(self) -> None:
+        return
+
+
+class MemoryPipeline:
+    def __init__(self, redis: MemoryRedis):
+        self._redis = redis
+        self._ops: List[Tuple[str, Sequence[Any]]] = []
+
+    async def __aenter__(self) -> "MemoryPipeline":
+        return self
+
+    async def __aexit__(self, *exc: Any) -> None:
+        self._ops = []
+
+    def lpush(self, name: str, *values: Any) -> "MemoryPipeline":
+        self._ops.append((name, values))
+        return self
+
+    async def execute(self) -> List[Any]:
+        await self._redis._round_trip()  # pylint: disable=protected-access
+        res = [self._redis._lpush(name, *values) for name, values in self._ops]  # noqa pylint: disable=protected-access
+        self._ops = []
+        return res
+
+
+class MemoryPgConnection:
+    # accepts what BatchWriter sends: COPY for list events, executemany for stream events
+    def __init__(self, latency_ms: float = 0, per_row_us: float = 0):
+        self.latency_s = latency_ms / 1_000
+        self.per_row_s = per_row_us / 1_000_000
+        self.rows = 0
+        self.statements = 0
+
+    async def _statement(self, records: Sequence[Any]) -> None:
+        self.statements += 1
+        await asyncio.sleep(self.latency_s + self.per_row_s * len(records))
+        self.rows += len(records)
+
+    async def copy_records_to_table(self, table: str, **kwargs: Any) -> str:
+        del table
+        records = list(kwargs.get("records") or [])
+        await self._statement(records)
+        return f"COPY {len(records)}"
+
+    async def executemany(self, query: str, records: Sequence[Any]) -> None:
+        del query
+        await self._statement(list(records))
+
+    def is_closed(self) -> bool:
+        return False
+
+
+class MemoryPgPool:
+    def __init__(self, latency_ms: float = 0, per_row_us: float = 0):
+        self._latency_ms = latency_ms
+        self._per_row_us = per_row_us
+        self.connections: List[MemoryPgConnection] = []
+
+    @property
+    def rows(self) -> int:
+        return sum(c.rows for c in self.connections)
+
+    @property
+    def statements(self) -> int:
+        return sum(c.statements for c in self.connections)
+
+    async def acquire(self) -> MemoryPgConnection:
+        conn = MemoryPgConnection(self._latency_ms, self._per_row_us)
+        self.connections.append(conn)
+        return conn
+
+    async def release(self, conn: MemoryPgConnection) -> None:
+        del conn
+
+    async def close(self) -> None:
+        return
@@ -0,0 +1,87 @@
+import asyncio
+import os
+import time
+from typing import Dict, List
+from common import Result, parse_args, use_app, write_results
+from stand_ins import MemoryPgPool, MemoryRedis
+
+os.environ.setdefault("EVENT_TRANSPORT", "list")  # the Redis stand-in only speaks lists
+os.environ.setdefault("WORKER_DELAY_MIN", "0")
+os.environ.setdefault("WORKER_DELAY_MAX", "0")
+use_app("worker")
+from services.color_consumer import ColorConsumer  # noqa: E402 pylint: disable=C0413
+from services.pg_pool import PgPool  # noqa: E402 pylint: disable=C0413
+from shared_schemas import COLOR_LIST_NAME, EventCodec  # noqa: E402 pylint: disable=C0413
+
+
+def _events(count: int) -> List[bytes]:
+    return [EventCodec.encode({
+        **dict(zip(("event_id", "published_at"), EventCodec.stamp())),
+        "user": "bench",
+        "run": f"run-{i % 10}",
+        "input": "light blue",
+        "request": {
+            "url": "http://localhost:8000/color/match?name=light+blue",
+            "query": {"name": "light blue"},
+            "headers": {"user-agent": "bench/1.0"},
+        },
+        "colors": [{"name": "blue0", "r": 231, "g": 245, "b": 255, "hex": "#e7f5ff"}],
+    }) for i in range(count)]
+
+
+async def _drain(
+    events: List[bytes], threads: int, redis_latency_ms: float, db_latency_ms: float,
+    db_row_us: float
+) -> Result:
+    # pre-fills the queue, then times the consumers from the first pop to the last row written
+    redis = MemoryRedis(redis_latency_ms)
+    pool = MemoryPgPool(db_latency_ms, db_row_us)
+    await redis.lpush(COLOR_LIST_NAME, *events)
+    ColorConsumer._redis = redis  # type: ignore[assignment] # pylint: disable=protected-access
+    PgPool._pool = pool  # type: ignore[assignment] # pylint: disable=protected-access
+
+    consumers = [ColorConsumer(task_id=i, empty_delay_s=0) for i in range(threads)]
+    start = time.perf_counter()
+    tasks = [asyncio.create_task(c.pull_event_loop()) for c in consumers]
+    while pool.rows < len(events):
+        await asyncio.sleep(0.001)
+    elapsed = time.perf_counter() - start
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    for consumer in consumers:
+        await consumer.cleanup()
+    return {
+        "value": round(len(events) / elapsed, 1),
+        "unit": "events/s",
+        "higher_is_better": True,
+        "seconds": round(elapsed, 4),
+        "db_statements": pool.statements,
+        "redis_round_trips": redis.round_trips,
+    }
+
+
+async def run(
+    events: int, threads: List[int], redis_latency_ms: float, db_latency_ms: float,
+    db_row_us: float
+) -> Dict[str, Result]:
+    payloads = _events(events)
+    await _drain(payloads[:min(len(payloads), 1_000)], 1, 0, 0, 0)  # warm up
+    results: Dict[str, Result] = {}
+    for n in threads:
+        results[f"worker.threads_{n}"] = await _drain(
+            payloads, n, redis_latency_ms, db_latency_ms, db_row_us)
+    return results
+
+
+def main() -> None:
+    args = parse_args(
+        "worker", events=20_000, threads=[1, 4], redis_latency_ms=0.2, db_latency_ms=2.0,
+        db_row_us=2.0)
+    results = asyncio.run(run(
+        args.events, args.threads, args.redis_latency_ms, args.db_latency_ms, args.db_row_us))
+    write_results("worker", args.out, results, vars(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,38 @@
 -- setup a single table to track match results
 
+-- range partitioned on created_at, one partition per day (or week). The worker creates upcoming
+-- partitions ahead of time & drops the ones past the retention, SEE: ../worker/services/partition_manager.py
+-- Dropping a partition is a metadata change, no DELETE, no dead rows left to vacuum.
+-- Existing databases keep their unpartitioned table, this file only runs on an empty volume
 create table if not exists color_matches (
-    id serial primary key,
+    id bigserial not null,
+    created_at timestamptz not null default now(),
     usr varchar(64) not null,
     run varchar(64) not null,
     input text not null,
-    body jsonb not null
-);
+    body jsonb not null,
+    stream_id varchar(32), -- redis stream entry id, null when events come from a redis list
+    event_id uuid, -- set by the API when it publishes the event, null for older events
+    published_at timestamptz, -- by the API host clock
+    popped_at timestamptz, -- by the worker host clock, when the event left redis
+    committed_at timestamptz default clock_timestamp(), -- by the database, when the row was written
+    primary key (id, created_at) -- unique constraints must include the partition key
+) partition by range (created_at);
 
-create index if not exists color_matches_usr_idx on color_matches (usr);
+-- catches rows no partition covers yet, the worker moves them out when it creates the partition
+create table if not exists color_matches_default partition of color_matches default;
 
-create index if not exists color_matches_run_idx on color_matches (run);
\ No newline at end of file
+-- every index below is created on each partition, so each one only covers a day (or week).
+-- Stream entries get created_at from their entry id, a re-delivered entry has the same
+-- (stream_id, created_at) & is inserted at most once (nulls do not collide)
+create unique index if not exists color_matches_stream_idx
+    on color_matches (stream_id, created_at);
+
+-- rows arrive in time order, a BRIN index is a few pages per partition & nearly free to maintain
+create index if not exists color_matches_created_idx on color_matches using brin (created_at);
+
+-- (usr, id) & (run, id): a keyset page "where usr = $1 and id > $2 order by id limit n" is one
+-- index range scan per partition, merged in id order, no sort
+create index if not exists color_matches_usr_idx on color_matches (usr, id);
+
+create index if not exists color_matches_run_idx on color_matches (run, id);
@@ -0,0 +1,23 @@
+-- hourly counters kept by the worker while it consumes events, SEE: ../worker/services/rollup_aggregator.py
+-- Dashboards read these instead of aggregating color_matches.body, and they outlive the raw
+-- partitions dropped by the retention
+
+-- top match of every event that found one
+create table if not exists color_match_rollups (
+    bucket timestamptz not null, -- start of the hour
+    usr varchar(64) not null,
+    run varchar(64) not null,
+    color varchar(64) not null,
+    matches bigint not null,
+    primary key (bucket, usr, run, color)
+);
+
+-- inputs that matched nothing
+create table if not exists color_miss_rollups (
+    bucket timestamptz not null,
+    usr varchar(64) not null,
+    run varchar(64) not null,
+    input text not null,
+    misses bigint not null,
+    primary key (bucket, usr, run, input)
+);
@@ -0,0 +1,37 @@
+-- brings a color_matches table created by an older 000_schema.sql up to date. The init scripts
+-- only run on an empty volume, the worker runs this one at every startup, SEE: ../worker/services/schema_migrator.py
+-- A column that exists is not touched & takes no lock. The table stays unpartitioned
+
+do $$
+declare
+    col record;
+begin
+    for col in select * from (values
+        ('stream_id', 'varchar(32)'),
+        ('created_at', 'timestamptz not null default now()'), -- now() is stable, no rewrite
+        ('event_id', 'uuid'),
+        ('published_at', 'timestamptz'),
+        ('popped_at', 'timestamptz'),
+        ('committed_at', 'timestamptz')) as c (name, definition)
+    loop
+        if not exists (
+            select 1 from information_schema.columns
+            where table_schema = current_schema() and table_name = 'color_matches'
+                and column_name = col.name
+        ) then
+            execute format(
+                'alter table color_matches add column %I %s', col.name, col.definition);
+        end if;
+    end loop;
+    -- set apart: a volatile default on the add would rewrite the table, old rows keep a null
+    if (
+        select column_default from information_schema.columns
+        where table_schema = current_schema() and table_name = 'color_matches'
+            and column_name = 'committed_at'
+    ) is null then
+        alter table color_matches alter column committed_at set default clock_timestamp();
+    end if;
+end $$;
+
+-- the (stream_id, created_at), (usr, id) & (run, id) indexes are built by the worker with
+-- create index concurrently, which cannot run in a transaction or a do block
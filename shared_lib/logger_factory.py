@@ -1,9 +1,15 @@
+from datetime import datetime, timezone
+import json
 import logging
+from logging.handlers import QueueHandler, QueueListener
 import os
+import queue
 import socket
+from typing import Any, Dict, IO
 
 
 host_name = socket.gethostname()
+_host_fmt = host_name.replace("%", "%%")  # baked into the format strings once, not per record
 
 
 class CustomFormatter(logging.Formatter):
@@ -22,32 +28,96 @@ class CustomFormatter(logging.Formatter):
         return log_message
 
 
-def log_config() -> dict | None:
-    fmt = os.getenv("LOG_FORMAT", "")
-    if fmt is None or fmt == "":
-        return None
-
+class JsonFormatter(logging.Formatter):
+    # one JSON object per line. uvicorn access records keep their fields instead of a request line
+    access_fields = ("client", "method", "path", "http_version", "status")
+
+    def format(self, record: logging.LogRecord) -> str:
+        doc: Dict[str, Any] = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(
+                timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "host": host_name,
+            "msg": record.getMessage(),
+        }
+        if record.name == "uvicorn.access" and isinstance(record.args, tuple) \
+                and len(record.args) == len(self.access_fields):
+            doc.update(zip(self.access_fields, record.args))
+        if record.exc_info:
+            doc["exc"] = self.formatException(record.exc_info)
+        if record.stack_info:
+            doc["stack"] = self.formatStack(record.stack_info)
+        return json.dumps(doc, ensure_ascii=False, default=str)
+
+
+class BackgroundQueueHandler(QueueHandler):
+    # the calling thread (the event loop) only enqueues the record. Formatting & the blocking
+    # write to the stream run on the listener thread
+    immutable = (str, int, float, bool, bytes, type(None))
+
+    def __init__(self, handler: logging.Handler):
+        super().__init__(queue.SimpleQueue())
+        self._listener: QueueListener | None = QueueListener(self.queue, handler)
+        self._listener.start()
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # args are formatted later on another thread. Only resolve the message now when an
+        # argument could be mutated by the caller in the meantime (dicts, lists, models...)
+        args = record.args
+        if args and (not isinstance(args, tuple)
+                     or not all(isinstance(a, self.immutable) for a in args)):
+            record.msg = record.getMessage()
+            record.args = None
+        return record
+
+    def close(self) -> None:
+        if self._listener is not None:
+            self._listener.stop()  # drains what is still queued
+            self._listener = None
+        super().close()
+
+
+def log_format() -> str:
+    # "" keeps the uvicorn console look, "text" adds timestamps & logger names, "json" is structured
+    return os.getenv("LOG_FORMAT", "").strip().lower()
+
+
+def _formatter(access: bool) -> logging.Formatter:
+    fmt = log_format()
+    if fmt == "json":
+        return JsonFormatter()
+    if fmt != "":
+        return logging.Formatter(
+            f"%(asctime)s [%(levelname)s] @{_host_fmt} %(name)s: %(message)s", "%Y-%m-%d %H:%M:%S")
+    from uvicorn.logging import AccessFormatter, DefaultFormatter  # pylint: disable=C0415
+    if access:
+        return AccessFormatter(
+            '%(levelprefix)s %(client_addr)s - "%(request_line)s" %(status_code)s')
+    return DefaultFormatter(f"%(levelprefix)s @{_host_fmt} - %(message)s")
+
+
+def console_handler(stream: IO[str], access: bool = False) -> logging.Handler:
+    handler = logging.StreamHandler(stream)
+    handler.setFormatter(_formatter(access))
+    if os.getenv("LOG_QUEUE", "true").lower() in ("0", "false", "no", "off"):
+        return handler
+    return BackgroundQueueHandler(handler)
+
+
+def log_config() -> Dict[str, Any]:
+    level = os.getenv("MIN_LOG_LEVEL", "INFO").upper()
     return {
         "version": 1,
         "disable_existing_loggers": False,
-        "formatters": {
-            "default": {
-                "format": "%(asctime)s [%(levelname)s] %(name)s: %(message)s",
-                "datefmt": "%Y-%m-%d %H:%M:%S"
-            },
-        },
         "handlers": {
-            "console": {
-                "class": "logging.StreamHandler",
-                "formatter": "default",
-                "stream": "ext://sys.stdout",
-            },
+            "default": {"()": console_handler, "stream": "ext://sys.stderr"},
+            "access": {"()": console_handler, "stream": "ext://sys.stdout", "access": True},
         },
         "loggers": {
-            "uvicorn": {
-                "handlers": ["console"],
-                "level": os.getenv("MIN_LOG_LEVEL", "INFO"),
-            },
+            "uvicorn": {"handlers": ["default"], "level": level, "propagate": False},
+            "uvicorn.error": {"level": level},
+            "uvicorn.access": {"handlers": ["access"], "level": level, "propagate": False},
         },
     }
 
@@ -67,24 +137,14 @@ def min_log_level() -> int:
     return logging.NOTSET
 
 
-class CustomFilter(logging.Filter):  # pylint: disable=too-few-public-methods
-    def filter(self, record):
-        record.msg = f"@{host_name} - {record.msg}"
-        return True
-
-_custom_filter = CustomFilter()
-
-
 def _setup_logger() -> logging.Logger:
-    lgr = logging.getLogger('uvicorn.error')
-    lgr.addFilter(_custom_filter)
-    return lgr.getChild(host_name)
+    return logging.getLogger('uvicorn.error').getChild(host_name)
 
 
 root_logger = _setup_logger()
 
 
 def get_logger(name) -> logging.Logger:
-    ch = root_logger.getChild(name)
-    ch.addFilter(_custom_filter)
-    return ch
+    # level checks are cached per logger, a disabled debug() call is a dict lookup. Arguments are
+    # only formatted once a record is emitted, pass them as args, never as an f-string
+    return root_logger.getChild(name)
@@ -0,0 +1,204 @@
+from bisect import bisect_left
+import time
+from typing import Any, Callable, Dict, List, Sequence, Tuple
+
+
+# seconds, from 100us to 10s. Good enough for request, redis & postgres latencies
+LATENCY_BUCKETS: Tuple[float, ...] = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+# seconds, from 1ms to 1h. Event lags: a backlog in Redis is minutes, not milliseconds
+LAG_BUCKETS: Tuple[float, ...] = (
+    0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 900, 3600)
+SIZE_BUCKETS: Tuple[float, ...] = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def _fmt_labels(labels: Labels, extra: str = "") -> str:
+    parts = [f'{k}="{v}"' for k, v in labels]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _fmt_value(v: float) -> str:
+    if v == float("inf"):
+        return "+Inf"
+    return repr(float(v)) if isinstance(v, float) and not v.is_integer() else str(int(v))
+
+
+class Counter:
+    __slots__ = ("labels", "value")
+
+    def __init__(self, labels: Labels):
+        self.labels = labels
+        self.value = 0.0
+
+    def inc(self, amount: float = 1) -> None:
+        self.value += amount
+
+    def samples(self, name: str) -> List[str]:
+        return [f"{name}_total{_fmt_labels(self.labels)} {_fmt_value(self.value)}"]
+
+
+class Gauge:
+    __slots__ = ("labels", "value", "func")
+
+    def __init__(self, labels: Labels):
+        self.labels = labels
+        self.value = 0.0
+        self.func: Callable[[], float] | None = None  # read at scrape time when set
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+    def set_function(self, func: Callable[[], float]) -> None:
+        self.func = func
+
+    def samples(self, name: str) -> List[str]:
+        value = self.value
+        if self.func is not None:
+            try:
+                value = self.func()
+            except Exception:  # pylint: disable=broad-except
+                return []
+        return [f"{name}{_fmt_labels(self.labels)} {_fmt_value(value)}"]
+
+
+class Histogram:
+    # observe() is a bisect over a short tuple plus 3 increments, no locks, no allocations.
+    # Everything runs on the event loop, so counts are consistent without locking
+    __slots__ = ("labels", "bounds", "counts", "sum", "count")
+
+    def __init__(self, labels: Labels, bounds: Sequence[float]):
+        self.labels = labels
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)  # last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def observe_since(self, start: float) -> None:
+        self.observe(time.perf_counter() - start)
+
+    def quantile(self, q: float) -> float | None:
+        # estimated from the buckets, linear within the bucket the rank falls in. Past the
+        # largest bound, that bound is all there is to report
+        if self.count == 0:
+            return None
+        rank = q * self.count
+        total = 0
+        lower = 0.0
+        for bound, c in zip(self.bounds, self.counts):
+            if c > 0 and total + c >= rank:
+                return lower + (bound - lower) * (rank - total) / c
+            total += c
+            lower = bound
+        return self.bounds[-1]
+
+    def samples(self, name: str) -> List[str]:
+        lines: List[str] = []
+        total = 0
+        for bound, c in zip(self.bounds + (float("inf"),), self.counts):
+            total += c
+            le = f'le="{_fmt_value(bound)}"'
+            lines.append(f"{name}_bucket{_fmt_labels(self.labels, le)} {total}")
+        lines.append(f"{name}_sum{_fmt_labels(self.labels)} {repr(self.sum)}")
+        lines.append(f"{name}_count{_fmt_labels(self.labels)} {self.count}")
+        return lines
+
+
+class MetricsRegistry:
+    # metrics are created once (module or class level) and kept as references on the hot path
+    def __init__(self) -> None:
+        self._families: Dict[str, Tuple[str, str, Dict[Labels, Any]]] = {}
+
+    def _child(self, kind: str, name: str, doc: str, labels: Dict[str, str], factory) -> Any:
+        family = self._families.get(name)
+        if family is None:
+            family = (kind, doc, {})
+            self._families[name] = family
+        elif family[0] != kind:
+            raise ValueError(f"Metric {name} is already registered as a {family[0]}")
+        key: Labels = tuple(sorted(labels.items()))
+        child = family[2].get(key)
+        if child is None:
+            child = factory(key)
+            family[2][key] = child
+        return child
+
+    def counter(self, name: str, doc: str, **labels: str) -> Counter:
+        return self._child("counter", name, doc, labels, Counter)
+
+    def gauge(self, name: str, doc: str, **labels: str) -> Gauge:
+        return self._child("gauge", name, doc, labels, Gauge)
+
+    def histogram(
+        self, name: str, doc: str, buckets: Sequence[float] = LATENCY_BUCKETS, **labels: str
+    ) -> Histogram:
+        return self._child("histogram", name, doc, labels, lambda k: Histogram(k, buckets))
+
+    def render(self) -> str:
+        # Prometheus text exposition format v0.0.4
+        lines: List[str] = []
+        for name, (kind, doc, children) in sorted(self._families.items()):
+            lines.append(f"# HELP {name} {doc}")
+            lines.append(f"# TYPE {name} {kind}")
+            for child in children.values():
+                lines.extend(child.samples(name))
+        lines.append("")
+        return "\n".join(lines)
+
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+REGISTRY = MetricsRegistry()
+
+
+class RequestMetricsMiddleware:
+    # plain ASGI middleware (cheaper than BaseHTTPMiddleware). Labels by route template, not by
+    # raw path, so path parameters cannot blow up the number of series
+    def __init__(self, app: Any, prefix: str, registry: MetricsRegistry = REGISTRY):
+        self.app = app
+        self.prefix = prefix
+        self.registry = registry
+        self._routes: Dict[Tuple[str, str], Tuple[Histogram, Dict[int, Counter]]] = {}
+
+    def _series(self, method: str, route: str) -> Tuple[Histogram, Dict[int, Counter]]:
+        series = self._routes.get((method, route))
+        if series is None:
+            series = (self.registry.histogram(
+                f"{self.prefix}_request_seconds", "HTTP request latency by route",
+                method=method, route=route), {})
+            self._routes[(method, route)] = series
+        return series
+
+    async def __call__(self, scope: Dict[str, Any], receive: Any, send: Any) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = [500]
+
+        async def _send(message: Dict[str, Any]) -> None:
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, _send)
+        finally:
+            route = getattr(scope.get("route"), "path", None) or "unmatched"
+            hist, counters = self._series(scope.get("method", ""), route)
+            hist.observe_since(start)
+            counter = counters.get(status[0])
+            if counter is None:
+                counter = self.registry.counter(
+                    f"{self.prefix}_responses", "HTTP responses by route & status code",
+                    method=scope.get("method", ""), route=route, status=str(status[0]))
+                counters[status[0]] = counter
+            counter.inc()
@@ -0,0 +1,174 @@
+import asyncio
+from collections import Counter
+import os
+import random
+import re
+import signal
+import sys
+import threading
+import time
+from types import CodeType, CoroutineType, FrameType
+from typing import Any, Dict, List
+
+
+class ProfilerBusyError(RuntimeError):
+    pass
+
+
+class Profiler:
+    # on-demand statistical sampler. Outside of a profile window nothing runs: no trace hook,
+    # no signal handler, no thread. Stacks are returned collapsed, one "root;...;leaf weight"
+    # line per distinct stack, as read by flamegraph.pl, inferno or speedscope. Weights are
+    # microseconds of wall time. Modes:
+    # - loop: the event loop thread, from a SIGALRM timer. The handler runs on that thread &
+    #   gets the exact frame it interrupted, idle time shows as the selector's select/poll
+    # - threads: every thread, from a sampling thread. It needs the GIL to look & gets it
+    #   late while Python code runs, bursts under a millisecond are under-counted
+    # - tasks: the await chain of every asyncio task, where tasks are suspended
+    enabled: bool = os.getenv("DEBUG_PROFILER", "0").lower() not in ("", "0", "false", "no", "off")
+    max_seconds: float = 60
+    switch_interval_s: float = 0.0005  # GIL switch interval while the thread sampler runs
+    _active = False  # one window at a time per process, sampling is not free while it runs
+    _task_name = re.compile(r"-\d+$")  # Task-123 -> Task, unnamed tasks collapse together
+
+    @staticmethod
+    def _label(code: CodeType) -> str:
+        path = "/".join(code.co_filename.replace(os.sep, "/").rsplit("/", 2)[-2:])
+        return f"{code.co_name} ({path}:{code.co_firstlineno})"
+
+    @classmethod
+    def _stack(cls, frame: FrameType | None, labels: Dict[CodeType, str], root: str) -> str:
+        stack: List[str] = []
+        while frame is not None:
+            label = labels.get(frame.f_code)
+            if label is None:
+                label = labels[frame.f_code] = cls._label(frame.f_code)
+            stack.append(label)
+            frame = frame.f_back
+        stack.append(root)
+        return ";".join(reversed(stack))
+
+    @classmethod
+    async def _sample_loop(cls, seconds: float, interval_s: float) -> Counter:
+        labels: Dict[CodeType, str] = {}
+        stacks: Counter = Counter()
+        last = [time.monotonic()]
+
+        def _sample(_: int, frame: FrameType | None) -> None:
+            # a signal arriving while C code holds the thread is handled late, each sample
+            # counts for the time since the previous one
+            now = time.monotonic()
+            stacks[cls._stack(frame, labels, "loop")] += round((now - last[0]) * 1_000_000)
+            last[0] = now
+
+        previous = signal.signal(signal.SIGALRM, _sample)
+        signal.setitimer(signal.ITIMER_REAL, interval_s, interval_s)
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            signal.signal(signal.SIGALRM, previous)
+        return stacks
+
+    @classmethod
+    def _sample_threads(cls, seconds: float, interval_s: float, stop: threading.Event) -> Counter:
+        # runs in its own thread. The jitter keeps the samples from locking onto a periodic load
+        own = threading.get_ident()
+        labels: Dict[CodeType, str] = {}
+        stacks: Counter = Counter()
+        last = time.monotonic()
+        end = last + seconds
+        while last < end and not stop.is_set():
+            now = time.monotonic()
+            weight, last = round((now - last) * 1_000_000), now
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():  # pylint: disable=protected-access
+                if ident != own:
+                    stacks[cls._stack(frame, labels, names.get(ident) or f"thread-{ident}")] += (
+                        weight)
+            time.sleep(interval_s * random.uniform(0.5, 1.5))
+        return stacks
+
+    @classmethod
+    async def _sample_tasks(cls, seconds: float, interval_s: float) -> Counter:
+        # runs on the event loop. A leaf that is not a coroutine is what the task waits on
+        current = asyncio.current_task()
+        labels: Dict[CodeType, str] = {}
+        stacks: Counter = Counter()
+        last = time.monotonic()
+        end = last + seconds
+        while last < end:
+            now = time.monotonic()
+            weight, last = round((now - last) * 1_000_000), now
+            for task in asyncio.all_tasks():
+                if task is current:
+                    continue
+                stack = [cls._task_name.sub("", task.get_name())]
+                awaited: Any = task.get_coro()
+                while awaited is not None:
+                    code = getattr(awaited, "cr_code", None) or getattr(awaited, "gi_code", None)
+                    if code is None:
+                        stack.append(type(awaited).__name__)
+                        break
+                    label = labels.get(code)
+                    if label is None:
+                        label = labels[code] = cls._label(code)
+                    stack.append(label)
+                    awaited = (
+                        awaited.cr_await if isinstance(awaited, CoroutineType)
+                        else getattr(awaited, "gi_yieldfrom", None))
+                stacks[";".join(stack)] += weight
+            await asyncio.sleep(interval_s)
+        return stacks
+
+    @classmethod
+    async def profile(cls, seconds: float, interval_ms: float, mode: str = "loop") -> str:
+        if cls._active:
+            raise ProfilerBusyError("A profile is already running in this process")
+        cls._active = True
+        seconds, interval_s = min(seconds, cls.max_seconds), interval_ms / 1_000
+        if mode == "loop" and threading.current_thread() is not threading.main_thread():
+            mode = "threads"  # signal handlers only run on the main thread
+        stop = threading.Event()  # the sampling thread outlives a cancelled request otherwise
+        switch_interval_s = sys.getswitchinterval()
+        try:
+            if mode == "loop":
+                stacks = await cls._sample_loop(seconds, interval_s)
+            elif mode == "tasks":
+                stacks = await cls._sample_tasks(seconds, interval_s)
+            else:
+                sys.setswitchinterval(min(switch_interval_s, cls.switch_interval_s))
+                stacks = await asyncio.to_thread(cls._sample_threads, seconds, interval_s, stop)
+        finally:
+            stop.set()
+            sys.setswitchinterval(switch_interval_s)
+            cls._active = False
+        return "".join(f"{stack} {n}\n" for stack, n in stacks.most_common())
+
+    @classmethod
+    async def loop_lag(cls, seconds: float, interval_ms: float) -> Dict[str, Any]:
+        # schedules a timer every interval & measures how late it fires: the time callbacks
+        # wait for the loop, i.e. how long other code held it without awaiting
+        loop = asyncio.get_running_loop()
+        interval_s = interval_ms / 1_000
+        lags: List[float] = []
+        end = loop.time() + min(seconds, cls.max_seconds)
+        while loop.time() < end:
+            due = loop.time() + interval_s
+            await asyncio.sleep(interval_s)
+            lags.append(max(loop.time() - due, 0.0))
+        lags.sort()
+
+        def ms(q: float) -> float | None:
+            if len(lags) == 0:
+                return None
+            return round(lags[min(int(q * len(lags)), len(lags) - 1)] * 1_000, 3)
+        return {
+            "seconds": seconds,
+            "interval_ms": interval_ms,
+            "samples": len(lags),
+            "mean_ms": round(sum(lags) / len(lags) * 1_000, 3) if len(lags) > 0 else None,
+            "p50_ms": ms(0.5),
+            "p99_ms": ms(0.99),
+            "max_ms": ms(1),
+        }
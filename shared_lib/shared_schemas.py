@@ -1,8 +1,20 @@
+import base64
+from datetime import datetime, timezone
 import os
+import pickle
+import time
+from typing import Any, Dict, FrozenSet, List, Mapping, Tuple
+import uuid
+import msgpack
 from pydantic import BaseModel, Field
 
 
 COLOR_LIST_NAME: str = os.getenv("REDIS_COLOR_LIST_NAME", "color_match_results")
+# "list" (LPUSH/BLMPOP) or "stream" (XADD/XREADGROUP with a consumer group & acks)
+EVENT_TRANSPORT: str = os.getenv("EVENT_TRANSPORT", "list").lower()
+COLOR_STREAM_NAME: str = os.getenv("REDIS_COLOR_STREAM_NAME", "color_match_stream")
+COLOR_STREAM_GROUP: str = os.getenv("REDIS_COLOR_STREAM_GROUP", "color_workers")
+COLOR_STREAM_FIELD: str = "e"  # every stream entry carries one encoded event under this field
 
 
 class ColorMatched(BaseModel):
@@ -11,3 +23,102 @@ class ColorMatched(BaseModel):
     g: int
     b: int
     hex: str = Field(..., min_length=6, max_length=7, description="Hex value of the color")
+
+
+class EventFormatError(ValueError):
+    pass
+
+
+class EventCodec:
+    # wire format: 2 magic bytes + 1 version byte + msgpack array of positional fields
+    # v1 fields: [user, run, input, url, query, headers, [[name, r, g, b, hex], ...]]
+    # v2 fields: v1 + [event id (16 bytes), published at (us since the epoch)]
+    magic: bytes = b"CE"
+    version: int = 2
+    versions: FrozenSet[int] = frozenset((1, 2))  # decoded, the older ones may still be queued
+    _last_us: int = 0
+    header_allowlist: FrozenSet[str] = frozenset(
+        h.strip().lower() for h in
+        os.getenv("EVENT_HEADER_ALLOWLIST", "user-agent,x-user,x-run,x-request-id").split(",")
+        if h.strip())
+
+    @classmethod
+    def _headers(cls, headers: Mapping[str, str]) -> Dict[str, str]:
+        return {k: v for k, v in headers.items() if k.lower() in cls.header_allowlist}
+
+    @staticmethod
+    def _color(c: Any) -> List[Any]:
+        if isinstance(c, ColorMatched):
+            return [c.name, c.r, c.g, c.b, c.hex]
+        return [c["name"], c["r"], c["g"], c["b"], c["hex"]]
+
+    @classmethod
+    def stamp(cls) -> Tuple[uuid.UUID, datetime]:
+        # a UUIDv7 (ms timestamp + 74 random bits, sorts by time) & the publish time. The time
+        # never goes backwards within a process, even when the wall clock is stepped back
+        now_us = max(time.time_ns() // 1_000, cls._last_us + 1)
+        cls._last_us = now_us
+        value = (now_us // 1_000) << 80 | int.from_bytes(os.urandom(10), "big")
+        value = value & ~(0xF << 76) | 0x7 << 76  # version
+        value = value & ~(0x3 << 62) | 0x2 << 62  # variant
+        return uuid.UUID(int=value), datetime.fromtimestamp(now_us / 1_000_000, timezone.utc)
+
+    @classmethod
+    def encode(cls, evt: Dict[str, Any]) -> bytes:
+        req = evt.get("request") or {}
+        event_id = evt.get("event_id")
+        published_at = evt.get("published_at")
+        body = msgpack.packb([
+            evt.get("user"),
+            evt.get("run"),
+            evt.get("input"),
+            req.get("url"),
+            req.get("query") or {},
+            cls._headers(req.get("headers") or {}),
+            [cls._color(c) for c in evt.get("colors") or []],
+            event_id.bytes if event_id is not None else None,
+            round(published_at.timestamp() * 1_000_000) if published_at is not None else None,
+        ], use_bin_type=True)
+        return cls.magic + bytes((cls.version,)) + body
+
+    @classmethod
+    def decode(cls, buf: bytes | str) -> Dict[str, Any]:
+        if isinstance(buf, str):
+            buf = buf.encode("utf-8")
+        if not buf.startswith(cls.magic):
+            return cls._decode_legacy(buf)
+        if len(buf) < 3 or buf[2] not in cls.versions:
+            raise EventFormatError(f"Unsupported event version: {buf[2] if len(buf) > 2 else None}")
+        try:
+            fields = msgpack.unpackb(buf[3:], raw=False)
+            user, run, name, url, query, headers, colors = fields[:7]
+            event_id, published_us = fields[7:9] if buf[2] > 1 else (None, None)
+            evt = {
+                "user": user,
+                "run": run,
+                "input": name,
+                "request": {"url": url, "query": query, "headers": headers},
+                "colors": [
+                    {"name": c[0], "r": c[1], "g": c[2], "b": c[3], "hex": c[4]} for c in colors],
+            }
+            if event_id is not None:
+                evt["event_id"] = uuid.UUID(bytes=event_id)
+            if published_us is not None:
+                evt["published_at"] = datetime.fromtimestamp(
+                    published_us / 1_000_000, timezone.utc)
+        except (ValueError, TypeError, IndexError, msgpack.UnpackException) as e:
+            raise EventFormatError(f"Malformed v{buf[2]} event: {e}") from e
+        return evt
+
+    @staticmethod
+    def _decode_legacy(buf: bytes) -> Dict[str, Any]:
+        # base64 encoded pickle, written by API versions before the v1 wire format
+        try:
+            data = pickle.loads(base64.b64decode(buf, validate=True))
+        except Exception as e:  # pylint: disable=broad-except  # unpickling can raise anything
+            raise EventFormatError(f"Malformed legacy event: {e}") from e
+        if not isinstance(data, dict):
+            raise EventFormatError(f"Legacy event is not a dict: {type(data)}")
+        data["colors"] = [
+            c.model_dump() if isinstance(c, ColorMatched) else c for c in data.get("colors") or []]
+        return data
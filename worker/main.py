@@ -3,15 +3,27 @@ from datetime import datetime
 from logging import Logger
 import os
 import socket
-from typing import Dict, Any
+from typing import Annotated, Dict, Any, Literal
 import uvicorn
-from fastapi import FastAPI
+from fastapi import Depends, FastAPI, HTTPException, Query, Response, status
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from logger_factory import get_logger, min_log_level, log_config
+from metrics import PROMETHEUS_CONTENT_TYPE, REGISTRY, RequestMetricsMiddleware
+from profiler import Profiler, ProfilerBusyError
 from services.color_consumer import ColorConsumer
+from services.consumer_scaler import ConsumerScaler
+from services.dead_letters import DeadLetterQueue
+from services.lag_tracker import LagTracker
+from services.match_reader import MatchReader, ReaderBusyError
+from services.partition_manager import PartitionManager
+from services.rollup_aggregator import RollupAggregator
+from services.schema_migrator import SchemaMigrator
+from services.pg_pool import PgPool
 
 
 _boot_time = datetime.now()
 _host_name = socket.gethostname()  # pylint: disable=R0801
+_scaler = ConsumerScaler(lambda task_id: ColorConsumer(task_id=task_id))
 
 
 app = FastAPI(
@@ -21,6 +33,8 @@ app = FastAPI(
     ),
     version="1.0.0"
 )
+app.add_middleware(RequestMetricsMiddleware, prefix="color_worker")
+_queue_depth = REGISTRY.gauge("color_worker_queue_depth", "Events waiting in Redis")
 
 
 def log() -> Logger:
@@ -38,22 +52,183 @@ async def health_check() -> Dict[str, Any]:
         "name": "color worker 🤖",
         "host": _host_name,
         "boot": _boot_time,
-        "alive": str(current_time - _boot_time)
+        "alive": str(current_time - _boot_time),
+        "consumers": [c.stats() for c in _scaler.consumers],
+        "scale": _scaler.state(),
+        "partitions": PartitionManager.stats(),
     }
+    if len(_scaler.consumers) > 0:
+        try:
+            resp["queue"] = await _scaler.consumers[0].describe_queue()
+        except Exception as e:  # pylint: disable=broad-except
+            log().warning("Failed to describe queue: %s", e)
     log().debug("Health check: OK for %s", _host_name)
     return resp
 
 
+@app.get("/worker/metrics", response_class=PlainTextResponse)
+async def metrics() -> PlainTextResponse:
+    if len(_scaler.consumers) > 0:
+        try:  # the queue depth needs a Redis round-trip, so it is refreshed per scrape
+            queue = await _scaler.consumers[0].describe_queue()
+            _queue_depth.set(queue.get("depth") or 0)
+        except Exception as e:  # pylint: disable=broad-except
+            log().warning("Failed to describe queue: %s", e)
+    return PlainTextResponse(REGISTRY.render(), media_type=PROMETHEUS_CONTENT_TYPE)
+
+
+UsrQuery = Annotated[str | None, Query(max_length=64, description="Only rows of this user")]
+RunQuery = Annotated[str | None, Query(max_length=64, description="Only rows of this run")]
+AfterQuery = Annotated[int, Query(ge=0, description="Cursor: only rows with a greater id")]
+
+
+def _busy(e: ReaderBusyError) -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=str(e),
+        headers={"Retry-After": "1"})
+
+
+@app.get("/worker/matches")
+async def list_matches(
+    usr: UsrQuery = None, run: RunQuery = None, after: AfterQuery = 0,
+    limit: Annotated[int, Query(ge=1, le=MatchReader.max_page_size)] = 100
+) -> Response:
+    # keyset pagination, pass "next" back as "after" to get the following page
+    try:
+        page = await MatchReader.page(usr, run, after, limit)
+    except ReaderBusyError as e:
+        raise _busy(e) from e
+    return Response(page, media_type="application/json")
+
+
+@app.get("/worker/matches/export")
+async def export_matches(
+    usr: UsrQuery = None, run: RunQuery = None, after: AfterQuery = 0
+) -> StreamingResponse:
+    # every matching row as NDJSON, streamed in id order. An interrupted export resumes with
+    # after=<last id received>
+    try:
+        MatchReader.check_capacity()
+    except ReaderBusyError as e:
+        raise _busy(e) from e
+    return StreamingResponse(
+        MatchReader.export(usr, run, after), media_type="application/x-ndjson")
+
+
+@app.get("/worker/stats")
+async def match_stats(
+    usr: UsrQuery = None, run: RunQuery = None,
+    hours: Annotated[int, Query(ge=1, le=24 * 366, description="Window, in hours")] = 24,
+    limit: Annotated[int, Query(ge=1, le=RollupAggregator.max_rows)] = 20
+) -> Dict[str, Any]:
+    # totals, top colors & top missed inputs, read from the hourly rollups, not color_matches
+    try:
+        return await RollupAggregator.query(hours, usr, run, limit)
+    except ReaderBusyError as e:
+        raise _busy(e) from e
+
+
+@app.get("/worker/lag")
+async def event_lag() -> Dict[str, Any]:
+    # how old the rows are when they reach color_matches, per stage, SEE: lag_tracker.py
+    return LagTracker.summary()
+
+
+def _dead_letters() -> DeadLetterQueue:
+    if len(_scaler.consumers) == 0:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="No consumer is running")
+    return _scaler.consumers[0].dead_letters
+
+
+@app.get("/worker/dead-letters")
+async def list_dead_letters(
+    count: Annotated[int, Query(ge=1, le=1_000, description="Newest entries to return")] = 20
+) -> Dict[str, Any]:
+    # parked events with the reason & error, nothing is removed
+    dead_letters = _dead_letters()
+    return {
+        "name": dead_letters.name,
+        "depth": await dead_letters.depth(),
+        "entries": await dead_letters.peek(count),
+    }
+
+
+@app.post("/worker/dead-letters/replay")
+async def replay_dead_letters(
+    count: Annotated[
+        int, Query(ge=1, le=DeadLetterQueue.max_replay, description="Oldest entries to replay")
+    ] = 100
+) -> Dict[str, Any]:
+    # pushes parked events back onto the event queue, fix the cause first: an event that fails
+    # again is parked again
+    dead_letters = _dead_letters()
+    replayed = await dead_letters.replay(count)
+    return {"name": dead_letters.name, "replayed": replayed, "depth": await dead_letters.depth()}
+
+
+@app.get("/worker/scale")
+async def scale_state() -> Dict[str, Any]:
+    # consumer tasks & batch size, with the inputs of the last controller decision
+    return _scaler.state()
+
+
+@app.post("/worker/scale")
+async def scale_override(
+    consumers: Annotated[int | None, Query(
+        ge=ConsumerScaler.min_consumers, le=ConsumerScaler.max_consumers,
+        description="Consumer tasks to run")] = None,
+    batch_size: Annotated[int | None, Query(
+        ge=ConsumerScaler.batch_min, le=ConsumerScaler.batch_max,
+        description="Rows per batch insert")] = None,
+    mode: Annotated[Literal["auto", "manual"] | None, Query(
+        description="manual pauses the controller, a consumers or batch_size value implies it")
+    ] = None
+) -> Dict[str, Any]:
+    return await _scaler.override(consumers, batch_size, mode)
+
+
+def _profiling() -> None:
+    # the debug endpoints only answer with DEBUG_PROFILER set, they cost nothing otherwise
+    if not Profiler.enabled:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not Found")
+
+
+ProfileSecondsQuery = Annotated[
+    float, Query(gt=0, le=Profiler.max_seconds, description="Window, in seconds")]
+ProfileIntervalQuery = Annotated[
+    float, Query(ge=1, le=1_000, description="Time between samples, in ms")]
+
+
+@app.get(
+    "/worker/debug/profile", response_class=PlainTextResponse, include_in_schema=False,
+    dependencies=[Depends(_profiling)])
+async def debug_profile(
+    seconds: ProfileSecondsQuery = 10, interval_ms: ProfileIntervalQuery = 10,
+    mode: Literal["loop", "threads", "tasks"] = "loop"
+) -> PlainTextResponse:
+    # collapsed stacks of this process only, for flamegraph.pl or speedscope. loop: what the
+    # event loop runs, threads: every thread, tasks: where each asyncio task is suspended
+    try:
+        stacks = await Profiler.profile(seconds, interval_ms, mode)
+    except ProfilerBusyError as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e)) from e
+    return PlainTextResponse(stacks)
+
+
+@app.get("/worker/debug/loop-lag", include_in_schema=False, dependencies=[Depends(_profiling)])
+async def debug_loop_lag(
+    seconds: ProfileSecondsQuery = 5, interval_ms: ProfileIntervalQuery = 10
+) -> Dict[str, Any]:
+    # how late timers fire on the event loop, i.e. how long callbacks hold it
+    return await Profiler.loop_lag(seconds, interval_ms)
+
+
 def _api_setup() -> uvicorn.Server:
     host = os.getenv("HOST", os.getenv("WORKER_HOST", "0.0.0.0"))
     port = os.getenv("PORT", os.getenv("WORKER_PORT", "8000"))
-    fmt = log_config()
-    cfg: uvicorn.Config | None = None
-    if fmt is not None:
-        cfg = uvicorn.Config(
-            app, host=host, port=int(port), log_level=min_log_level(), log_config=fmt)
-    else:
-        cfg = uvicorn.Config(app, host=host, port=int(port), log_level=min_log_level())
+    cfg = uvicorn.Config(
+        app, host=host, port=int(port), log_level=min_log_level(), log_config=log_config())
     svr = uvicorn.Server(cfg)
     return svr
 
@@ -61,13 +236,18 @@ def _api_setup() -> uvicorn.Server:
 async def main() -> None:
     try:
         svr = _api_setup()  # configure API server
-        consumer = ColorConsumer()  # setup consumer
-        worker_threads = int(os.getenv("WORKER_THREADS", "1")) or 1
-        for _ in range(worker_threads):
-            asyncio.create_task(consumer.pull_event_loop())  # fork consumer on a side loops
+        await SchemaMigrator.run()  # a database created by an older schema gets its columns
+        PartitionManager.start()  # before the consumers write, see partition_manager.py
+        RollupAggregator.start()
+        # each consumer task gets its own pooled PG connection, WORKER_THREADS to start with
+        await _scaler.start()
 
         await svr.serve()  # start API server. This is ablocking call on the main thread
-        await consumer.cleanup()  # once the API server is closed, this statement will run
+        await PartitionManager.stop()  # once the API server is closed, these statements will run
+        await _scaler.stop()  # consumers finish the events they pulled & flush
+        await RollupAggregator.stop()  # flushes, needs the pool
+        await ColorConsumer.close()
+        await PgPool.close()
     except Exception as e:  # pylint: disable=broad-except
         log().error("Worker fault: %s", e)
         raise e
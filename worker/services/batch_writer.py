@@ -0,0 +1,231 @@
+import asyncio
+from datetime import datetime
+import logging
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Tuple
+import uuid
+import asyncpg
+from logger_factory import get_logger
+from metrics import REGISTRY, SIZE_BUCKETS
+from services.lag_tracker import LagTracker
+from services.retry import TRANSIENT_ERRORS, Backoff, is_data_error
+from services.rollup_aggregator import RollupAggregator
+
+
+# usr, run, input, body (json), stream_id, created_at (the partition key), event_id,
+# published_at (both none for v1 & legacy events), popped_at & the top color (none for a
+# miss). The top color is not a column, it feeds the rollups once the row is written
+Record = Tuple[
+    str, str, str, str, str | None, datetime, uuid.UUID | None, datetime | None, datetime,
+    str | None]
+
+
+class BatchWriter:  # pylint: disable=too-many-instance-attributes
+    # accumulates rows & writes them with a single COPY once the batch is full or old enough
+    logger = get_logger(__name__)
+    batch_size = max(int(os.getenv("WORKER_BATCH_SIZE", "500")), 1)
+    max_latency_ms = float(os.getenv("WORKER_BATCH_MAX_LATENCY_MS", "200"))
+    table = "color_matches"
+    columns = (
+        "usr", "run", "input", "body", "stream_id", "created_at", "event_id", "published_at",
+        "popped_at")  # committed_at is set by the server
+    width = len(columns)
+    # COPY cannot skip duplicates, re-delivered stream entries go through an idempotent insert
+    idempotent_insert = (
+        "INSERT INTO color_matches (usr, run, input, body, stream_id, created_at, event_id, "
+        "published_at, popped_at) VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9) "
+        "ON CONFLICT (stream_id, created_at) DO NOTHING;")
+    insert_seconds = REGISTRY.histogram(
+        "color_worker_db_insert_seconds", "Time to write one batch to PostgreSQL")
+    insert_rows = REGISTRY.histogram(
+        "color_worker_db_batch_rows", "Rows per batch written to PostgreSQL", SIZE_BUCKETS)
+    failed_rows = REGISTRY.counter(
+        "color_worker_db_failed_rows", "Rows rejected by PostgreSQL & parked")
+    retried_flushes = REGISTRY.counter(
+        "color_worker_db_retries", "Batch writes failed with a transient error")
+
+    def __init__(
+        self,
+        connect: Callable[[], Awaitable[asyncpg.Connection | None]],
+        on_commit: Callable[[List[str]], Awaitable[None]] | None = None,
+        on_park: Callable[[List[Record], str, Exception], Awaitable[None]] | None = None
+    ):
+        self._connect = connect
+        self._on_commit = on_commit  # receives the stream ids of every row that was handled
+        self._on_park = on_park  # receives rows that cannot be written, with the reason
+        self.backoff = Backoff()  # while set, the consumer leaves new events in Redis
+        self._pending: List[Record] = []
+        self._oldest: float = 0  # monotonic time the first pending row was added
+        self._lock = asyncio.Lock()  # one flush at a time, a connection runs one query at a time
+        self._task: asyncio.Task | None = None
+        self._rows = 0
+        self._batches = 0
+        self._splits = 0
+        self._failed_rows = 0
+        self._retries = 0
+        self._parked_rows = 0
+        self._last_flush_ms = 0.0
+        self._error: Exception | None = None  # of the last failed flush
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        await self.flush(force=True)
+        if len(self._pending) > 0:
+            # PostgreSQL is still failing: parked rows survive the task, un-acked stream
+            # entries are re-delivered to the next consumer if parking fails too
+            rows, self._pending = self._pending, []
+            error = self._error or ConnectionError("Writer stopped with unwritten rows")
+            self.logger.warning("Writer stopped with %d unwritten rows, parking them", len(rows))
+            if await self._park(rows, "shutdown", error):
+                await self._commit(rows)
+
+    async def add(self, record: Record) -> None:
+        if len(self._pending) == 0:
+            self._oldest = time.monotonic()
+        self._pending.append(record)
+        if len(self._pending) >= self.batch_size:
+            await self.flush()
+
+    async def _flush_loop(self) -> None:
+        # time threshold, so a trickle of events is not held back waiting for a full batch
+        interval_s = self.max_latency_ms / 1_000
+        while True:
+            await asyncio.sleep(interval_s)
+            if len(self._pending) > 0 and time.monotonic() - self._oldest >= interval_s:
+                try:
+                    await self.flush()
+                except Exception as e:  # pylint: disable=broad-except
+                    self.logger.error("Scheduled flush failed: %s", e)
+
+    async def flush(self, force: bool = False) -> None:
+        # a transient failure keeps the rows & backs off, the retries are spaced out by it &
+        # once the budget is used up the rows are parked, memory stays bounded in an outage
+        async with self._lock:
+            if len(self._pending) == 0 or (self.backoff.wait_s() > 0 and not force):
+                return
+            batch = self._pending
+            self._pending = []
+            parts = [batch]
+            unparked: List[Record] = []  # rejected rows the DLQ did not take, kept for a retry
+            start = time.perf_counter()
+            try:
+                conn = await self._connect()
+                if conn is None:
+                    raise ConnectionError("PostgreSQL connection is not initialized")
+                await self._insert(conn, parts, unparked)
+            except asyncio.CancelledError:
+                # stop() cancelled the flush loop mid-write, the final flush writes the rest.
+                # Written rows stay un-acked, re-delivered entries are skipped as duplicates
+                unwritten = unparked + [r for part in parts for r in part]
+                self._pending = unwritten + self._pending
+                self.logger.warning("Flush of %d rows cancelled, kept", len(unwritten))
+                raise
+            except Exception as e:  # pylint: disable=broad-except
+                # rows PostgreSQL rejects are parked by _insert, anything reaching here is the
+                # server, the network or the connection setup: the rows are kept for a retry
+                self._error = e
+                self._retries += 1
+                self.retried_flushes.inc()
+                delay = self.backoff.fail()
+                unwritten = unparked + [r for part in parts for r in part]
+                self.logger.log(
+                    logging.WARNING if isinstance(e, TRANSIENT_ERRORS) else logging.ERROR,
+                    "Failed to write %d rows (attempt %d), retrying in %.2fs: %s",
+                    len(unwritten), self.backoff.failures, delay, e)
+                left = {id(r) for r in unwritten}
+                await self._commit([r for r in batch if id(r) not in left])
+                if self.backoff.exhausted and await self._park(unwritten, "retries", e):
+                    self.backoff.failures = 0  # a fresh budget for the next batch
+                    await self._commit(unwritten)
+                else:
+                    self._pending = unwritten + self._pending
+                return
+            self.backoff.reset()
+            elapsed = time.perf_counter() - start
+            self.insert_seconds.observe(elapsed)
+            self.insert_rows.observe(len(batch))
+            self._last_flush_ms = elapsed * 1_000
+            self._batches += 1
+            self.logger.debug("Flushed %d rows in %.2fms", len(batch), self._last_flush_ms)
+            if len(unparked) > 0:
+                self.logger.warning("Kept %d rejected rows, failed to park them", len(unparked))
+                self._pending = unparked + self._pending
+                left = {id(r) for r in unparked}
+                batch = [r for r in batch if id(r) not in left]
+            await self._commit(batch)
+
+    async def _commit(self, batch: List[Record]) -> None:
+        ids = [r[4] for r in batch if r[4] is not None]
+        if self._on_commit is not None and len(ids) > 0:
+            try:
+                await self._on_commit(ids)
+            except Exception as e:  # pylint: disable=broad-except
+                # rows are committed, un-acked entries get re-delivered & skipped as duplicates
+                self.logger.warning("Failed to acknowledge %d entries: %s", len(ids), e)
+
+    async def _park(self, records: List[Record], reason: str, error: Exception) -> bool:
+        if self._on_park is None:
+            return False
+        try:
+            await self._on_park(records, reason, error)
+        except Exception as e:  # pylint: disable=broad-except
+            self.logger.error("Failed to park %d rows: %s", len(records), e)
+            return False
+        self._parked_rows += len(records)
+        return True
+
+    async def _insert(
+        self, conn: asyncpg.Connection, parts: List[List[Record]], unparked: List[Record]
+    ) -> None:
+        # parts is a stack of rows still to write. A transient error leaves the unwritten parts
+        # on it for the retry, the rows already committed are not written twice
+        while len(parts) > 0:
+            part = parts[-1]
+            try:
+                rows = [r[:self.width] for r in part]
+                if part[0][4] is not None:
+                    await conn.executemany(self.idempotent_insert, rows)
+                else:
+                    await conn.copy_records_to_table(
+                        self.table, records=rows, columns=self.columns)
+                parts.pop()
+                self._rows += len(part)
+                LagTracker.written(part)
+                RollupAggregator.written(part)
+            except Exception as e:  # pylint: disable=broad-except
+                if not is_data_error(e):
+                    raise  # not the data's fault, retried as a whole
+                # the data was rejected: bisect until the bad row is isolated
+                parts.pop()
+                if len(part) == 1:
+                    self._failed_rows += 1
+                    self.failed_rows.inc()
+                    self.logger.error("Rejected row usr: %s, run: %s, input: %s: %s",
+                                      part[0][0], part[0][1], part[0][2], e)
+                    if self._on_park is not None and not await self._park(part, "rejected", e):
+                        unparked.extend(part)
+                    continue
+                self._splits += 1
+                mid = len(part) // 2
+                parts.append(part[mid:])
+                parts.append(part[:mid])  # written first, rows keep their order
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "pending": len(self._pending),
+            "rows": self._rows,
+            "batches": self._batches,
+            "splits": self._splits,
+            "failed_rows": self._failed_rows,
+            "retries": self._retries,
+            "parked_rows": self._parked_rows,
+            "backoff_s": round(self.backoff.wait_s(), 3),
+            "last_flush_ms": round(self._last_flush_ms, 3),
+        }
@@ -1,85 +1,123 @@
 import asyncio
-import base64
 import os
-import pickle
-from datetime import datetime
+from datetime import datetime, timezone
 import random
-from typing import Any, Dict
+import socket
+import time
+from typing import Any, Dict, List
 import json
 import asyncpg
 from fastapi.encoders import jsonable_encoder
 from logger_factory import get_logger
-from redis import StrictRedis as Redis
-from shared_schemas import COLOR_LIST_NAME
+from metrics import REGISTRY
+from redis.asyncio import ConnectionPool, StrictRedis as Redis
+from shared_schemas import EventCodec, EventFormatError
+from services.batch_writer import BatchWriter, Record
+from services.dead_letters import DeadLetterQueue
+from services.event_source import EventSourceABC, Message, create_event_source
+from services.lag_tracker import LagTracker
+from services.pg_pool import PgPool
+from services.retry import TRANSIENT_ERRORS, Backoff
 
 
-class ColorConsumer:
+class ColorConsumer:  # pylint: disable=too-many-instance-attributes
+    # one instance per consumer task: Redis is shared (pooled), each task owns its own PG connection
     _redis: Redis | None = None
-    _pg_conn: asyncpg.Connection | None = None
     logger = get_logger(__name__)
     min_delay = int(os.getenv("WORKER_DELAY_MIN", "0"))
     max_delay = int(os.getenv("WORKER_DELAY_MAX", "0"))
     can_delay = min_delay < max_delay and max_delay > 0
     is_random_delay = can_delay and min_delay < max_delay
+    decode_seconds = LagTracker.stages["decode"]
+    key_length = 64  # usr & run columns, SEE: ../../db/000_schema.sql
+    bad_messages = REGISTRY.counter(
+        "color_worker_bad_messages", "Events that cannot be stored, parked in the DLQ")
 
-    def __init__(self, empty_delay_s: float = 2, empty_print_s: int = 60):
+    def __init__(self, task_id: int = 0, empty_delay_s: float = 2, empty_print_s: int = 60):
         self._init_redis()
+        self.task_id = task_id
         self._empty_delay_s = empty_delay_s
         self._empty_print_s = int(empty_print_s)  # seconds to wait between empty list reminders
         self._last_pull = datetime.now()
         self._last_mod = -1
+        self._conn: asyncpg.Connection | None = None
+        self._source: EventSourceABC = create_event_source(
+            self._redis, f"{socket.gethostname()}-{task_id}")  # type: ignore[arg-type]
+        self.dead_letters = DeadLetterQueue(self._redis)  # type: ignore[arg-type]
+        self._writer = BatchWriter(self._connection, self._source.ack, self._park_records)
+        self._backoff = Backoff()  # Redis errors, the writer keeps its own for PostgreSQL
+        self._pops = 0
+        self._messages = 0
+        self._bad_messages = 0
+        self._errors = 0
+        self._stopping = False
+        self._popped_at = datetime.now(timezone.utc)  # of the messages being processed
 
     @classmethod
     def _init_redis(cls):
         if cls._redis is None:
             host = os.getenv("REDIS_HOST", "localhost")
             port = int(os.getenv("REDIS_PORT", "6379"))
+            pool_size = int(os.getenv("REDIS_POOL_SIZE", "10"))
             cls.logger.debug("Connecting to Redis at %s:%d", host, port)
-            cls._redis = Redis(host, port, decode_responses=True)
+            # events are binary, keep raw bytes. Every consumer task holds a pooled connection
+            # while it blocks in BLMPOP, so the pool must be at least WORKER_MAX_THREADS in size
+            pool = ConnectionPool(host=host, port=port, max_connections=pool_size)
+            cls._redis = Redis.from_pool(pool)
 
-    @classmethod
-    async def _init_pg(cls):
-        if cls._pg_conn is None:
-            host = os.getenv("POSTGRES_HOST", "localhost")
-            port = int(os.getenv("POSTGRES_PORT", "5432"))
-            schema = os.getenv("POSTGRES_DB", "dev")
-            user = os.getenv("POSTGRES_USER", "pguser")
-            pwd = os.getenv("POSTGRES_PASSWORD", "pgpass")
-            cls.logger.debug("Connecting to PostgreSQL db: %s at: %s:%d", schema, host, port)
-            cls._pg_conn = await asyncpg.connect(
-                user=user, password=pwd, database=schema, host=host, port=port)
+    async def _connection(self) -> asyncpg.Connection | None:
+        if self._conn is not None and self._conn.is_closed():
+            await self._release()  # connection was lost, get a fresh one from the pool
+        if self._conn is None:
+            pool = await PgPool.get()
+            self._conn = await pool.acquire()
+            self.logger.debug("Consumer %d acquired a PostgreSQL connection", self.task_id)
+        return self._conn
 
-    @classmethod
-    async def cleanup(cls) -> None:
-        if cls._pg_conn is not None:
+    async def _release(self) -> None:
+        if self._conn is not None:
+            conn, self._conn = self._conn, None
             try:
-                await cls._pg_conn.close()
-                cls._pg_conn = None
-                cls.logger.debug("Closed PostgreSQL connection")
+                pool = await PgPool.get()
+                await pool.release(conn)
             except Exception as e:  # pylint: disable=broad-except
-                cls.logger.warning("Failed to close PostgreSQL connection: %s", e)
+                self.logger.warning("Failed to release PostgreSQL connection: %s", e)
+
+    async def cleanup(self) -> None:
+        try:
+            await self._writer.stop()  # write out whatever is still batched
+        except Exception as e:  # pylint: disable=broad-except
+            self.logger.error("Failed to flush pending rows: %s", e)
+        await self._release()
+
+    @classmethod
+    async def close(cls) -> None:
         if cls._redis is not None:
             try:
-                cls._redis.close()
+                await cls._redis.aclose()
                 cls._redis = None
                 cls.logger.debug("Closed Redis connection")
             except Exception as e:  # pylint: disable=broad-except
                 cls.logger.warning("Failed to close Redis connection: %s", e)
 
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "task": self.task_id,
+            "pops": self._pops,
+            "messages": self._messages,
+            "bad_messages": self._bad_messages,
+            "errors": self._errors,
+            "last_pull": self._last_pull,
+            "writer": self._writer.stats(),
+        }
+
     def _unwrap(self, msg: Any) -> Dict[str, Any]:
-        if msg is None:
-            self.logger.error("Received message is None")
-            return {}
-        s: str = ""
-        if isinstance(msg, list) and len(msg) >= 1 and isinstance(msg[0], str):
-            s = msg[0]
-        if not s:
-            self.logger.error("Received message payload is not a string: %s", msg)
-            return {}
-
-        buf = base64.b64decode(s, validate=True)
-        data: Dict[str, Any] = pickle.loads(buf)
-        return data
+        if not isinstance(msg, bytes) or not msg:
+            raise EventFormatError(f"Payload is not bytes: {type(msg).__name__}")
+        return EventCodec.decode(msg)  # also reads legacy base64 pickle events
+
+    async def describe_queue(self) -> Dict[str, Any]:
+        return await self._source.describe()
 
     async def pull_event_loop(self) -> None:
         if self._empty_delay_s > 0:
@@ -90,69 +128,147 @@ class ColorConsumer:
             self.logger.error("Redis connection is not initialized")
             return
 
-        self.logger.info("Starting color consumer loop")
-        while True:
+        self.logger.info("Starting color consumer loop %d", self.task_id)
+        self._writer.start()
+        msgs: List[Message] = []  # pulled & not processed yet, survives a retry
+        while not self._stopping or len(msgs) > 0:
             try:
-                msg = self._redis.rpop(COLOR_LIST_NAME, 1)
-                if not msg:
-                    since_sec = int((datetime.now() - self._last_pull).total_seconds())
-                    mod_count = since_sec % self._empty_print_s
-                    block = since_sec - mod_count
-                    if self._last_mod != block:
-                        self._last_mod = block
-                        self.logger.debug(
-                            "No messages in the last %d seconds. Since: %s", 
-                            since_sec, self._last_pull)
-
-                    await asyncio.sleep(self._empty_delay_s)  # wait before the next fetch
-                    continue  # repeat loop, still empty
-
-                self._last_pull = datetime.now()
-                data: Dict[str, Any] = self._unwrap(msg)
-                self.logger.debug("Received color match event: %s", data)
-
-                await self._write_to_db(data)
-                if self.can_delay:
-                    delay_ms = self.min_delay
-                    if self.is_random_delay:
-                        delay_ms = random.randint(self.min_delay, self.max_delay)
-                    self.logger.debug("Delaying for %dms before next message", delay_ms)
-                    await asyncio.sleep(delay_ms / 1000)
+                wait_s = self._writer.backoff.wait_s()
+                if wait_s > 0:  # PostgreSQL is failing, new events are safer in Redis
+                    await asyncio.sleep(wait_s)
+                    await self._writer.flush()
+                    continue
+                if len(msgs) == 0:
+                    msgs = list(reversed(await self._source.pull()))
+                    self._backoff.reset()
+                    if len(msgs) == 0:
+                        self._log_empty()
+                        continue  # repeat loop, the pull already blocked for pop_timeout_s
+                    self._last_pull = datetime.now()
+                    self._popped_at = datetime.now(timezone.utc)
+                    self._pops += 1
+                while len(msgs) > 0:
+                    stream_id, msg = msgs[-1]
+                    await self._process(stream_id, msg)
+                    msgs.pop()  # only once processed, a transient error retries the same one
+                    self._messages += 1
+                    await self._throttle()
 
+            except TRANSIENT_ERRORS as e:
+                self._errors += 1
+                delay = self._backoff.fail()
+                self.logger.warning("Redis error, retrying in %.2fs: %s", delay, e)
+                await asyncio.sleep(delay)
             except Exception as e:  # pylint: disable=broad-except
-                self.logger.error("Failed to process message: %s", e)
-                await asyncio.sleep(1)
-                continue
-
-    async def _write_to_db(self, data: Dict[str, Any]) -> None:
-        if self._pg_conn is None:
-            await self._init_pg()
-        if self._pg_conn is None:
-            self.logger.error("PostgreSQL connection is not initialized")
+                # not a Redis or PostgreSQL outage, retrying would fail the same way
+                self._errors += 1
+                self.logger.exception("Failed to process message: %s", e)
+                if len(msgs) > 0:
+                    await self._park_failed(msgs.pop(), e)
+        self.logger.info("Stopped color consumer loop %d", self.task_id)
+
+    def stop(self) -> None:
+        # the loop ends once the events already pulled are processed, cleanup() flushes them
+        self._stopping = True
+
+    def _log_empty(self) -> None:
+        since_sec = int((datetime.now() - self._last_pull).total_seconds())
+        mod_count = since_sec % self._empty_print_s
+        block = since_sec - mod_count
+        if self._last_mod != block:
+            self._last_mod = block
+            self.logger.debug(
+                "No messages in the last %d seconds. Since: %s", since_sec, self._last_pull)
+
+    async def _throttle(self) -> None:
+        if self.can_delay:
+            delay_ms = self.min_delay
+            if self.is_random_delay:
+                delay_ms = random.randint(self.min_delay, self.max_delay)
+            self.logger.debug("Delaying for %dms before next message", delay_ms)
+            await asyncio.sleep(delay_ms / 1000)
+
+    async def _process(self, stream_id: str | None, msg: Any) -> None:
+        # an event that can never be stored is parked in the DLQ right away, no retry & no
+        # sleep, the events behind it keep flowing
+        start = time.perf_counter()
+        try:
+            data: Dict[str, Any] = self._unwrap(msg)
+            self.decode_seconds.observe_since(start)
+        except EventFormatError as e:
+            await self._park(msg, "decode", e, stream_id)
             return
+        self.logger.debug("Received color match event: %s", data)
+        if not await self._write_to_db(data, stream_id):
+            await self._park(msg, "invalid", "user, run or input is missing", stream_id)
+
+    async def _park(self, msg: Any, reason: str, error: Any, stream_id: str | None) -> None:
+        self._bad_messages += 1
+        self.bad_messages.inc()
+        payload = msg if isinstance(msg, bytes) else str(msg).encode("utf-8")
+        await self.dead_letters.park([payload], reason, error, [stream_id])
+        if stream_id is not None:
+            await self._source.ack([stream_id])  # parked, stop re-delivery
+
+    async def _park_failed(self, message: Message, error: Exception) -> None:
+        try:
+            await self._park(message[1], "error", error, message[0])
+        except Exception as e:  # pylint: disable=broad-except
+            self.logger.error("Dropping message %s, failed to park it: %s", message[0], e)
+
+    async def _park_records(self, records: List[Record], reason: str, error: Exception) -> None:
+        # rows the writer gave up on, re-encoded as the events they came from
+        payloads = [EventCodec.encode({
+            "user": r[0], "run": r[1], "input": r[2], **json.loads(r[3]), "event_id": r[6],
+            "published_at": r[7]}) for r in records]
+        await self.dead_letters.park(payloads, reason, error, [r[4] for r in records])
+        self._bad_messages += len(records)
+        self.bad_messages.inc(len(records))
 
+    @staticmethod
+    def _created_at(stream_id: str | None) -> datetime:
+        # a stream entry id starts with the ms it was added at: a re-delivered entry gets the
+        # same created_at, lands in the same partition & is skipped as a duplicate
+        if stream_id is not None:
+            return datetime.fromtimestamp(int(stream_id.split("-", 1)[0]) / 1_000, timezone.utc)
+        return datetime.now(timezone.utc)
+
+    def _to_record(self, data: Dict[str, Any], stream_id: str | None = None) -> Record | None:
         usr = data.get("user", None)
         if usr is None:
             self.logger.warning("User not found in message: %s", data)
-            return
+            return None
         run = data.get("run", None)
         if run is None:
             self.logger.warning("Run not found in message: %s", data)
-            return
+            return None
         name = data.get("input", None)
         if name is None:
             self.logger.warning("Input not found in message: %s", data)
-            return
+            return None
 
         del data["user"]
         del data["run"]
         del data["input"]
+        event_id = data.pop("event_id", None)  # columns, not part of the body
+        published_at = data.pop("published_at", None)
+        colors = data.get("colors") or []
+        top = None
+        if len(colors) > 0:
+            top = colors[0]["name"] if isinstance(colors[0], dict) else colors[0].name
         obj = jsonable_encoder(data)
         js = json.dumps(obj)
+        # headers & query params are free text, a longer value would get the row rejected
+        return (
+            str(usr)[:self.key_length], str(run)[:self.key_length], name, js, stream_id,
+            self._created_at(stream_id), event_id, published_at, self._popped_at, top)
 
-        ok = await self._pg_conn.execute(
-            "INSERT INTO color_matches (usr, run, input, body) VALUES ($1, $2, $3, $4);",
-            usr, run, name, js)
+    async def _write_to_db(self, data: Dict[str, Any], stream_id: str | None = None) -> bool:
+        record = self._to_record(data, stream_id)
+        if record is None:
+            return False
+        await self._writer.add(record)  # written (acked & counted) by the next batch flush
         self.logger.debug(
-            "%s color match result for usr: %s, run: %s, input: %s",
-            ok, usr, run, name)
+            "Queued color match result for usr: %s, run: %s, input: %s",
+            record[0], record[1], record[2])
+        return True
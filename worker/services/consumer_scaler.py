@@ -0,0 +1,164 @@
+import asyncio
+import os
+import time
+from typing import Any, Callable, Dict, List, Tuple
+from logger_factory import get_logger
+from metrics import REGISTRY
+from services.batch_writer import BatchWriter
+from services.color_consumer import ColorConsumer
+from services.event_source import EventSourceABC
+
+
+class ConsumerScaler:  # pylint: disable=too-many-instance-attributes
+    # AIMD over the consumer tasks & the batch size. Every interval: one more consumer & a
+    # bigger batch while the queue lags, half of both as soon as PostgreSQL slows down or
+    # fails, one consumer less once the queue is drained. A burst is absorbed without piling
+    # more writers onto a struggling database
+    logger = get_logger(__name__)
+    initial: int = int(os.getenv("WORKER_THREADS", "1")) or 1
+    min_consumers: int = max(int(os.getenv("WORKER_MIN_THREADS", "1")), 1)
+    max_consumers: int = max(int(os.getenv("WORKER_MAX_THREADS", str(initial * 2))), initial)
+    interval_s: float = float(os.getenv("WORKER_SCALE_INTERVAL_S", "5"))  # 0: always manual
+    lag: int = int(os.getenv("WORKER_SCALE_LAG", "1000"))  # queued events that add a consumer
+    insert_ms: float = float(os.getenv("WORKER_SCALE_INSERT_MS", "250"))  # mean batch insert
+    batch_min: int = max(int(os.getenv("WORKER_BATCH_MIN", "50")), 1)
+    batch_max: int = max(int(os.getenv("WORKER_BATCH_MAX", "5000")), BatchWriter.batch_size)
+    batch_step: int = max(BatchWriter.batch_size // 2, 1)
+    consumers_gauge = REGISTRY.gauge("color_worker_consumers", "Running consumer tasks")
+    batch_gauge = REGISTRY.gauge("color_worker_batch_size", "Rows per batch insert")
+
+    def __init__(self, factory: Callable[[int], ColorConsumer]):
+        self._factory = factory  # builds the consumer of a task id
+        self._running: Dict[int, Tuple[ColorConsumer, asyncio.Task]] = {}
+        self._resize_lock = asyncio.Lock()
+        self._task: asyncio.Task | None = None
+        self.mode = "auto" if self.interval_s > 0 else "manual"
+        self._inserts = (0, 0.0, 0.0)  # insert count, seconds & retries at the last step
+        self._last: Dict[str, Any] = {}
+        self.consumers_gauge.set_function(lambda: len(self._running))
+        self.batch_gauge.set_function(lambda: BatchWriter.batch_size)
+
+    @property
+    def consumers(self) -> List[ColorConsumer]:
+        return [self._running[i][0] for i in sorted(self._running)]
+
+    async def resize(self, count: int) -> int:
+        # the lowest free task ids are started first: a stream consumer restarted under the
+        # same name reads its own un-acked entries before anything else
+        async with self._resize_lock:
+            while len(self._running) < count:
+                task_id = min(set(range(count)) - set(self._running))
+                consumer = self._factory(task_id)
+                self._running[task_id] = (
+                    consumer, asyncio.create_task(consumer.pull_event_loop()))
+            retiring = [self._running.pop(i) for i in sorted(self._running)[count:]]
+            await asyncio.gather(*(self._retire(c, t) for c, t in retiring))
+            return len(self._running)
+
+    async def _retire(self, consumer: ColorConsumer, task: asyncio.Task) -> None:
+        # the consumer finishes the events it already pulled & exits after its next pull
+        consumer.stop()
+        try:
+            await asyncio.wait_for(task, EventSourceABC.pop_timeout_s + 10)
+        except asyncio.TimeoutError:
+            self.logger.warning("Consumer %d did not stop in time, cancelled", consumer.task_id)
+        except Exception as e:  # pylint: disable=broad-except
+            self.logger.error("Consumer %d failed: %s", consumer.task_id, e)
+        await consumer.cleanup()
+
+    @classmethod
+    def set_batch_size(cls, size: int) -> int:
+        BatchWriter.batch_size = min(max(size, cls.batch_min), cls.batch_max)  # every writer
+        return BatchWriter.batch_size
+
+    async def _depth(self) -> int | None:
+        consumers = self.consumers
+        if len(consumers) == 0:
+            return None
+        try:
+            return (await consumers[0].describe_queue()).get("depth")
+        except Exception as e:  # pylint: disable=broad-except
+            self.logger.warning("Failed to describe queue: %s", e)
+            return None
+
+    async def step(self) -> None:
+        depth = await self._depth()
+        hist = BatchWriter.insert_seconds
+        count, seconds, retries = self._inserts
+        self._inserts = (hist.count, hist.sum, BatchWriter.retried_flushes.value)
+        inserts = hist.count - count
+        insert_ms = (hist.sum - seconds) / inserts * 1_000 if inserts > 0 else 0.0
+        failed = BatchWriter.retried_flushes.value - retries
+
+        consumers, batch = len(self._running), BatchWriter.batch_size
+        if failed > 0 or insert_ms > self.insert_ms:
+            decision = "decrease"  # multiplicative, the database is the bottleneck
+            consumers, batch = consumers // 2, batch // 2
+        elif depth is not None and depth > self.lag:
+            decision = "increase"  # additive, one step at a time
+            consumers, batch = consumers + 1, batch + self.batch_step
+        elif depth is not None and depth < self.lag // 10:
+            decision = "shrink"
+            consumers -= 1
+        else:
+            decision = "hold"
+        consumers = min(max(consumers, self.min_consumers), self.max_consumers)
+        if consumers != len(self._running):
+            self.logger.info(
+                "Scaling consumers %d -> %d (%s, depth: %s, insert: %.1fms, retries: %d)",
+                len(self._running), consumers, decision, depth, insert_ms, failed)
+        await self.resize(consumers)
+        self.set_batch_size(batch)
+        self._last = {
+            "at": time.time(), "decision": decision, "depth": depth,
+            "insert_ms": round(insert_ms, 3), "inserts": inserts, "retries": failed}
+
+    async def override(
+        self, consumers: int | None, batch_size: int | None, mode: str | None
+    ) -> Dict[str, Any]:
+        # manual values pause the controller until mode is set back to auto
+        if mode is not None:
+            self.mode = mode if self.interval_s > 0 else "manual"
+        elif consumers is not None or batch_size is not None:
+            self.mode = "manual"
+        if consumers is not None:
+            await self.resize(min(max(consumers, self.min_consumers), self.max_consumers))
+        if batch_size is not None:
+            self.set_batch_size(batch_size)
+        return self.state()
+
+    def state(self) -> Dict[str, Any]:
+        return {
+            "mode": self.mode,
+            "consumers": len(self._running),
+            "min_consumers": self.min_consumers,
+            "max_consumers": self.max_consumers,
+            "batch_size": BatchWriter.batch_size,
+            "batch_min": self.batch_min,
+            "batch_max": self.batch_max,
+            "interval_s": self.interval_s,
+            "lag": self.lag,
+            "insert_ms": self.insert_ms,
+            "last": self._last,
+        }
+
+    async def start(self) -> None:
+        await self.resize(min(max(self.initial, self.min_consumers), self.max_consumers))
+        if self._task is None and self.interval_s > 0:
+            self._task = asyncio.create_task(self._control_loop())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        await self.resize(0)
+
+    async def _control_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval_s)
+            if self.mode != "auto":
+                continue
+            try:
+                await self.step()
+            except Exception as e:  # pylint: disable=broad-except
+                self.logger.error("Scaling step failed: %s", e)
@@ -0,0 +1,78 @@
+import base64
+import json
+import os
+import socket
+import time
+from typing import Any, Dict, List
+from redis.asyncio import StrictRedis as Redis
+from logger_factory import get_logger
+from metrics import REGISTRY
+from shared_schemas import COLOR_LIST_NAME, COLOR_STREAM_FIELD, COLOR_STREAM_NAME, EVENT_TRANSPORT
+
+
+class DeadLetterQueue:
+    # a Redis list of events the worker cannot store, newest first. Each entry is a JSON
+    # document with the encoded event (base64) & why it was parked. Replaying pushes the events
+    # back onto the event queue as they were published
+    logger = get_logger(__name__)
+    name: str = os.getenv("REDIS_DEAD_LETTER_NAME", "color_match_dead_letters")
+    max_len: int = max(int(os.getenv("WORKER_DLQ_MAX_LEN", "10000")), 1)  # oldest are trimmed
+    max_replay: int = 10_000
+    reasons = ("decode", "invalid", "rejected", "retries", "shutdown", "error")
+    parked = {
+        r: REGISTRY.counter("color_worker_dead_letters", "Events parked in the DLQ", reason=r)
+        for r in reasons}
+    replayed = REGISTRY.counter("color_worker_dead_letters_replayed", "Parked events replayed")
+    host = socket.gethostname()
+
+    def __init__(self, redis: Redis):
+        self._redis = redis
+
+    async def park(
+        self, payloads: List[bytes], reason: str, error: Any, stream_ids: List[str | None]
+    ) -> None:
+        entries = [json.dumps({
+            "payload": base64.b64encode(payload).decode("ascii"),
+            "reason": reason,
+            "error": str(error)[:512],
+            "stream_id": stream_id,
+            "host": self.host,
+            "at": time.time(),
+        }) for payload, stream_id in zip(payloads, stream_ids)]
+        async with self._redis.pipeline(transaction=False) as pipe:
+            pipe.lpush(self.name, *entries)
+            pipe.ltrim(self.name, 0, self.max_len - 1)
+            await pipe.execute()
+        self.parked[reason].inc(len(entries))
+        self.logger.warning("Parked %d events (%s): %s", len(entries), reason, error)
+
+    async def depth(self) -> int:
+        return await self._redis.llen(self.name)  # type: ignore[misc]
+
+    async def peek(self, count: int) -> List[Dict[str, Any]]:
+        # newest first, nothing is removed
+        entries = await self._redis.lrange(self.name, 0, count - 1)  # type: ignore[misc]
+        return [json.loads(e) for e in entries]
+
+    async def replay(self, count: int) -> int:
+        # oldest first. RPOP hands each entry to one caller only, so replicas can replay at the
+        # same time. An event that fails again is simply parked again
+        entries: List[Any] = await self._redis.rpop(  # type: ignore[misc,assignment]
+            self.name, min(count, self.max_replay)) or []
+        payloads = [base64.b64decode(json.loads(e)["payload"]) for e in entries]
+        if len(payloads) == 0:
+            return 0
+        try:
+            if EVENT_TRANSPORT == "stream":
+                async with self._redis.pipeline(transaction=False) as pipe:
+                    for payload in payloads:
+                        pipe.xadd(COLOR_STREAM_NAME, {COLOR_STREAM_FIELD: payload})
+                    await pipe.execute()
+            else:  # consumers pop from the right, replayed events go to the back of the queue
+                await self._redis.lpush(COLOR_LIST_NAME, *payloads)  # type: ignore[misc]
+        except Exception:
+            await self._redis.rpush(self.name, *reversed(entries))  # type: ignore[misc]
+            raise
+        self.replayed.inc(len(payloads))
+        self.logger.info("Replayed %d parked events", len(payloads))
+        return len(payloads)
@@ -0,0 +1,170 @@
+from abc import ABC, abstractmethod
+import os
+import time
+from typing import Any, Dict, List, Tuple
+from redis.asyncio import StrictRedis as Redis
+from redis.exceptions import ResponseError
+from logger_factory import get_logger
+from metrics import REGISTRY, SIZE_BUCKETS
+from shared_schemas import (
+    COLOR_LIST_NAME, COLOR_STREAM_NAME, COLOR_STREAM_GROUP, COLOR_STREAM_FIELD, EVENT_TRANSPORT
+)
+
+
+Message = Tuple[str | None, bytes]  # (stream entry id or None for lists, encoded event)
+
+
+class EventSourceABC(ABC):
+    pop_count = max(int(os.getenv("WORKER_POP_COUNT", "100")), 1)  # max messages per pop
+    pop_timeout_s = float(os.getenv("WORKER_POP_TIMEOUT_S", "5"))  # how long a pop may block
+    # includes the time spent blocked on an empty queue, read it together with pop_messages
+    pop_seconds = REGISTRY.histogram("color_worker_pop_seconds", "Redis pop round-trip latency")
+    pop_messages = REGISTRY.histogram(
+        "color_worker_pop_messages", "Messages returned per Redis pop", SIZE_BUCKETS)
+
+    def __init__(self, redis: Redis):
+        self._redis = redis
+
+    async def pull(self) -> List[Message]:
+        start = time.perf_counter()
+        msgs = await self._pull()
+        self.pop_seconds.observe_since(start)
+        self.pop_messages.observe(len(msgs))
+        return msgs
+
+    @abstractmethod
+    async def _pull(self) -> List[Message]:
+        pass
+
+    @abstractmethod
+    async def ack(self, ids: List[str]) -> None:
+        pass
+
+    @abstractmethod
+    async def describe(self) -> Dict[str, Any]:
+        pass
+
+
+class ListEventSource(EventSourceABC):
+    # a popped message is gone from Redis, there is nothing to acknowledge
+
+    async def _pull(self) -> List[Message]:
+        # blocks server side until at least one message is available or the timeout is hit,
+        # then returns up to pop_count messages in a single round-trip
+        res = await self._redis.blmpop(  # type: ignore[misc]
+            self.pop_timeout_s, 1, COLOR_LIST_NAME, direction="RIGHT", count=self.pop_count)
+        if not res or len(res) < 2:
+            return []
+        return [(None, msg) for msg in res[1]]  # type: ignore[misc]
+
+    async def ack(self, ids: List[str]) -> None:
+        return
+
+    async def describe(self) -> Dict[str, Any]:
+        depth = await self._redis.llen(COLOR_LIST_NAME)  # type: ignore[misc]
+        return {"transport": "list", "name": COLOR_LIST_NAME, "depth": depth}
+
+
+class StreamEventSource(EventSourceABC):
+    # entries stay pending in the consumer group until acked after the DB commit. Entries left
+    # pending by a crashed replica are reclaimed with XAUTOCLAIM once they are idle long enough
+    logger = get_logger(__name__)
+    claim_idle_ms = int(os.getenv("WORKER_STREAM_CLAIM_IDLE_MS", "60000"))
+    claim_interval_s = float(os.getenv("WORKER_STREAM_CLAIM_INTERVAL_S", "30"))
+
+    def __init__(self, redis: Redis, consumer_name: str):
+        super().__init__(redis)
+        self.consumer_name = consumer_name
+        self._group_ready = False
+        self._last_claim = 0.0
+        self._claim_cursor = "0-0"
+        self._own_cursor: str | None = "0"  # first pages through what this consumer left un-acked
+
+    async def _ensure_group(self) -> None:
+        if self._group_ready:
+            return
+        try:
+            await self._redis.xgroup_create(
+                COLOR_STREAM_NAME, COLOR_STREAM_GROUP, id="0", mkstream=True)
+            self.logger.info(
+                "Created consumer group %s on %s", COLOR_STREAM_GROUP, COLOR_STREAM_NAME)
+        except ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+        self._group_ready = True
+
+    @staticmethod
+    def _entries(entries: Any) -> List[Message]:
+        res: List[Message] = []
+        for entry_id, fields in entries or []:
+            sid = entry_id.decode() if isinstance(entry_id, bytes) else str(entry_id)
+            payload = (fields or {}).get(COLOR_STREAM_FIELD.encode()) or b""
+            res.append((sid, payload))  # an empty payload is rejected & acked by the consumer
+        return res
+
+    @classmethod
+    def _read(cls, res: Any) -> List[Message]:
+        # XREADGROUP replies [[stream_name, entries]] or nil when nothing arrived in time
+        return cls._entries(res[0][1]) if res else []
+
+    async def _claim(self) -> List[Message]:
+        now = time.monotonic()
+        if now - self._last_claim < self.claim_interval_s:
+            return []
+        self._last_claim = now
+        res = await self._redis.xautoclaim(
+            COLOR_STREAM_NAME, COLOR_STREAM_GROUP, self.consumer_name,
+            self.claim_idle_ms, start_id=self._claim_cursor, count=self.pop_count)
+        cursor = res[0].decode() if isinstance(res[0], bytes) else str(res[0])
+        self._claim_cursor = cursor
+        if cursor != "0-0":
+            self._last_claim = 0  # more to scan, keep claiming on the next pull
+        claimed = self._entries(res[1])
+        if len(claimed) > 0:
+            self.logger.info("%s reclaimed %d stale entries", self.consumer_name, len(claimed))
+        return claimed
+
+    async def _pull(self) -> List[Message]:
+        await self._ensure_group()
+        if self._own_cursor is not None:
+            res = await self._redis.xreadgroup(
+                COLOR_STREAM_GROUP, self.consumer_name, {COLOR_STREAM_NAME: self._own_cursor},
+                count=self.pop_count)
+            own = self._read(res)
+            if len(own) > 0:
+                self._own_cursor = own[-1][0]
+                return own
+            self._own_cursor = None
+
+        claimed = await self._claim()
+        if len(claimed) > 0:
+            return claimed
+
+        res = await self._redis.xreadgroup(
+            COLOR_STREAM_GROUP, self.consumer_name, {COLOR_STREAM_NAME: ">"},
+            count=self.pop_count, block=int(self.pop_timeout_s * 1_000))
+        return self._read(res)
+
+    async def ack(self, ids: List[str]) -> None:
+        if len(ids) > 0:
+            await self._redis.xack(COLOR_STREAM_NAME, COLOR_STREAM_GROUP, *ids)
+
+    async def describe(self) -> Dict[str, Any]:
+        await self._ensure_group()
+        info: Dict[str, Any] = {"transport": "stream", "name": COLOR_STREAM_NAME}
+        for group in await self._redis.xinfo_groups(COLOR_STREAM_NAME):
+            name = group.get("name")
+            if (name.decode() if isinstance(name, bytes) else name) == COLOR_STREAM_GROUP:
+                info["group"] = COLOR_STREAM_GROUP
+                info["lag"] = group.get("lag")  # entries not yet delivered to the group
+                info["pending"] = group.get("pending")  # delivered but not acked
+                info["depth"] = (group.get("lag") or 0) + (group.get("pending") or 0)
+        return info
+
+
+def create_event_source(redis: Redis, consumer_name: str) -> EventSourceABC:
+    if EVENT_TRANSPORT == "stream":
+        return StreamEventSource(redis, consumer_name)
+    if EVENT_TRANSPORT != "list":
+        raise ValueError(f"Unknown EVENT_TRANSPORT: {EVENT_TRANSPORT}")
+    return ListEventSource(redis)
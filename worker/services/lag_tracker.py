@@ -0,0 +1,92 @@
+from datetime import datetime, timezone
+import os
+import random
+import time
+from typing import Any, Dict, Sequence
+from logger_factory import get_logger
+from metrics import LAG_BUCKETS, REGISTRY, Histogram
+
+
+class LagTracker:
+    # lag of the events written to PostgreSQL, per stage: queue (API publish -> worker pop),
+    # decode, db (pop -> row written, time in the batch included) & total (publish -> written).
+    # Publish times come from the API hosts' clocks, a negative lag is clock skew, counted as 0.
+    # v1 & legacy events carry no publish time & only count for decode & db
+    logger = get_logger(__name__)
+    sample: float = min(max(float(os.getenv("WORKER_TRACE_SAMPLE", "0")), 0.0), 1.0)
+    stages: Dict[str, Histogram] = {
+        "queue": REGISTRY.histogram(
+            "color_worker_event_lag_seconds", "Event lag per stage", LAG_BUCKETS, stage="queue"),
+        "decode": REGISTRY.histogram("color_worker_decode_seconds", "Event decode latency"),
+        "db": REGISTRY.histogram(
+            "color_worker_event_lag_seconds", "Event lag per stage", LAG_BUCKETS, stage="db"),
+        "total": REGISTRY.histogram(
+            "color_worker_event_lag_seconds", "Event lag per stage", LAG_BUCKETS, stage="total"),
+    }
+    skewed = REGISTRY.counter(
+        "color_worker_event_clock_skew", "Events published after the worker popped them")
+    _last: Dict[str, Any] = {}
+
+    @classmethod
+    def written(cls, records: Sequence[Sequence[Any]]) -> None:
+        # BatchWriter records, right after they were written
+        now = time.time()
+        queue, db, total = cls.stages["queue"], cls.stages["db"], cls.stages["total"]
+        popped_at, popped = None, 0.0
+        for r in records:
+            if r[8] is not popped_at:  # shared by the events of one pop
+                popped_at, popped = r[8], r[8].timestamp()
+            db.observe(max(now - popped, 0.0))
+            if r[7] is None:
+                continue
+            published = r[7].timestamp()
+            if published > popped:
+                cls.skewed.inc()
+                published = popped
+            queue.observe(popped - published)
+            total.observe(now - published)
+        last = records[-1]
+        cls._last = {
+            "event_id": last[6],
+            "published_at": last[7],
+            "popped_at": last[8],
+            "written_at": datetime.fromtimestamp(now, timezone.utc),
+            "total_s": round(now - last[7].timestamp(), 6) if last[7] is not None else None,
+        }
+        if cls.sample > 0:
+            for r in records:
+                if random.random() < cls.sample:
+                    cls._trace(r, now)
+
+    @classmethod
+    def _trace(cls, r: Sequence[Any], now: float) -> None:
+        popped = r[8].timestamp()
+        published = min(r[7].timestamp(), popped) if r[7] is not None else None
+        cls.logger.info(
+            "Trace event %s usr: %s, run: %s, queue: %s, db: %.1fms, total: %s",
+            r[6], r[0], r[1],
+            f"{(popped - published) * 1_000:.1f}ms" if published is not None else "-",
+            (now - popped) * 1_000,
+            f"{(now - published) * 1_000:.1f}ms" if published is not None else "-")
+
+    @staticmethod
+    def _describe(hist: Histogram) -> Dict[str, Any]:
+        def ms(value: float | None) -> float | None:
+            return round(value * 1_000, 3) if value is not None else None
+        return {
+            "count": hist.count,
+            "mean_ms": ms(hist.sum / hist.count) if hist.count > 0 else None,
+            "p50_ms": ms(hist.quantile(0.5)),
+            "p95_ms": ms(hist.quantile(0.95)),
+            "p99_ms": ms(hist.quantile(0.99)),
+        }
+
+    @classmethod
+    def summary(cls) -> Dict[str, Any]:
+        # since the worker started, quantiles are estimated from the histogram buckets
+        return {
+            "stages": {name: cls._describe(hist) for name, hist in cls.stages.items()},
+            "clock_skew": int(cls.skewed.value),
+            "last": cls._last,
+            "trace_sample": cls.sample,
+        }
@@ -0,0 +1,102 @@
+import asyncio
+from contextlib import asynccontextmanager
+import json
+import os
+from typing import Any, AsyncIterator, List, Tuple
+from logger_factory import get_logger
+from metrics import REGISTRY
+from services.pg_pool import PgPool
+
+
+class ReaderBusyError(RuntimeError):
+    pass
+
+
+class MatchReader:
+    # read side of color_matches. Keyset pagination: a page starts after the last id of the
+    # previous one, so page 1000 costs the same as page 1. usr & run filters ride on the
+    # (usr, id) & (run, id) indexes, SEE: ../../db/000_schema.sql
+    logger = get_logger(__name__)
+    max_page_size: int = 1_000
+    prefetch: int = max(int(os.getenv("WORKER_READ_PREFETCH", "500")), 1)
+    # reads share the pool with the consumers, each running read holds one connection
+    concurrency: int = max(int(os.getenv("WORKER_READ_CONCURRENCY", "2")), 1)
+    _slots = asyncio.Semaphore(concurrency)  # bound to the running loop on first use
+    exported_rows = REGISTRY.counter("color_worker_read_rows", "Rows served", mode="export")
+    paged_rows = REGISTRY.counter("color_worker_read_rows", "Rows served", mode="page")
+
+    @staticmethod
+    def _query(usr: str | None, run: str | None, after: int) -> Tuple[str, List[Any]]:
+        where: List[str] = ["id > $1"]
+        args: List[Any] = [after]
+        if usr is not None:
+            args.append(usr)
+            where.append(f"usr = ${len(args)}")
+        if run is not None:
+            args.append(run)
+            where.append(f"run = ${len(args)}")
+        # body is sent as the jsonb text, never parsed here
+        return (
+            f"SELECT id, usr, run, input, body::text FROM color_matches "
+            f"WHERE {' AND '.join(where)} ORDER BY id", args)
+
+    @staticmethod
+    def _row(record: Any) -> str:
+        return (
+            f'{{"id":{record[0]},"usr":{json.dumps(record[1])},"run":{json.dumps(record[2])},'
+            f'"input":{json.dumps(record[3])},"body":{record[4]}}}')
+
+    @classmethod
+    def check_capacity(cls) -> None:
+        # fails fast instead of queueing, the caller answers 503 & the client retries. Called
+        # before an export starts streaming, a status cannot change once the body has started
+        if cls._slots.locked():
+            raise ReaderBusyError("Too many concurrent reads")
+
+    @classmethod
+    @asynccontextmanager
+    async def slot(cls) -> AsyncIterator[None]:
+        # a read slot for the other queries served by the worker, e.g. the rollup stats
+        cls.check_capacity()
+        async with cls._slots:
+            yield
+
+    @classmethod
+    async def page(cls, usr: str | None, run: str | None, after: int, limit: int) -> str:
+        # one JSON document: {"items": [...], "next": <id to pass as after> or null}
+        sql, args = cls._query(usr, run, after)
+        args.append(min(limit, cls.max_page_size))
+        cls.check_capacity()
+        async with cls._slots:
+            pool = await PgPool.get()
+            records = await pool.fetch(f"{sql} LIMIT ${len(args)}", *args)
+        cls.paged_rows.inc(len(records))
+        next_id = records[-1][0] if len(records) == args[-1] else None
+        return (
+            f'{{"items":[{",".join(cls._row(r) for r in records)}],'
+            f'"next":{"null" if next_id is None else next_id}}}')
+
+    @classmethod
+    async def export(cls, usr: str | None, run: str | None, after: int) -> AsyncIterator[bytes]:
+        # NDJSON, one row per line. A server side cursor fetches prefetch rows at a time and
+        # each batch is sent before the next is read, memory stays flat for millions of rows.
+        # A client disconnect cancels the generator, which closes the cursor & the connection
+        sql, args = cls._query(usr, run, after)
+        async with cls._slots:
+            pool = await PgPool.get()
+            async with pool.acquire() as conn:
+                async with conn.transaction(readonly=True):
+                    cursor = conn.cursor(sql, *args, prefetch=cls.prefetch)
+                    lines: List[str] = []
+                    rows = 0
+                    async for record in cursor:
+                        lines.append(cls._row(record))
+                        if len(lines) >= cls.prefetch:
+                            yield ("\n".join(lines) + "\n").encode("utf-8")
+                            rows += len(lines)
+                            lines.clear()
+                    if len(lines) > 0:
+                        yield ("\n".join(lines) + "\n").encode("utf-8")
+                        rows += len(lines)
+        cls.exported_rows.inc(rows)
+        cls.logger.debug("Exported %d rows (usr: %s, run: %s, after: %d)", rows, usr, run, after)
@@ -0,0 +1,174 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+import os
+import re
+import time
+from typing import Any, Dict, List, Tuple
+import asyncpg
+from logger_factory import get_logger
+from metrics import REGISTRY
+from services.pg_pool import PgPool
+
+
+Partition = Tuple[str, datetime, datetime]  # table name, from (inclusive), to (exclusive)
+
+
+class PartitionManager:
+    # keeps the color_matches time partitions ahead of the clock & drops the expired ones,
+    # SEE: ../../db/000_schema.sql. Every worker replica runs it, a session advisory lock lets
+    # one of them at a time do the work
+    logger = get_logger(__name__)
+    table = "color_matches"
+    interval_days: int = 7 if os.getenv("WORKER_PARTITION_INTERVAL", "day").lower() == "week" else 1
+    premake: int = max(int(os.getenv("WORKER_PARTITION_PREMAKE", "3")), 1)  # after the current
+    retention_days: int = int(os.getenv("WORKER_RETENTION_DAYS", "0"))  # 0 keeps everything
+    check_s: float = float(os.getenv("WORKER_PARTITION_CHECK_S", "3600"))  # 0 turns it off
+    lock_timeout_ms = 5_000  # DDL waits behind running inserts at most this long, retried later
+    lock_key = 0x636F6C72  # pg_try_advisory_lock key, any constant shared by the replicas
+    re_bound = re.compile(r"FROM \('([^']+)'\) TO \('([^']+)'\)")
+    re_offset = re.compile(r"(:\d\d(?:\.\d+)?[+-]\d\d)$")  # the +00 after the seconds
+    _partitions: List[Partition] = []
+    _last_check: float = 0
+    _task: asyncio.Task | None = None
+    created = REGISTRY.counter(
+        "color_worker_partition_changes", "Partitions created or dropped", action="created")
+    dropped = REGISTRY.counter(
+        "color_worker_partition_changes", "Partitions created or dropped", action="dropped")
+    failed = REGISTRY.counter(
+        "color_worker_partition_changes", "Partitions created or dropped", action="failed")
+    moved_rows = REGISTRY.counter(
+        "color_worker_partition_moved_rows", "Rows moved out of the default partition")
+    partitions = REGISTRY.gauge("color_worker_partitions", "Time partitions of color_matches")
+
+    @classmethod
+    def planned(cls, now: datetime) -> List[Tuple[datetime, datetime]]:
+        # the partition holding now & the premake ones after it, in UTC. Weeks start on Monday
+        day = datetime(now.year, now.month, now.day, tzinfo=timezone.utc)
+        if cls.interval_days == 7:
+            day -= timedelta(days=day.weekday())
+        step = timedelta(days=cls.interval_days)
+        return [(day + i * step, day + (i + 1) * step) for i in range(cls.premake + 1)]
+
+    @classmethod
+    async def _list(cls, conn: asyncpg.Connection) -> List[Partition]:
+        rows = await conn.fetch(
+            "SELECT c.relname, pg_get_expr(c.relpartbound, c.oid) FROM pg_inherits i "
+            "JOIN pg_class c ON c.oid = i.inhrelid WHERE i.inhparent = $1::regclass", cls.table)
+        found: List[Partition] = []
+        for name, bound in rows:
+            match = cls.re_bound.search(bound or "")  # the default partition has no range
+            if match is not None:
+                found.append((name, cls._bound(match[1]), cls._bound(match[2])))
+        return sorted(found, key=lambda p: p[1])
+
+    @classmethod
+    def _bound(cls, text: str) -> datetime:
+        # '2026-10-18 00:00:00+00' as printed by pg_get_expr. fromisoformat reads an hour only
+        # offset from Python 3.11 on, 3.10 needs the minutes
+        return datetime.fromisoformat(cls.re_offset.sub(r"\1:00", text))
+
+    @classmethod
+    async def _create(cls, conn: asyncpg.Connection, start: datetime, end: datetime) -> int:
+        # built aside & attached, so rows that already went to the default partition for this
+        # range move with it. Returns the number of moved rows
+        name = f"{cls.table}_p{start:%Y%m%d}"
+        async with conn.transaction():
+            await conn.execute(f"SET LOCAL lock_timeout = {cls.lock_timeout_ms}")
+            await conn.execute(
+                f"CREATE TABLE {name} (LIKE {cls.table} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)")
+            status = await conn.execute(
+                f"WITH moved AS (DELETE FROM {cls.table}_default "
+                f"WHERE created_at >= $1 AND created_at < $2 RETURNING *) "
+                f"INSERT INTO {name} SELECT * FROM moved", start, end)
+            # the parent's indexes are created on the new table as part of the attach
+            await conn.execute(
+                f"ALTER TABLE {cls.table} ATTACH PARTITION {name} "
+                f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')")
+        return int(status.split()[-1])
+
+    @classmethod
+    async def _drop(cls, conn: asyncpg.Connection, name: str) -> None:
+        async with conn.transaction():
+            await conn.execute(f"SET LOCAL lock_timeout = {cls.lock_timeout_ms}")
+            await conn.execute(f'DROP TABLE "{name}"')
+
+    @classmethod
+    async def _apply(cls, conn: asyncpg.Connection, now: datetime) -> None:
+        existing = await cls._list(conn)
+        for start, end in cls.planned(now):
+            if any(s < end and start < e for _, s, e in existing):
+                continue  # already there, or overlaps partitions of a former interval setting
+            try:
+                moved = await cls._create(conn, start, end)
+                cls.created.inc()
+                cls.moved_rows.inc(moved)
+                cls.logger.info(
+                    "Created partition %s_p%s, moved %d rows", cls.table, f"{start:%Y%m%d}", moved)
+            except asyncpg.PostgresError as e:
+                cls.failed.inc()
+                cls.logger.error("Failed to create partition from %s: %s", start, e)
+        if cls.retention_days <= 0:
+            return
+        cutoff = now - timedelta(days=cls.retention_days)
+        for name, _, end in existing:
+            if end > cutoff:
+                continue
+            try:
+                await cls._drop(conn, name)
+                cls.dropped.inc()
+                cls.logger.info("Dropped expired partition %s", name)
+            except asyncpg.PostgresError as e:
+                cls.failed.inc()
+                cls.logger.error("Failed to drop partition %s: %s", name, e)
+
+    @classmethod
+    async def maintain(cls) -> None:
+        pool = await PgPool.get()
+        async with pool.acquire() as conn:
+            kind = await conn.fetchval(
+                "SELECT relkind FROM pg_class WHERE oid = to_regclass($1)", cls.table)
+            if kind != "p":
+                cls.logger.warning("Table %s is not partitioned, nothing to manage", cls.table)
+                return
+            # the lock is released when the connection goes back to the pool at the latest
+            if await conn.fetchval("SELECT pg_try_advisory_lock($1)", cls.lock_key):
+                try:
+                    await cls._apply(conn, datetime.now(timezone.utc))
+                finally:
+                    await conn.execute("SELECT pg_advisory_unlock($1)", cls.lock_key)
+            cls._partitions = await cls._list(conn)
+        cls._last_check = time.time()
+        cls.partitions.set(len(cls._partitions))
+
+    @classmethod
+    def stats(cls) -> Dict[str, Any]:
+        partitions = cls._partitions
+        return {
+            "interval_days": cls.interval_days,
+            "retention_days": cls.retention_days,
+            "count": len(partitions),
+            "oldest": partitions[0][1] if len(partitions) > 0 else None,
+            "newest": partitions[-1][2] if len(partitions) > 0 else None,
+            "last_check": cls._last_check,
+        }
+
+    @classmethod
+    def start(cls) -> None:
+        if cls._task is None and cls.check_s > 0:
+            cls._task = asyncio.create_task(cls._maintain_loop())
+
+    @classmethod
+    async def stop(cls) -> None:
+        if cls._task is not None:
+            cls._task.cancel()
+            cls._task = None
+
+    @classmethod
+    async def _maintain_loop(cls) -> None:
+        # right away at startup, consumers may already be writing to today's range
+        while True:
+            try:
+                await cls.maintain()
+            except Exception as e:  # pylint: disable=broad-except
+                cls.logger.error("Partition maintenance failed: %s", e)
+            await asyncio.sleep(cls.check_s)
@@ -0,0 +1,53 @@
+import asyncio
+import os
+import asyncpg
+from logger_factory import get_logger
+
+
+class PgPool:
+    # process wide asyncpg pool, each consumer task holds one connection for its lifetime
+    _pool: asyncpg.Pool | None = None
+    _lock = asyncio.Lock()  # concurrent first callers must not open a second pool
+    logger = get_logger(__name__)
+    workers = int(os.getenv("WORKER_THREADS", "1")) or 1
+    max_workers = max(int(os.getenv("WORKER_MAX_THREADS", str(workers * 2))), workers)  # scaled
+    reads = max(int(os.getenv("WORKER_READ_CONCURRENCY", "2")), 1)  # reads & stats queries
+    background = 2  # rollup flush & partition maintenance, the schema migration runs before
+    # every holder at once: a smaller pool lets reads & maintenance starve the consumers
+    demand = max_workers + reads + background
+    min_size = int(os.getenv("POSTGRES_POOL_MIN", str(workers)))
+    configured = int(os.getenv("POSTGRES_POOL_MAX", "0"))  # 0: sized from the demand
+    max_size = max(configured, demand, min_size, 1)
+
+    @classmethod
+    async def get(cls) -> asyncpg.Pool:
+        if cls._pool is None:
+            async with cls._lock:
+                if cls._pool is None:
+                    host = os.getenv("POSTGRES_HOST", "localhost")
+                    port = int(os.getenv("POSTGRES_PORT", "5432"))
+                    schema = os.getenv("POSTGRES_DB", "dev")
+                    user = os.getenv("POSTGRES_USER", "pguser")
+                    pwd = os.getenv("POSTGRES_PASSWORD", "pgpass")
+                    if 0 < cls.configured < cls.max_size:
+                        cls.logger.warning(
+                            "POSTGRES_POOL_MAX=%d is below the %d connections the worker can "
+                            "hold at once (WORKER_MAX_THREADS + WORKER_READ_CONCURRENCY + %d), "
+                            "using %d", cls.configured, cls.demand, cls.background, cls.max_size)
+                    cls.logger.debug(
+                        "Connecting to PostgreSQL db: %s at: %s:%d, pool: %d-%d",
+                        schema, host, port, cls.min_size, cls.max_size)
+                    cls._pool = await asyncpg.create_pool(
+                        user=user, password=pwd, database=schema, host=host, port=port,
+                        min_size=cls.min_size, max_size=cls.max_size)
+        return cls._pool  # type: ignore[return-value]
+
+    @classmethod
+    async def close(cls) -> None:
+        if cls._pool is not None:
+            try:
+                await cls._pool.close()
+                cls._pool = None
+                cls.logger.debug("Closed PostgreSQL pool")
+            except Exception as e:  # pylint: disable=broad-except
+                cls.logger.warning("Failed to close PostgreSQL pool: %s", e)
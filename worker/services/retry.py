@@ -0,0 +1,64 @@
+import asyncio
+import os
+import random
+import time
+import asyncpg
+from redis.exceptions import ConnectionError as RedisConnectionError, TimeoutError as RedisTimeout
+
+
+# errors worth retrying: the server or the network, not the data. Everything else from
+# PostgreSQL (a constraint, a bad value) is the row's fault & retrying cannot fix it
+TRANSIENT_ERRORS = (
+    OSError,
+    asyncio.TimeoutError,
+    RedisConnectionError,
+    RedisTimeout,
+    asyncpg.PostgresConnectionError,
+    asyncpg.InterfaceError,  # connection closed or reset under the query
+    asyncpg.TransactionRollbackError,  # deadlock, serialization failure
+    asyncpg.InsufficientResourcesError,  # too many connections, disk full
+    asyncpg.OperatorInterventionError,  # shutdown, cancelled query
+    asyncpg.LockNotAvailableError,  # lock_timeout, e.g. behind partition maintenance
+)
+# a value asyncpg cannot encode, e.g. of the wrong type. Its client side DataError is an
+# InterfaceError too, it must be told apart from a connection problem
+ARGUMENT_ERRORS = (ValueError, TypeError)
+
+
+def is_data_error(error: BaseException) -> bool:
+    # the rows' fault: a value the server rejects or asyncpg cannot send, retrying cannot help
+    if isinstance(error, ARGUMENT_ERRORS):
+        return True
+    return isinstance(error, asyncpg.PostgresError) and not isinstance(error, TRANSIENT_ERRORS)
+
+
+class Backoff:
+    # exponential backoff with jitter, reset by the first success. budget is the number of
+    # failures in a row after which the caller gives up on what it was retrying
+    base_s = float(os.getenv("WORKER_RETRY_BASE_MS", "500")) / 1_000
+    max_s = float(os.getenv("WORKER_RETRY_MAX_MS", "30000")) / 1_000
+    budget = max(int(os.getenv("WORKER_RETRY_BUDGET", "8")), 1)
+
+    def __init__(self) -> None:
+        self.failures = 0
+        self.retry_at = 0.0  # monotonic time before which the caller should not retry
+
+    def fail(self) -> float:
+        # returns the delay before the next attempt, half fixed & half random so replicas
+        # that failed together do not retry together
+        self.failures += 1
+        delay = min(self.max_s, self.base_s * 2 ** (self.failures - 1))
+        delay = delay / 2 + random.uniform(0, delay / 2)
+        self.retry_at = time.monotonic() + delay
+        return delay
+
+    def reset(self) -> None:
+        self.failures = 0
+        self.retry_at = 0.0
+
+    @property
+    def exhausted(self) -> bool:
+        return self.failures >= self.budget
+
+    def wait_s(self) -> float:
+        return max(0.0, self.retry_at - time.monotonic())
@@ -0,0 +1,162 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+import os
+from typing import Any, Dict, List, Sequence, Tuple
+from logger_factory import get_logger
+from metrics import REGISTRY
+from services.match_reader import MatchReader
+from services.pg_pool import PgPool
+from services.retry import is_data_error
+
+
+Key = Tuple[datetime, str, str, str]  # hour, usr, run, color (matches) or input (misses)
+
+
+class RollupAggregator:
+    # process wide hourly counters, bumped by every consumer task & upserted every flush_s.
+    # Counting happens once the event's row is written, a stream entry re-delivered after a
+    # crash is counted again. SEE: ../../db/001_rollups.sql
+    logger = get_logger(__name__)
+    flush_s: float = float(os.getenv("WORKER_ROLLUP_FLUSH_S", "10"))  # 0 turns rollups off
+    max_rows: int = 1_000  # rows returned by a stats query
+    key_length: int = 64  # color column, usr & run are cut by the consumer already
+    _matches: Dict[Key, int] = {}
+    _misses: Dict[Key, int] = {}
+    _task: asyncio.Task | None = None
+    _lock = asyncio.Lock()  # the periodic & the final flush must not interleave
+    # one statement per table: the arrays are unnested server side. Keys are unique & sorted,
+    # concurrent replicas lock shared rows in the same order & cannot deadlock
+    upserts = {
+        "matches": (
+            "INSERT INTO color_match_rollups (bucket, usr, run, color, matches) "
+            "SELECT * FROM unnest($1::timestamptz[], $2::text[], $3::text[], $4::text[], "
+            "$5::bigint[]) ON CONFLICT (bucket, usr, run, color) "
+            "DO UPDATE SET matches = color_match_rollups.matches + excluded.matches"),
+        "misses": (
+            "INSERT INTO color_miss_rollups (bucket, usr, run, input, misses) "
+            "SELECT * FROM unnest($1::timestamptz[], $2::text[], $3::text[], $4::text[], "
+            "$5::bigint[]) ON CONFLICT (bucket, usr, run, input) "
+            "DO UPDATE SET misses = color_miss_rollups.misses + excluded.misses"),
+    }
+    flushed_rows = REGISTRY.counter("color_worker_rollup_rows", "Rollup rows upserted")
+    failed_flushes = REGISTRY.counter("color_worker_rollup_failed", "Failed rollup flushes")
+    dropped_rows = REGISTRY.counter(
+        "color_worker_rollup_dropped", "Rollup rows rejected by PostgreSQL & dropped")
+
+    @classmethod
+    def written(cls, records: Sequence[Sequence[Any]]) -> None:
+        # BatchWriter records, right after they were written: rows still queued may get parked
+        if cls.flush_s <= 0:
+            return
+        for r in records:
+            hour = r[5].replace(minute=0, second=0, microsecond=0)
+            if r[9] is not None:
+                key = (hour, r[0], r[1], r[9][:cls.key_length])
+                cls._matches[key] = cls._matches.get(key, 0) + 1
+            else:
+                key = (hour, r[0], r[1], r[2])
+                cls._misses[key] = cls._misses.get(key, 0) + 1
+
+    @classmethod
+    async def flush(cls) -> None:
+        async with cls._lock:
+            pending = {"matches": cls._matches, "misses": cls._misses}
+            cls._matches, cls._misses = {}, {}  # swapped before the first await
+            for kind, counts in pending.items():
+                if len(counts) == 0:
+                    continue
+                parts = [sorted(counts)]
+                try:
+                    await cls._upsert(kind, counts, parts)
+                except Exception as e:  # pylint: disable=broad-except
+                    # kept for the next flush, merged with what was counted meanwhile
+                    current = cls._matches if kind == "matches" else cls._misses
+                    unwritten = [k for part in parts for k in part]
+                    for k in unwritten:
+                        current[k] = current.get(k, 0) + counts[k]
+                    cls.failed_flushes.inc()
+                    cls.logger.error(
+                        "Failed to flush %d %s rollups: %s", len(unwritten), kind, e)
+
+    @classmethod
+    async def _upsert(cls, kind: str, counts: Dict[Key, int], parts: List[List[Key]]) -> None:
+        # parts is a stack of sorted keys still to write, like BatchWriter._insert: keys the
+        # server rejects are bisected until the bad one is isolated & dropped, retrying it
+        # would fail the same way forever. A transient error leaves the unwritten parts
+        pool = await PgPool.get()
+        while len(parts) > 0:
+            keys = parts[-1]
+            try:
+                await pool.execute(
+                    cls.upserts[kind], [k[0] for k in keys], [k[1] for k in keys],
+                    [k[2] for k in keys], [k[3] for k in keys], [counts[k] for k in keys])
+                parts.pop()
+                cls.flushed_rows.inc(len(keys))
+            except Exception as e:  # pylint: disable=broad-except
+                if not is_data_error(e):
+                    raise
+                parts.pop()
+                if len(keys) == 1:
+                    cls.dropped_rows.inc()
+                    cls.logger.error(
+                        "Dropped %s rollup %s (%d): %s", kind, keys[0], counts[keys[0]], e)
+                    continue
+                mid = len(keys) // 2
+                parts.append(keys[mid:])
+                parts.append(keys[:mid])  # written first, keys stay in lock order
+
+    @classmethod
+    async def query(
+        cls, hours: int, usr: str | None, run: str | None, limit: int
+    ) -> Dict[str, Any]:
+        # totals & top entries over the last hours, from the rollups only
+        since = datetime.now(timezone.utc).replace(
+            minute=0, second=0, microsecond=0) - timedelta(hours=hours - 1)
+        where: List[str] = ["bucket >= $1"]
+        args: List[Any] = [since]
+        if usr is not None:
+            args.append(usr)
+            where.append(f"usr = ${len(args)}")
+        if run is not None:
+            args.append(run)
+            where.append(f"run = ${len(args)}")
+        cond = " AND ".join(where)
+        args.append(min(limit, cls.max_rows))
+        pool = await PgPool.get()
+        async with MatchReader.slot(), pool.acquire() as conn:
+            colors = await conn.fetch(
+                f"SELECT color, sum(matches) AS n FROM color_match_rollups WHERE {cond} "
+                f"GROUP BY color ORDER BY n DESC, color LIMIT ${len(args)}", *args)
+            misses = await conn.fetch(
+                f"SELECT input, sum(misses) AS n FROM color_miss_rollups WHERE {cond} "
+                f"GROUP BY input ORDER BY n DESC, input LIMIT ${len(args)}", *args)
+            totals = await conn.fetchrow(
+                f"SELECT (SELECT coalesce(sum(matches), 0) FROM color_match_rollups "
+                f"WHERE {cond}), (SELECT coalesce(sum(misses), 0) FROM color_miss_rollups "
+                f"WHERE {cond})", *args[:-1])
+        return {
+            "since": since,
+            "matches": totals[0],
+            "misses": totals[1],
+            "colors": [{"color": r[0], "matches": r[1]} for r in colors],
+            "missed_inputs": [{"input": r[0], "misses": r[1]} for r in misses],
+            "unflushed": sum(cls._matches.values()) + sum(cls._misses.values()),
+        }
+
+    @classmethod
+    def start(cls) -> None:
+        if cls._task is None and cls.flush_s > 0:
+            cls._task = asyncio.create_task(cls._flush_loop())
+
+    @classmethod
+    async def stop(cls) -> None:
+        if cls._task is not None:
+            cls._task.cancel()
+            cls._task = None
+        await cls.flush()  # counts of the last seconds
+
+    @classmethod
+    async def _flush_loop(cls) -> None:
+        while True:
+            await asyncio.sleep(cls.flush_s)
+            await cls.flush()  # never raises, failed counts stay for the next round
@@ -0,0 +1,94 @@
+import asyncio
+import os
+import asyncpg
+from logger_factory import get_logger
+from services.pg_pool import PgPool
+from services.retry import TRANSIENT_ERRORS, Backoff
+
+
+class SchemaMigrator:
+    # applies the idempotent scripts to the live database at startup, before anything writes:
+    # ../../db/000_schema.sql only runs on an empty volume, a database created before misses
+    # the columns, indexes & tables added since. Replicas take turns on a session advisory lock
+    logger = get_logger(__name__)
+    enabled: bool = os.getenv("WORKER_SCHEMA_MIGRATE", "1").lower() not in ("0", "false", "no")
+    path: str = os.getenv(
+        "WORKER_SCHEMA_DIR", os.path.join(os.path.dirname(__file__), "..", "..", "db"))
+    scripts = ("001_rollups.sql", "002_upgrade.sql")  # in order, 000 creates the partitioned table
+    table = "color_matches"
+    lock_timeout_ms = 5_000  # an ALTER waits behind running queries at most this long
+    lock_key = 0x636F6C73  # pg_advisory_lock key, not the one of the partition manager
+    lock_poll_s = 1.0
+    # (name, columns, unique) built concurrently, inserts & reads of the live table go on. The
+    # partitioned table of 000_schema.sql has them already, usr & run under other names
+    indexes = (
+        ("color_matches_stream_idx", "stream_id, created_at", True),  # on conflict target
+        ("color_matches_usr_id_idx", "usr, id", False),  # keyset pages, SEE: match_reader.py
+        ("color_matches_run_id_idx", "run, id", False),
+    )
+    find_index = (
+        "SELECT i.indisvalid, c.relname FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+        "WHERE i.indrelid = $1::regclass AND (i.indisunique OR NOT $2) "
+        "AND pg_get_indexdef(i.indexrelid) LIKE '%USING btree (' || $3 || ')'")
+
+    @classmethod
+    async def migrate(cls) -> None:
+        pool = await PgPool.get()
+        async with pool.acquire() as conn:
+            if await conn.fetchval("SELECT to_regclass($1)", cls.table) is None:
+                cls.logger.warning("Table %s does not exist, run db/000_schema.sql", cls.table)
+                return
+            # the lock is released when the connection goes back to the pool at the latest. Not
+            # waited for in a statement: a concurrent index build waits for every open
+            # transaction, a replica blocked in pg_advisory_lock would stall it
+            while not await conn.fetchval("SELECT pg_try_advisory_lock($1)", cls.lock_key):
+                await asyncio.sleep(cls.lock_poll_s)
+            try:
+                for name in cls.scripts:
+                    with open(os.path.join(cls.path, name), encoding="utf-8") as f:
+                        script = f.read()
+                    async with conn.transaction():
+                        await conn.execute(f"SET LOCAL lock_timeout = {cls.lock_timeout_ms}")
+                        await conn.execute(script)
+                    cls.logger.debug("Applied %s", name)
+                partitioned = await conn.fetchval(
+                    "SELECT relkind = 'p' FROM pg_class WHERE oid = $1::regclass", cls.table)
+                for name, columns, unique in cls.indexes:
+                    await cls._index(conn, name, columns, unique, not partitioned)
+            finally:
+                await conn.execute("SELECT pg_advisory_unlock($1)", cls.lock_key)
+
+    @classmethod
+    async def _index(
+        cls, conn: asyncpg.Connection, name: str, columns: str, unique: bool, concurrently: bool
+    ) -> None:
+        # any valid index over the same columns will do, whatever its name
+        found = await conn.fetch(cls.find_index, cls.table, unique, columns)
+        if any(valid for valid, _ in found):
+            return
+        mode = "CONCURRENTLY " if concurrently else ""  # not supported on a partitioned table
+        if any(index == name for _, index in found):  # left invalid by a failed build
+            await conn.execute(f"DROP INDEX {mode}IF EXISTS {name}")
+        cls.logger.info("Creating index %s on %s (%s)", name, cls.table, columns)
+        await conn.execute(
+            f"CREATE {'UNIQUE ' if unique else ''}INDEX {mode}IF NOT EXISTS {name} "
+            f"ON {cls.table} ({columns})")
+
+    @classmethod
+    async def run(cls) -> None:
+        # retries while PostgreSQL comes up. Anything else stops the worker: writing to a table
+        # without the columns would get every row rejected & parked
+        if not cls.enabled:
+            return
+        backoff = Backoff()
+        while True:
+            try:
+                await cls.migrate()
+                cls.logger.info("Schema is up to date")
+                return
+            except TRANSIENT_ERRORS as e:
+                delay = backoff.fail()
+                if backoff.exhausted:
+                    raise
+                cls.logger.warning("Schema migration failed, retrying in %.2fs: %s", delay, e)
+                await asyncio.sleep(delay)
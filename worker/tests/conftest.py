@@ -0,0 +1,9 @@
+import os
+import sys
+
+
+# same import roots as the app: PYTHONPATH=../shared_lib:. from ./worker
+for path in ("..", os.path.join("..", "..", "shared_lib")):
+    path = os.path.abspath(os.path.join(os.path.dirname(__file__), path))
+    if path not in sys.path:
+        sys.path.insert(0, path)
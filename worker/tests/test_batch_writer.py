@@ -0,0 +1,153 @@
+import asyncio
+import base64
+from datetime import datetime, timezone
+from typing import Any, List
+import asyncpg
+from asyncpg.exceptions._base import DataError as ArgumentError
+from fakeredis import FakeAsyncRedis
+from shared_schemas import EventCodec
+from services.batch_writer import BatchWriter
+from services.color_consumer import ColorConsumer
+
+
+def _record(i: int) -> Any:
+    now = datetime.now(timezone.utc)
+    return ("u", "run", f"input {i}", "{}", f"{i}-0", now, None, None, now, None)
+
+
+class Sink:
+    # the writer's callbacks: acked stream ids & parked rows
+    def __init__(self, park_fails: bool = False) -> None:
+        self.acked: List[str] = []
+        self.parked: List[Any] = []
+        self.park_fails = park_fails
+
+    async def ack(self, ids: List[str]) -> None:
+        self.acked.extend(ids)
+
+    async def park(self, records: List[Any], reason: str, _: Exception) -> None:
+        if self.park_fails:
+            raise ConnectionRefusedError("Redis is down")
+        self.parked.extend((r[2], reason) for r in records)
+
+
+class Connection:
+    def __init__(self, reject: str | None = None, hang: bool = False) -> None:
+        self.rows: List[Any] = []
+        self._reject = reject
+        self._hang = hang
+
+    async def executemany(self, _: str, rows: List[Any]) -> None:
+        if self._hang:
+            await asyncio.sleep(10)
+        if any(not isinstance(r[2], str) for r in rows):  # as asyncpg encodes a text argument
+            raise ArgumentError("invalid input for query argument $3: expected str, got int")
+        if any(r[2] == self._reject for r in rows):
+            raise asyncpg.NotNullViolationError("rejected")
+        self.rows.extend(rows)
+
+
+def test_connection_setup_errors_keep_the_rows() -> None:
+    async def connect() -> Any:
+        raise asyncpg.InvalidPasswordError("password authentication failed")
+
+    async def run() -> BatchWriter:
+        writer = BatchWriter(connect)
+        for i in range(3):
+            await writer.add(_record(i))
+        await writer.flush()
+        return writer
+
+    writer = asyncio.run(run())
+    assert writer.stats()["pending"] == 3
+    assert writer.stats()["retries"] == 1
+
+
+def test_rejected_rows_are_kept_when_they_cannot_be_parked() -> None:
+    sink = Sink(park_fails=True)
+    conn = Connection(reject="input 1")
+
+    async def connect() -> Any:
+        return conn
+
+    async def run() -> BatchWriter:
+        writer = BatchWriter(connect, sink.ack, sink.park)
+        for i in range(3):
+            await writer.add(_record(i))
+        await writer.flush()
+        return writer
+
+    writer = asyncio.run(run())
+    assert [r[2] for r in conn.rows] == ["input 0", "input 2"]
+    assert sink.acked == ["0-0", "2-0"]
+    assert writer.stats()["pending"] == 1
+
+
+def test_a_cancelled_flush_keeps_the_rows() -> None:
+    conn = Connection(hang=True)
+
+    async def connect() -> Any:
+        return conn
+
+    async def run() -> BatchWriter:
+        writer = BatchWriter(connect)
+        for i in range(3):
+            await writer.add(_record(i))
+        flush = asyncio.create_task(writer.flush())
+        await asyncio.sleep(0.01)
+        flush.cancel()
+        await asyncio.gather(flush, return_exceptions=True)
+        return writer
+
+    writer = asyncio.run(run())
+    assert writer.stats()["pending"] == 3
+
+
+def test_stop_during_an_outage_parks_the_rows_in_the_dead_letter_list() -> None:
+    sink = Sink()
+
+    async def connect() -> Any:
+        raise ConnectionRefusedError("PostgreSQL is down")
+
+    async def run() -> Any:
+        ColorConsumer._redis = FakeAsyncRedis()  # pylint: disable=protected-access
+        consumer = ColorConsumer()
+        writer = BatchWriter(
+            connect, sink.ack, consumer._park_records)  # pylint: disable=protected-access
+        for i in range(3):
+            await writer.add(_record(i))
+        await writer.stop()
+        try:
+            return writer.stats(), await consumer.dead_letters.peek(10)
+        finally:
+            await ColorConsumer.close()
+
+    stats, parked = asyncio.run(run())
+    assert stats["parked_rows"] == 3
+    assert [(e["stream_id"], e["reason"]) for e in reversed(parked)] == [
+        (f"{i}-0", "shutdown") for i in range(3)]
+    assert sink.acked == ["0-0", "1-0", "2-0"]
+    events = [EventCodec.decode(base64.b64decode(e["payload"])) for e in reversed(parked)]
+    assert [e["input"] for e in events] == [f"input {i}" for i in range(3)]
+
+
+def test_a_wrongly_typed_row_is_bisected_out_of_its_batch() -> None:
+    sink = Sink()
+    conn = Connection()
+
+    async def connect() -> Any:
+        return conn
+
+    async def run() -> BatchWriter:
+        writer = BatchWriter(connect, sink.ack, sink.park)
+        for i in range(4):
+            record = _record(i)
+            await writer.add(record if i != 2 else record[:2] + (2,) + record[3:])
+        await writer.flush()
+        return writer
+
+    writer = asyncio.run(run())
+    assert [r[2] for r in conn.rows] == ["input 0", "input 1", "input 3"]
+    assert sink.parked == [(2, "rejected")]
+    assert writer.stats()["retries"] == 0
+    assert writer.stats()["pending"] == 0
@@ -0,0 +1,11 @@
+from datetime import datetime, timezone
+from services.partition_manager import PartitionManager
+
+
+def test_bounds_as_printed_by_postgres() -> None:
+    # pg_get_expr prints an hour only offset, which fromisoformat rejects on Python 3.10
+    bound = PartitionManager._bound  # pylint: disable=protected-access
+    assert bound("2026-10-18 00:00:00+00") == datetime(2026, 10, 18, tzinfo=timezone.utc)
+    assert bound("2026-10-18 02:00:00+02") == datetime(2026, 10, 18, tzinfo=timezone.utc)
+    assert bound("2026-10-18 05:30:00+05:30") == datetime(2026, 10, 18, tzinfo=timezone.utc)
+    assert bound("2026-10-17 19:00:00-05") == datetime(2026, 10, 18, tzinfo=timezone.utc)
@@ -0,0 +1,85 @@
+import asyncio
+from datetime import datetime, timezone
+from typing import Any, List
+import asyncpg
+import pytest
+from services.batch_writer import BatchWriter
+from services.pg_pool import PgPool
+from services.rollup_aggregator import RollupAggregator
+
+
+class VarcharPool:
+    # rejects a statement holding a key longer than the varchar(64) columns, like PostgreSQL
+    def __init__(self) -> None:
+        self.down = False
+        self.rows: List[Any] = []
+
+    async def execute(self, _: str, *columns: List[Any]) -> None:
+        if self.down:
+            raise ConnectionRefusedError("PostgreSQL is down")
+        if any(len(v) > 64 for v in columns[1] + columns[2] + columns[3]):
+            raise asyncpg.StringDataRightTruncationError("value too long")
+        self.rows.extend(zip(*columns))
+
+
+@pytest.fixture(autouse=True)
+def _empty() -> None:
+    # process wide counters, other tests write rows too
+    RollupAggregator._matches, RollupAggregator._misses = {}, {}  # pylint: disable=protected-access
+
+
+def _record(usr: str, color: str | None) -> Any:
+    now = datetime.now(timezone.utc)
+    return (usr, "run", "light blue", "{}", None, now, None, None, now, color)
+
+
+def _flush(pool: VarcharPool) -> None:
+    PgPool._pool = pool  # type: ignore[assignment] # pylint: disable=protected-access
+    try:
+        asyncio.run(RollupAggregator.flush())
+    finally:
+        PgPool._pool = None  # pylint: disable=protected-access
+
+
+def test_rejected_keys_are_dropped_not_merged_again() -> None:
+    pool = VarcharPool()
+    RollupAggregator.written(
+        [_record(f"u{i}", "blue") for i in range(7)] + [_record("x" * 65, "blue")])
+    _flush(pool)
+    assert sorted(r[1] for r in pool.rows) == [f"u{i}" for i in range(7)]
+    assert len(RollupAggregator._matches) == 0  # pylint: disable=protected-access
+
+
+def test_transient_errors_keep_the_counts() -> None:
+    pool = VarcharPool()
+    pool.down = True
+    RollupAggregator.written([_record("u", None), _record("u", None)])
+    _flush(pool)
+    assert len(pool.rows) == 0
+    pool.down = False
+    _flush(pool)
+    assert [(r[1], r[3], r[4]) for r in pool.rows] == [("u", "light blue", 2)]
+
+
+def test_only_written_rows_are_counted() -> None:
+    class RejectingConnection:
+        async def copy_records_to_table(self, *_: Any, **__: Any) -> None:
+            raise asyncpg.NotNullViolationError("rejected")
+
+    async def connect() -> Any:
+        return RejectingConnection()
+
+    async def write() -> None:
+        writer = BatchWriter(connect)
+        await writer.add(_record("u", "blue"))
+        await writer.flush()
+
+    asyncio.run(write())
+    assert len(RollupAggregator._matches) == 0  # pylint: disable=protected-access
+
+
+def test_long_colors_are_cut_to_the_column() -> None:
+    pool = VarcharPool()
+    RollupAggregator.written([_record("u", "x" * 65)])
+    _flush(pool)
+    assert [r[3] for r in pool.rows] == ["x" * 64]